@@ -1,32 +1,24 @@
 #!/usr/bin/env python3
 
 from collections import Counter
-from typing import List
-from tqdm import tqdm
-import boto3
 import os
+import sys
 
-s3_bucket = 'tori-calculate-wind-power'
-bucket_folder = 'output_compressed'
-
-s3 = boto3.client('s3')
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.catalog import Catalog  # noqa: E402
+from common.storage import get_storage  # noqa: E402
 
+bucket_folder = 'output_compressed'
 
-def get_keys(prefix='') -> List[str]:
-    paginator = s3.get_paginator('list_objects_v2')
-    for page in tqdm(paginator.paginate(Bucket=s3_bucket, Prefix=prefix)):
-        for content in page.get('Contents', ()):
-            yield content['Key']
-
+storage = get_storage()
 
-def count_files():
-    all_keys = list(get_keys(bucket_folder))
-    print('num keys:', len(all_keys))
 
-    count = Counter()
-    for key in all_keys:
-        folder_name = key.split(bucket_folder)[1].split(os.sep)[1]
-        count[folder_name] += 1
+def count_files(refresh_catalog=False):
+    catalog = Catalog()
+    catalog.update(storage, [bucket_folder], refresh=refresh_catalog)
+    count = Counter(catalog.counts(bucket_folder))
+    catalog.close()
+    print('num keys:', sum(count.values()))
     # print('folder names:', list(count.keys()))
     print('counts:', count.items())
     target = 365
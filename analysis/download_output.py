@@ -1,45 +1,35 @@
 #!/usr/bin/env python3
-import boto3
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
 
-s3 = boto3.client('s3')
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.storage import get_storage  # noqa: E402
 
-def download_dir(prefix, local, bucket='tori-calculate-wind-power'):
+# parallel downloads, one connection of the storage client each
+num_workers = 16
+
+
+def download_dir(prefix, local, storage=None):
     """
     params:
-    - prefix: pattern to match in s3
+    - prefix: pattern to match in the storage (s3, or data/ with STORAGE=local)
     - local: local path to folder in which to place files
-    - bucket: s3 bucket with target contents
+    - storage: storage with target contents, see common/storage.py
     """
-    keys = []
-    dirs = []
-    next_token = ''
-    base_kwargs = {
-        'Bucket':bucket,
-        'Prefix':prefix,
-    }
-    while next_token is not None:
-        kwargs = base_kwargs.copy()
-        if next_token != '':
-            kwargs.update({'ContinuationToken': next_token})
-        results = s3.list_objects_v2(**kwargs)
-        contents = results.get('Contents')
-        for i in contents:
-            k = i.get('Key')
-            if k[-1] != '/':
-                keys.append(k)
-            else:
-                dirs.append(k)
-        next_token = results.get('NextContinuationToken')
-    for d in dirs:
-        dest_pathname = os.path.join(local, d)
-        if not os.path.exists(os.path.dirname(dest_pathname)):
-            os.makedirs(os.path.dirname(dest_pathname))
-    for k in keys:
+    if storage is None:
+        storage = get_storage(max_pool_connections=num_workers)
+    keys = [content['key'] for content in storage.list(prefix)
+            if content['key'][-1] != '/']
+
+    def download(k):
         dest_pathname = os.path.join(local, k)
-        if not os.path.exists(os.path.dirname(dest_pathname)):
-            os.makedirs(os.path.dirname(dest_pathname))
-        s3.download_file(bucket, k, dest_pathname)
+        os.makedirs(os.path.dirname(dest_pathname), exist_ok=True)
+        storage.download_file(k, dest_pathname)
+
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        list(pool.map(download, keys))
+
 
 if __name__ == '__main__':
     download_dir('output/', '/home/tori/wind/data')
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+from datetime import date
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.store import read_store, s3_filesystem, daily_folder, aggregated_folder  # noqa: E402
+
+s3_bucket = 'tori-calculate-wind-power'
+
+# synced with aws s3 sync s3://tori-calculate-wind-power/store_daily ../data/store_daily
+local_data_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '../data'))
+
+
+def load_aggregated(countries=None, bbox=None, local=False):
+    '''
+    per cell sums of the year, one row per country and cell
+    '''
+    if local:
+        return read_store(local_data_folder, aggregated_folder, countries, bbox=bbox)
+    return read_store(s3_bucket, aggregated_folder, countries, bbox=bbox,
+                      filesystem=s3_filesystem())
+
+
+def load_daily(countries=None, start=None, end=None, bbox=None, columns=None, local=False):
+    '''
+    per cell sums of every day, one row per country, day and cell. only
+    the countries and row groups matching the filters are read
+    '''
+    if local:
+        return read_store(local_data_folder, daily_folder, countries, start, end, bbox, columns)
+    return read_store(s3_bucket, daily_folder, countries, start, end, bbox, columns,
+                      filesystem=s3_filesystem())
+
+
+if __name__ == '__main__':
+    df = load_daily(['Germany'], start=date(2019, 1, 1), end=date(2019, 1, 31),
+                    bbox=(50., 6., 52., 10.), local=True)
+    print(df.head())
+    print(df.groupby('date')[['sed', 'power_output']].sum())
@@ -101,3 +101,5 @@ with open(os.path.join(output_folder, 'model.pkl'), 'wb') as f:
 
 with open(os.path.join(output_folder, 'poly.pkl'), 'wb') as f:
     pickle.dump(poly, f)
+
+# the lambda reads the coefficients exported by src/export_data.py, run it next
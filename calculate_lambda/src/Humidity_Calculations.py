@@ -6,10 +6,14 @@ Created on Sat Jan  8 16:07:07 2022
 """
 
 import os
-import pandas as pd
-import pickle
+import json
+import numpy as np
 import math
 
+# coefficients of the sed polynomial, exported from model.pkl / poly.pkl
+# by export_data.py, so importing this module does not need scikit-learn
+coefficients_file_path = os.path.join(os.path.dirname(__file__), 'sed_coefficients.json')
+
 
 def convert_SH_to_RH(sh, p_ambient, T_ambient):
     '''
@@ -45,34 +49,161 @@ def convert_SH_to_RH(sh, p_ambient, T_ambient):
 
     return RH
 
-with open(os.path.join(os.path.dirname(__file__), './model.pkl'), 'rb') as f:
-    model = pickle.load(f)
 
-with open(os.path.join(os.path.dirname(__file__), './poly.pkl'), 'rb') as f:
-    poly = pickle.load(f)
+def convert_SH_to_RH_array(sh, p_ambient, T_ambient, out=None, work=None):
+    '''
+    Converts specific to relative humidity for whole arrays at once.
+    Same formula as convert_SH_to_RH, but evaluated with numpy ufuncs
+    instead of one python call per sample.
+    Input: 
+        sh, p_ambient, T_ambient as numpy or xarray arrays of one shape
+        T_ambient in Kelvin
+        p_ambient in Pascals
+        out: optional preallocated array the result is written into
+        work: optional preallocated scratch array, same shape as out
+
+    Output: Relative humidity array (out, if given)
+    '''
+    # 0 Reference Point and Constants
+    T_0 = 273.15  # In [K]
+    R_d = 287.058  # Dry Air, in [J/(kg*K)]
+    R_v = 461.5  # Water Vapor, in [J/(kg*K)]
 
-def Poly_Fit_Optimized_Energy(df, T_name, phi_name, res_name):
+    with np.errstate(divide='ignore'):
+        if out is None:
+            # 1 vapor mass fraction, 2 saturation mass fraction, 3 RH
+            mass_fraction = 1/(1/sh - 1)
+            saturated_vapor_pressure = 611 * \
+                np.exp((17.67*(T_ambient - T_0)) / (T_ambient-29.65))
+            saturation_mass_fraction = (
+                saturated_vapor_pressure*R_d) / ((p_ambient-saturated_vapor_pressure)*R_v)
+            return mass_fraction/saturation_mass_fraction
+
+        sh = np.asarray(sh)
+        p_ambient = np.asarray(p_ambient)
+        T_ambient = np.asarray(T_ambient)
+        if work is None:
+            work = np.empty_like(out)
+
+        # 2.1 Clausis-Clapeyron, saturated vapor pressure into work
+        np.subtract(T_ambient, T_0, out=work)
+        np.multiply(work, 17.67, out=work)
+        np.subtract(T_ambient, 29.65, out=out)
+        np.divide(work, out, out=work)
+        np.exp(work, out=work)
+        np.multiply(work, 611, out=work)
+
+        # 2.2 saturation mass ratio into work
+        np.subtract(p_ambient, work, out=out)
+        np.multiply(out, R_v, out=out)
+        np.multiply(work, R_d, out=work)
+        np.divide(work, out, out=work)
+
+        # 1 vapor mass fraction into out
+        np.divide(1, sh, out=out)
+        np.subtract(out, 1, out=out)
+        np.divide(1, out, out=out)
+
+        # 3 Relative humidity
+        np.divide(out, work, out=out)
+
+    return out
+
+
+def load_poly_coefficients(file_path=coefficients_file_path):
+    '''
+    Loads the coefficient matrix saved by export_data.py, indexed by the
+    PolynomialFeatures powers, so coef[i, j] multiplies
+    T_amb^i * phi_amb^j. The intercept is stored in coef[0, 0].
+    '''
+    with open(file_path, 'r') as f:
+        return np.array(json.load(f)['poly_coef'], dtype=np.float64)
+
+
+poly_coef = load_poly_coefficients()
+
+
+def evaluate_poly(T_amb, phi_amb, coef=poly_coef, out=None, block_size=65536):
+    '''
+    Evaluates the polynomial surrogate directly from its coefficients,
+    without building the PolynomialFeatures matrix. Nested Horner scheme:
+    the inner loop runs over phi_amb for each power of T_amb, the outer
+    loop over T_amb. Works in blocks so the scratch memory is fixed.
+    The blocks are evaluated in float64 for float32 arrays too, the terms
+    cancel to about 1e-3 relative error in float32.
+
+    Input: T_amb in [K] and phi_amb in [%] as arrays of one shape
+           coef matrix from load_poly_coefficients
+           out: optional preallocated C contiguous float array for the result
+
+    Output: Array with the predicted energy demand (out, if given)
+    '''
+    T_amb = np.asarray(T_amb)
+    phi_amb = np.asarray(phi_amb)
+    if out is None:
+        out = np.empty(T_amb.shape, dtype=np.result_type(T_amb, coef))
+    elif not out.flags.c_contiguous:
+        # reshape(-1) would copy it, the result would not be written to out
+        raise ValueError('out must be a C contiguous array')
+    if T_amb.size == 0:
+        return out
+
+    T_flat = T_amb.reshape(-1)
+    phi_flat = phi_amb.reshape(-1)
+    out_flat = out.reshape(-1)
+
+    # highest power of phi_amb used with each power of T_amb
+    degree = coef.shape[0] - 1
+    row_degree = [int(np.nonzero(row)[0].max()) if row.any() else 0
+                  for row in coef]
+
+    size = min(block_size, T_flat.size)
+    inner = np.empty(size, dtype=np.float64)
+    block = np.empty(size, dtype=np.float64) if out.dtype != np.float64 else None
+
+    for start in range(0, T_flat.size, size):
+        stop = min(start + size, T_flat.size)
+        t = T_flat[start:stop]
+        phi = phi_flat[start:stop]
+        acc = out_flat[start:stop] if block is None else block[:stop - start]
+        b = inner[:stop - start]
+
+        for i in range(degree, -1, -1):
+            # 1 inner polynomial in phi_amb
+            b.fill(coef[i, row_degree[i]])
+            for j in range(row_degree[i] - 1, -1, -1):
+                b *= phi
+                b += coef[i, j]
+
+            # 2 outer polynomial in T_amb
+            if i == degree:
+                acc[:] = b
+            else:
+                acc *= t
+                acc += b
+
+        if block is not None:
+            out_flat[start:stop] = acc
+
+    return out
+
+
+def Poly_Fit_Optimized_Energy(df, T_name, phi_name, res_name, dtype=np.float64):
     '''
     Input: Dataframe with Ambient Temperature and Relative Humidity Column
            Column Names 
            Desired result column name
+           dtype: float type of the arrays and the result column
 
     Output: Dataframe with results column
     '''
 
     # 1 Data Preparation
-    T_amb = df[T_name]  # read out column
-    phi_amb = df[phi_name]  # read out column
-
-    X = pd.DataFrame({'T_amb': T_amb, 'phi_amb': phi_amb}
-                     )  # create dataframe for prediction
-    X['T_amb'] = X['T_amb'] + 273.15  # Convert [°C] to [K]
-    X['phi_amb'] = X['phi_amb'] * 100  # Convert to [%]
-
-    poly_features = poly.fit_transform(X)  # transform to polynomial shape
+    T_amb = df[T_name].to_numpy(dtype=dtype) + 273.15  # Convert [°C] to [K]
+    phi_amb = df[phi_name].to_numpy(dtype=dtype) * 100  # Convert to [%]
 
     # 2 Predict
-    y_pred = model.predict(poly_features)
+    y_pred = evaluate_poly(T_amb, phi_amb, out=np.empty(T_amb.shape, dtype=dtype))
 
     # 3 Write result to df
     df[res_name] = y_pred
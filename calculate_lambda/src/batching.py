@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+import os
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import lambda_memory, batch_target_seconds, batch_overhead_seconds, \
+    file_overhead_seconds, default_seconds_per_mb, memory_per_input_byte, prefetch_depth
+
+
+def estimate_seconds(files: List[str], sizes: Dict[str, int],
+                     seconds: Dict[str, float]) -> Dict[str, float]:
+    '''
+    runtime estimate of every file, the measured runtime of its last run if
+    there is one, otherwise file_overhead_seconds plus its input size times
+    the median seconds per byte of the measured files of its country, of
+    all measured files, or default_seconds_per_mb
+
+    @param sizes: Dict[str, int], input size in bytes by file
+    @param seconds: Dict[str, float], measured runtime by file
+    '''
+    rates: Dict[Optional[str], List[float]] = {}
+    for file_path, file_seconds in seconds.items():
+        if sizes.get(file_path, 0) > 0:
+            rate = max(file_seconds - file_overhead_seconds, 0) / sizes[file_path]
+            rates.setdefault(os.path.dirname(file_path), []).append(rate)
+            rates.setdefault(None, []).append(rate)
+    rates = {country_name: float(np.median(country_rates))
+             for country_name, country_rates in rates.items()}
+    default_rate = rates.get(None, default_seconds_per_mb / 1024 ** 2)
+
+    estimates = {}
+    for file_path in files:
+        if file_path in seconds:
+            estimates[file_path] = seconds[file_path]
+        else:
+            rate = rates.get(os.path.dirname(file_path), default_rate)
+            estimates[file_path] = file_overhead_seconds + rate * sizes.get(file_path, 0)
+    return estimates
+
+
+def estimate_memory(size: int) -> float:
+    return memory_per_input_byte * size
+
+
+def pack_batches(files: List[str], estimates: Dict[str, float], sizes: Dict[str, int],
+                 target_seconds: float = batch_target_seconds,
+                 memory: float = lambda_memory, depth: int = prefetch_depth,
+                 max_files: int = -1) -> List[List[str]]:
+    '''
+    packs the files into batches with best fit decreasing, so the estimated
+    runtime of a batch (plus the start up overhead) stays below
+    target_seconds and the files held in memory at once (the one computed
+    and depth prefetched) stay below memory. files that do not fit on their
+    own get a batch each
+
+    @returns batches: List[List[str]], the files of a batch in name order
+    '''
+    capacity = target_seconds - batch_overhead_seconds
+    batches: List[List[str]] = []
+    batch_seconds: List[float] = []
+    # memory of the depth + 1 largest files of each batch
+    batch_memory: List[List[float]] = []
+    # (seconds left, batch index) of the batches, sorted
+    remaining: List[Tuple[float, int]] = []
+
+    too_large = []
+    for file_path in sorted(files, key=lambda file_path: -estimates[file_path]):
+        file_seconds = estimates[file_path]
+        file_memory = estimate_memory(sizes.get(file_path, 0))
+        if file_seconds > capacity or file_memory > memory:
+            too_large.append(file_path)
+            candidates = range(0)
+        else:
+            candidates = range(bisect_left(remaining, (file_seconds, -1)), len(remaining))
+
+        # the fullest batch with time left for the file and memory to spare
+        chosen = None
+        for j in candidates:
+            i = remaining[j][1]
+            if max_files != -1 and len(batches[i]) >= max_files:
+                continue
+            largest = sorted(batch_memory[i] + [file_memory])[-(depth + 1):]
+            if sum(largest) <= memory:
+                chosen = j
+                break
+
+        if chosen is None:
+            i = len(batches)
+            batches.append([])
+            batch_seconds.append(0.)
+            batch_memory.append([])
+            largest = [file_memory]
+        else:
+            del remaining[chosen]
+
+        batches[i].append(file_path)
+        batch_seconds[i] += file_seconds
+        batch_memory[i] = largest
+        # a batch over the memory on its own does not take more files
+        if sum(largest) <= memory:
+            insort(remaining, (capacity - batch_seconds[i], i))
+
+    if len(too_large) > 0:
+        print(f'{len(too_large)} files are estimated over the target runtime or memory '
+              f'on their own, they run in a batch each, e.g.', sorted(too_large)[:10])
+
+    if len(batches) > 0:
+        print(f'packed {len(files)} files into {len(batches)} batches, estimated runtime '
+              f'per batch {min(batch_seconds) + batch_overhead_seconds:.0f}s to '
+              f'{max(batch_seconds) + batch_overhead_seconds:.0f}s')
+
+    return [sorted(batch) for batch in batches]
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+import os
+import sys
+import tempfile
+from typing import Dict, List, Optional
+
+import xarray as xr
+
+# the kernels are timed here, without the json lines of their spans
+os.environ.setdefault('METRICS_OUTPUT', 'off')
+# common/ is two folders up
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from main import compute_file, get_output_format, get_model_fingerprint, \
+    write_output  # noqa: E402
+from power import get_power, get_power_array  # noqa: E402
+from sed import get_sed, get_sed_array  # noqa: E402
+from config import compute_dtype  # noqa: E402
+from common import synthetic  # noqa: E402
+from common.benchmark import measure, case_result, report  # noqa: E402
+
+# benchmark of the calculate lambda on synthetic MERRA-2 files of a small,
+# a medium and two huge countries (common/synthetic.py): the power and sed
+# kernels of both process modes, and process_file without the s3 requests.
+# the results go to data/benchmark/calculate_<commit>.json, pass the commit
+# of an earlier run as baseline to list the cases that got slower
+
+countries = ['Andorra', 'Germany', 'United States', 'Russia']
+modes = ['dataframe', 'array']
+
+
+def process_local(file_path: str, mode: str) -> bytes:
+    '''
+    process_file without the download and upload: computes a local input
+    file and serializes the output in memory
+    '''
+    output_ds = compute_file(file_path, False, mode)
+    file_format = get_output_format()
+    get_model_fingerprint(False, mode)
+    return write_output(os.path.basename(file_path), output_ds, True, file_format)
+
+
+def benchmark_country(folder: str, country_name: str, repeats: int = 5) -> List[Dict]:
+    file_path = synthetic.write_inputs(folder, country_name)[0]
+    with xr.open_dataset(file_path) as ds:
+        ds_wind = ds.transpose('time', 'lat', 'lon').load()
+    df_main = ds_wind.to_dataframe()
+    arrays = {name: ds_wind[name].values for name in ds_wind.data_vars}
+    cells = ds_wind.sizes['lat'] * ds_wind.sizes['lon']
+    hours = ds_wind.sizes['time']
+
+    cases = [
+        ('get_power', 'dataframe', lambda df: get_power(df, False), lambda: (df_main,)),
+        # get_sed adds columns to the data frame
+        ('get_sed', 'dataframe', get_sed, lambda: (df_main.copy(),)),
+        ('get_power', 'array', get_power_array,
+         lambda: (arrays['U50M'], arrays['V50M'], arrays['PS'], arrays['T10M'])),
+        ('get_sed', 'array', get_sed_array,
+         lambda: (arrays['QV2M'], arrays['PS'], arrays['T2M'])),
+    ] + [
+        ('process_file', mode, process_local, lambda mode=mode: (file_path, mode))
+        for mode in modes
+    ]
+
+    results = []
+    for benchmark, mode, fn, setup in cases:
+        print(f'{benchmark}[{mode}] {country_name}')
+        result = case_result(benchmark, mode, country_name, cells, hours,
+                             measure(fn, setup, repeats))
+        result['dtype'] = compute_dtype
+        results.append(result)
+    return results
+
+
+def main(country_names: List[str] = countries, repeats: int = 5,
+         baseline: Optional[str] = None) -> List[Dict]:
+    '''
+    @param baseline: str, commit of the results to compare to
+    @returns regressions: List[dict], see common.benchmark.compare_results
+    '''
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        for country_name in country_names:
+            results.extend(benchmark_country(folder, country_name, repeats))
+    return report('calculate', results, baseline)
+
+
+if __name__ == '__main__':
+    main(baseline=sys.argv[1] if len(sys.argv) > 1 else None)
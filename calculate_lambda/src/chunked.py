@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+import os
+import sys
+import resource
+from glob import glob
+from time import time
+from typing import List, Tuple
+
+import numpy as np
+import xarray as xr
+import dask
+import dask.array as da
+
+# common/ is two folders up
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from power import get_power_array  # noqa: E402
+from sed import get_sed_array  # noqa: E402
+from common.summation import compensated_nansum  # noqa: E402
+from config import chunked_memory_budget, chunked_workers, chunked_bytes_per_value, \
+    chunked_group_files, compute_dtype  # noqa: E402
+
+# out-of-core mode, computes the per cell totals of many daily files (e.g.
+# the year of a country, or of the globe) on one machine. groups of files
+# are opened lazily with dask, and (time, lat, lon) chunks go through the
+# array kernels one per worker, so only the chunks in flight, one group
+# and the (lat, lon) partial sums are in memory
+
+variables = ['U50M', 'V50M', 'PS', 'T10M', 'QV2M', 'T2M']
+output_variables = ['sed', 'power_output']
+
+data_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../data'))
+country_data_folder = os.path.join(data_folder, 'World_2019', '11111')
+global_data_folder = os.path.join(data_folder, 'World_2019_global')
+output_folder = os.path.join(data_folder, 'output_chunked')
+
+
+def chunk_steps(num_cells: int, memory_budget: int = chunked_memory_budget,
+                num_workers: int = chunked_workers) -> int:
+    '''
+    time steps per chunk, so that a chunk per worker stays below the budget
+    '''
+    steps = int(memory_budget // (num_workers * num_cells * chunked_bytes_per_value))
+    if steps < 1:
+        raise ValueError(f'memory budget {memory_budget} B is too small for one time '
+                         f'step of {num_cells} cells on {num_workers} workers')
+    return steps
+
+
+def chunk_totals(u50m: np.ndarray, v50m: np.ndarray, ps: np.ndarray, t10m: np.ndarray,
+                 qv2m: np.ndarray, t2m: np.ndarray) -> np.ndarray:
+    '''
+    per cell sums of sed and power output over the time steps of a chunk,
+    same as compute_output_array in main. the partial sums are float64,
+    also in the float32 mode, since they are added over the whole year
+
+    @returns totals: np.ndarray, (1, 2, lat, lon), sed and power output
+    '''
+    time_sum = np.nansum if np.dtype(compute_dtype) == np.float64 else compensated_nansum
+    totals = np.empty((1, len(output_variables)) + u50m.shape[1:])
+    totals[0, 0] = time_sum(get_sed_array(qv2m, ps, t2m), axis=0)
+    totals[0, 1] = time_sum(get_power_array(u50m, v50m, ps, t10m), axis=0)
+    return totals
+
+
+def compute_group(file_paths: List[str], steps: int,
+                  num_workers: int = chunked_workers) -> Tuple[np.ndarray, xr.Dataset]:
+    '''
+    totals of a group of files, chunks of at most steps time steps
+
+    @returns totals: np.ndarray, (2, lat, lon), coords: xr.Dataset, lat and lon
+    '''
+    with xr.open_mfdataset(file_paths, combine='by_coords', chunks={'time': steps},
+                           data_vars='minimal', coords='minimal',
+                           compat='override') as ds_wind:
+        ds_wind = ds_wind[variables].transpose('time', 'lat', 'lon')
+        arrays = [ds_wind[name].data for name in variables]
+
+        # one block of partial sums per time chunk, summed in a tree
+        num_chunks = arrays[0].numblocks[0]
+        partial = da.map_blocks(chunk_totals, *arrays, new_axis=1, dtype=np.float64,
+                                chunks=((1,) * num_chunks, (len(output_variables),))
+                                + arrays[0].chunks[1:])
+        with dask.config.set(scheduler='threads', num_workers=num_workers):
+            totals = partial.sum(axis=0).compute()
+
+        return totals, ds_wind[['lat', 'lon']].load()
+
+
+def compute_files_chunked(file_paths: List[str], memory_budget: int = chunked_memory_budget,
+                          num_workers: int = chunked_workers,
+                          group_files: int = chunked_group_files) -> xr.Dataset:
+    '''
+    per cell totals of sed and power output over all time steps of the
+    files, which must share the (lat, lon) grid
+    '''
+    file_paths = sorted(file_paths)
+    with xr.open_dataset(file_paths[0]) as ds:
+        num_cells = ds.sizes['lat'] * ds.sizes['lon']
+    steps = chunk_steps(num_cells, memory_budget, num_workers)
+    print(f'{len(file_paths)} files, {num_cells} cells, {steps} time steps per chunk')
+
+    start_time = time()
+    totals = None
+    for i in range(0, len(file_paths), group_files):
+        group_totals, coords = compute_group(file_paths[i:i + group_files], steps, num_workers)
+        if totals is None:
+            totals = group_totals
+        else:
+            totals += group_totals
+
+    print(f'computed {len(file_paths)} files, time {time() - start_time:.1f}s')
+
+    return xr.Dataset({
+        name: (('lat', 'lon'), totals[i]) for i, name in enumerate(output_variables)
+    }, coords={
+        'lat': coords['lat'].values,
+        'lon': coords['lon'].values,
+    })
+
+
+def main(folder_name: str = 'Germany', global_grid: bool = False,
+         memory_budget: int = chunked_memory_budget, num_workers: int = chunked_workers) -> str:
+    '''
+    computes the totals of all local files of a country (or of the global
+    grid mode) and saves them as csv, same columns as output_aggregated
+
+    @returns output_file_path: str
+    '''
+    if global_grid:
+        folder_name = 'global'
+        file_paths = glob(os.path.join(global_data_folder, '*.nc4'))
+    else:
+        file_paths = glob(os.path.join(country_data_folder, folder_name, '*.nc4'))
+    if len(file_paths) == 0:
+        raise ValueError(f'no files for {folder_name}')
+
+    output_ds = compute_files_chunked(file_paths, memory_budget, num_workers)
+
+    os.makedirs(output_folder, exist_ok=True)
+    output_file_path = os.path.join(output_folder, f'{folder_name}.csv')
+    output_ds.to_dataframe()[output_variables].to_csv(output_file_path)
+
+    # ru_maxrss is in KB on linux
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f'saved {output_file_path}, peak memory {peak_memory:.0f} MB')
+
+    return output_file_path
+
+
+if __name__ == '__main__':
+    main('Germany')
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# process mode, 'dataframe' goes through Dataset.to_dataframe and a
+# groupby, 'array' keeps the (time, lat, lon) arrays and sums over time
+process_mode = os.getenv('PROCESS_MODE', 'dataframe')
+
+# read inputs from s3 into memory and write outputs from memory, without
+# files in /tmp. objects larger than in_memory_max_bytes still go to disk.
+# an object read into memory is also kept in the input cache while the
+# cache has room for it without evicting, CACHE_MAX_MB=0 keeps it off /tmp
+in_memory_io = os.getenv('IN_MEMORY_IO', 'false').lower() == 'true'
+in_memory_max_bytes = int(os.getenv('IN_MEMORY_MAX_BYTES', 256 * 1024 ** 2))
+
+# number of files lambda_handler downloads ahead of the one being computed
+# (0 downloads each file when it is computed), and the max object bytes of
+# the files ahead, downloading or done, in memory or in /tmp
+prefetch_depth = int(os.getenv('PREFETCH_DEPTH', 1))
+prefetch_max_bytes = int(os.getenv('PREFETCH_MAX_BYTES', 512 * 1024 ** 2))
+
+# inputs kept in /tmp across the invocations of a warm container (see
+# common/cache.py), the least recently used are evicted above the budget.
+# leave room for the outputs in the ephemeral storage, 0 disables it. each
+# process has a folder of its own, /tmp/cache/<pid>
+cache_max_bytes = int(os.getenv('CACHE_MAX_MB', 256)) * 1024 ** 2
+
+# format of the compressed daily outputs, 'netcdf' writes one file per day
+# to output_compressed, 'parquet' writes to the columnar store under
+# store_daily (common/store.py). the other outputs are always netcdf
+output_format = os.getenv('OUTPUT_FORMAT', 'netcdf')
+
+# float type of the power / sed kernels and the daily sums, 'float32'
+# keeps the MERRA-2 float32 data as is (half the memory and bandwidth),
+# with compensated sums over the hours. the sed polynomial is always
+# evaluated in float64 blocks, see Humidity_Calculations.evaluate_poly
+compute_dtype = os.getenv('COMPUTE_DTYPE', 'float64')
+
+# power engine, 'array' runs the model chain on flat arrays
+# (energy_calc_array), 'windpowerlib' runs wpl.ModelChain.run_model
+power_engine = os.getenv('POWER_ENGINE', 'array')
+
+# turbine / hub height sweep (main.compute_output_sweep), every turbine
+# type with every hub height in one pass over each weather file. the
+# turbine types are the ones of the windpowerlib turbine library
+sweep_turbine_types = os.getenv('SWEEP_TURBINE_TYPES', 'E-82/2300,E-101/3050').split(',')
+sweep_hub_heights = [float(hub_height) for hub_height
+                     in os.getenv('SWEEP_HUB_HEIGHTS', '78,98,108,138').split(',')]  # in [m]
+
+# sed engine, 'exact' evaluates the polynomial for every sample,
+# 'table' interpolates a precomputed (T_amb, phi_amb) grid
+sed_engine = os.getenv('SED_ENGINE', 'exact')
+
+# domain the sed polynomial was fitted on, T_amb in [K] and phi_amb in [%]
+sed_fit_T_range = (253.15, 303.15)
+sed_fit_phi_range = (0., 100.)
+
+# sed lookup table grid, samples outside of it use the exact polynomial
+sed_table_T_range = (float(os.getenv('SED_TABLE_T_MIN', sed_fit_T_range[0])),
+                     float(os.getenv('SED_TABLE_T_MAX', sed_fit_T_range[1])))
+sed_table_phi_range = (float(os.getenv('SED_TABLE_PHI_MIN', sed_fit_phi_range[0])),
+                       float(os.getenv('SED_TABLE_PHI_MAX', sed_fit_phi_range[1])))
+sed_table_T_step = float(os.getenv('SED_TABLE_T_STEP', 0.05))  # in [K]
+sed_table_phi_step = float(os.getenv('SED_TABLE_PHI_STEP', 0.05))  # in [%]
+# bound of the relative interpolation error of the table over the fitted
+# domain, building a coarser table fails (sed_table.py)
+sed_table_max_rel_error = float(os.getenv('SED_TABLE_MAX_REL_ERROR', 1e-4))
+
+# batching of files into lambda invocations in start_lambdas (batching.py).
+# a batch is planned to take batch_target_seconds, well below the lambda
+# timeout since the runtimes are estimates
+lambda_timeout = float(os.getenv('LAMBDA_TIMEOUT', 900))  # in [s]
+lambda_memory = int(os.getenv('LAMBDA_MEMORY_MB', 3008)) * 1024 ** 2  # in [B]
+batch_target_seconds = float(os.getenv('BATCH_TARGET_SECONDS', lambda_timeout / 2))
+# start up and imports of one invocation, in [s]
+batch_overhead_seconds = float(os.getenv('BATCH_OVERHEAD_SECONDS', 20))
+# runtime estimate for files without measured runtimes, a fixed time per
+# file for the s3 requests and opening the dataset, in [s], and a time
+# per MB of input, in [s/MB], used until there are measured runtimes
+file_overhead_seconds = float(os.getenv('FILE_OVERHEAD_SECONDS', 0.5))
+default_seconds_per_mb = float(os.getenv('DEFAULT_SECONDS_PER_MB', 0.1))
+# memory used while computing a file, in bytes per byte of input
+memory_per_input_byte = float(os.getenv('MEMORY_PER_INPUT_BYTE', 16))
+
+# out-of-core mode (chunked.py), streams time chunks of many files
+# through the array kernels. the chunks in flight (one per worker) are
+# sized to stay below the budget, peak memory does not grow with the
+# number of files
+chunked_memory_budget = int(os.getenv('CHUNKED_MEMORY_MB', 1024)) * 1024 ** 2  # in [B]
+chunked_workers = int(os.getenv('CHUNKED_WORKERS', os.cpu_count() or 1))
+# memory per (time, lat, lon) sample of a chunk, the float32 inputs plus
+# the float64 temporaries of the power and sed kernels, in [B]
+chunked_bytes_per_value = float(os.getenv('CHUNKED_BYTES_PER_VALUE', 128))
+# files opened together, the files of a group and their task graph are
+# held in memory, the groups are summed one after the other
+chunked_group_files = int(os.getenv('CHUNKED_GROUP_FILES', 16))
@@ -1,5 +1,9 @@
 #!/usr/bin/env python3
-import windpowerlib as wpl
+import os
+from functools import lru_cache
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+import numpy as np
 import pandas as pd
 
 # 0.15 roughness length
@@ -10,7 +14,6 @@ enercon_e82 = {
     #^to find turbine data
     "hub_height": 138 #78-138,  # in m
 }
-e82 = wpl.WindTurbine(**enercon_e82)
 
 modelchain_data = {
     "wind_speed_model": "logarithmic",  # 'logarithmic' (default),
@@ -25,11 +28,239 @@ modelchain_data = {
     "density_correction": True,  # False (default) or True
 }  # None (default) or None
 
-mc_e82 = wpl.ModelChain(e82, **modelchain_data)
+# ModelChain defaults, in [m] and unused by the logarithmic wind profile
+obstacle_height = 0
+hellman_exp = None
+
+# gas constant of dry air used by windpowerlib, in [J/(kg*K)]
+R_d = 287.058
+# temperature gradient used by windpowerlib, in [K/m]
+temperature_gradient = 0.0065
+
+# power coefficient curves of the turbines used here, exported from the
+# windpowerlib turbine library by export_data.py. importing windpowerlib
+# and parsing its library takes longer than the lambda needs for a file
+turbine_curves_file_path = os.path.join(os.path.dirname(__file__), 'turbine_curves.npz')
+
+
+class Turbine(NamedTuple):
+    '''
+    the parts of a wpl.WindTurbine the array engine uses
+    '''
+    turbine_type: str
+    hub_height: float
+    nominal_power: float
+    rotor_diameter: float
+    # 'wind_speed' in m/s and 'value', the power coefficient
+    power_coefficient_curve: Dict[str, np.ndarray]
+
+
+@lru_cache(maxsize=None)
+def load_turbine_curves(file_path: str = turbine_curves_file_path) -> Dict[str, dict]:
+    '''
+    @returns turbines: Dict[str, dict], nominal power, rotor diameter and
+             power coefficient curve by turbine type, empty if the file
+             is missing
+    '''
+    if not os.path.exists(file_path):
+        return {}
+    turbines = {}
+    with np.load(file_path) as data:
+        for turbine_type in data['turbine_types']:
+            prefix = f'{turbine_type}/'
+            nominal_power, rotor_diameter = data[prefix + 'specs']
+            turbines[str(turbine_type)] = {
+                'nominal_power': float(nominal_power),
+                'rotor_diameter': float(rotor_diameter),
+                'power_coefficient_curve': {
+                    'wind_speed': data[prefix + 'wind_speed'],
+                    'value': data[prefix + 'value'],
+                },
+            }
+    return turbines
+
+
+@lru_cache(maxsize=None)
+def get_turbine(turbine_type: str, hub_height: float) -> Turbine:
+    '''
+    turbine from turbine_curves.npz, or from the windpowerlib turbine
+    library for turbine types that are not bundled, see enercon_e82
+    '''
+    turbines = load_turbine_curves()
+    if turbine_type in turbines:
+        return Turbine(turbine_type, hub_height, **turbines[turbine_type])
+
+    import windpowerlib as wpl
+    turbine = wpl.WindTurbine(turbine_type=turbine_type, hub_height=hub_height)
+    if turbine.power_coefficient_curve is None:
+        raise ValueError(f'{turbine_type} has no power coefficient curve')
+    curve = turbine.power_coefficient_curve
+    return Turbine(turbine_type, hub_height, turbine.nominal_power, turbine.rotor_diameter, {
+        'wind_speed': curve['wind_speed'].to_numpy(),
+        'value': curve['value'].to_numpy(),
+    })
+
+
+e82 = get_turbine(**enercon_e82)
+
+
+@lru_cache(maxsize=None)
+def get_modelchain():
+    '''
+    windpowerlib model chain of the E-82 with modelchain_data, only built
+    for the 'windpowerlib' power engine
+    '''
+    import windpowerlib as wpl
+    return wpl.ModelChain(wpl.WindTurbine(**enercon_e82), **modelchain_data)
+
 
 def energy_calc(weather_df) -> pd.Series:
-    model_data = mc_e82.run_model(weather_df)
+    model_data = get_modelchain().run_model(weather_df)
 
     power_output = model_data.power_output
 
     return power_output
+
+
+def check_modelchain(modelchain: dict) -> None:
+    '''
+    energy_calc_array only implements the model chain configured in
+    modelchain_data, make sure it is not silently used with another one
+    '''
+    if modelchain['wind_speed_model'] != 'logarithmic' \
+            or modelchain['density_model'] != 'ideal_gas' \
+            or modelchain['temperature_model'] != 'linear_gradient' \
+            or modelchain['power_output_model'] != 'power_coefficient_curve':
+        raise ValueError(
+            'energy_calc_array only supports the logarithmic / ideal_gas / '
+            'linear_gradient / power_coefficient_curve model chain')
+
+
+check_modelchain(modelchain_data)
+
+
+def hub_height_terms(wind_speed: np.ndarray, pressure: np.ndarray,
+                     temperature: np.ndarray, roughness_length, hub_height: float,
+                     wind_speed_height: float = 50, pressure_height: float = 0,
+                     temperature_height: float = 10,
+                     obstacle_height: float = obstacle_height,
+                     dtype=np.float64) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    wind speed and air density at the hub height, shared by all turbines
+    with that hub height
+
+    @returns hub_wind_speed: np.ndarray in m/s, density: np.ndarray in kg/m^3
+    '''
+    obstacle_height = 0.7 * obstacle_height
+
+    wind_speed = np.asarray(wind_speed, dtype=dtype)
+    pressure = np.asarray(pressure, dtype=dtype)
+    temperature = np.asarray(temperature, dtype=dtype)
+    hub_wind_speed = np.empty(wind_speed.shape, dtype=dtype)
+
+    # 1 wind speed at hub height, logarithmic wind profile
+    np.multiply(wind_speed, np.log((hub_height - obstacle_height) / roughness_length),
+                out=hub_wind_speed)
+    np.divide(hub_wind_speed, np.log((wind_speed_height - obstacle_height) / roughness_length),
+              out=hub_wind_speed)
+
+    # 2 temperature at hub height, linear gradient
+    work = np.subtract(temperature,
+                       temperature_gradient * (hub_height - temperature_height))
+
+    # 3 density at hub height, ideal gas
+    np.multiply(work, R_d, out=work)
+    density = pressure / 100 - (hub_height - pressure_height) * 1 / 8
+    density *= 100
+    np.divide(density, work, out=density)
+
+    return hub_wind_speed, density
+
+
+def turbine_power(hub_wind_speed: np.ndarray, density: np.ndarray,
+                  turbine: Turbine, out: np.ndarray = None) -> np.ndarray:
+    '''
+    power output of the turbine from the terms at its hub height (see
+    hub_height_terms), power coefficient curve
+
+    @param out: np.ndarray, optional preallocated output
+    @returns power_output: np.ndarray in W
+    '''
+    if out is None:
+        out = np.empty(hub_wind_speed.shape, dtype=hub_wind_speed.dtype)
+
+    # 4 power output, power coefficient curve
+    curve = turbine.power_coefficient_curve
+    power_coefficient = np.interp(hub_wind_speed, curve['wind_speed'], curve['value'],
+                                  left=0, right=0)
+    np.multiply(density, 1 / 8, out=out)
+    out *= turbine.rotor_diameter ** 2
+    out *= np.pi
+    out *= np.power(hub_wind_speed, 3)
+    out *= power_coefficient
+
+    return out
+
+
+def energy_calc_array(wind_speed: np.ndarray, pressure: np.ndarray,
+                      temperature: np.ndarray, roughness_length,
+                      wind_speed_height: float = 50, pressure_height: float = 0,
+                      temperature_height: float = 10,
+                      turbine: Turbine = e82,
+                      out: np.ndarray = None, dtype=np.float64) -> np.ndarray:
+    '''
+    same calculation as energy_calc (ModelChain.run_model with
+    modelchain_data), done directly on flat float arrays instead of
+    a MultiIndex DataFrame
+
+    the heights are the ones run_model would select as closest to the
+    hub height from the weather data built in power.get_power.
+    density_correction only applies to the 'power_curve' model in
+    windpowerlib, the power coefficient curve uses the density directly
+
+    @param wind_speed: np.ndarray in m/s at wind_speed_height
+    @param pressure: np.ndarray in Pa at pressure_height
+    @param temperature: np.ndarray in K at temperature_height
+    @param roughness_length: float or np.ndarray in m
+    @param turbine: Turbine, see get_turbine
+    @param out: np.ndarray, optional preallocated output
+    @param dtype: float type of the calculation and the output
+    @returns power_output: np.ndarray in W
+    '''
+    hub_wind_speed, density = hub_height_terms(
+        wind_speed, pressure, temperature, roughness_length, turbine.hub_height,
+        wind_speed_height, pressure_height, temperature_height,
+        obstacle_height, dtype)
+    return turbine_power(hub_wind_speed, density, turbine, out=out)
+
+
+def energy_calc_sweep(wind_speed: np.ndarray, pressure: np.ndarray,
+                      temperature: np.ndarray, roughness_length,
+                      turbines: List[Tuple[str, float]],
+                      wind_speed_height: float = 50, pressure_height: float = 0,
+                      temperature_height: float = 10,
+                      dtype=np.float64) -> Iterator[Tuple[int, np.ndarray]]:
+    '''
+    power output of every (turbine type, hub height) from one read of the
+    weather data. the wind profile, temperature and density are computed
+    once per hub height, only the power coefficient curve per turbine
+
+    @param turbines: List[Tuple[str, float]], turbine type and hub height
+    @returns power_outputs: Iterator[Tuple[int, np.ndarray]], index into
+             turbines and power output in W. the array is reused for the
+             next turbine, reduce or copy it before the next one
+    '''
+    by_height: Dict[float, List[int]] = {}
+    for i, (_turbine_type, hub_height) in enumerate(turbines):
+        by_height.setdefault(float(hub_height), []).append(i)
+
+    out = None
+    for hub_height, indices in by_height.items():
+        hub_wind_speed, density = hub_height_terms(
+            wind_speed, pressure, temperature, roughness_length, hub_height,
+            wind_speed_height, pressure_height, temperature_height,
+            obstacle_height, dtype)
+        for i in indices:
+            turbine = get_turbine(turbines[i][0], hub_height)
+            out = turbine_power(hub_wind_speed, density, turbine, out=out)
+            yield i, out
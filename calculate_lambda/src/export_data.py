@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+import json
+import os
+import pickle
+from typing import List
+
+import numpy as np
+
+from config import sweep_turbine_types
+from energy_calc_func import enercon_e82, turbine_curves_file_path
+
+# exports the sed model and the turbine curves to the small files loaded
+# at import, so a cold start does not unpickle the scikit-learn model
+# (model.pkl, poly.pkl) or import windpowerlib and parse its turbine
+# library. run in an environment with scikit-learn and windpowerlib after
+# generate_model.py, or to bundle more turbine types
+
+src_folder = os.path.dirname(os.path.abspath(__file__))
+# Humidity_Calculations.coefficients_file_path, the module loads the file
+# at import, so it can not be imported before the file exists
+coefficients_file_path = os.path.join(src_folder, 'sed_coefficients.json')
+
+
+def get_poly_coefficients(model, poly) -> np.ndarray:
+    '''
+    Rearranges the fitted LinearRegression coefficients into a matrix
+    indexed by the PolynomialFeatures powers, so coef[i, j] multiplies
+    T_amb^i * phi_amb^j. The intercept is stored in coef[0, 0].
+    '''
+    powers = poly.powers_
+    degree = int(powers.sum(axis=1).max())
+    coef = np.zeros((degree + 1, degree + 1))
+    np.add.at(coef, (powers[:, 0], powers[:, 1]), np.ravel(model.coef_))
+    coef[0, 0] += float(np.ravel(model.intercept_)[0])
+    return coef
+
+
+def export_sed_coefficients(file_path: str = coefficients_file_path) -> np.ndarray:
+    with open(os.path.join(src_folder, 'model.pkl'), 'rb') as f:
+        model = pickle.load(f)
+    with open(os.path.join(src_folder, 'poly.pkl'), 'rb') as f:
+        poly = pickle.load(f)
+
+    coef = get_poly_coefficients(model, poly)
+    # json floats round trip exactly, the coefficients stay bit for bit
+    with open(file_path, 'w') as f:
+        json.dump({'poly_coef': coef.tolist()}, f)
+    print('saved', file_path)
+
+    return coef
+
+
+def export_turbine_curves(turbine_types: List[str],
+                          file_path: str = turbine_curves_file_path) -> None:
+    '''
+    saves the nominal power, rotor diameter and power coefficient curve
+    of the turbine types, see energy_calc_func.load_turbine_curves
+    '''
+    import windpowerlib as wpl
+
+    arrays = {'turbine_types': np.array(turbine_types)}
+    for turbine_type in turbine_types:
+        # the curve and specs do not depend on the hub height
+        turbine = wpl.WindTurbine(turbine_type=turbine_type, hub_height=100)
+        curve = turbine.power_coefficient_curve
+        if curve is None:
+            raise ValueError(f'{turbine_type} has no power coefficient curve')
+        arrays[f'{turbine_type}/specs'] = np.array(
+            [turbine.nominal_power, turbine.rotor_diameter], dtype=np.float64)
+        arrays[f'{turbine_type}/wind_speed'] = curve['wind_speed'].to_numpy(dtype=np.float64)
+        arrays[f'{turbine_type}/value'] = curve['value'].to_numpy(dtype=np.float64)
+
+    np.savez_compressed(file_path, **arrays)
+    print(f'saved {file_path}, {len(turbine_types)} turbines from windpowerlib {wpl.__version__}')
+
+
+def main(turbine_types: List[str] = sweep_turbine_types) -> None:
+    export_sed_coefficients()
+    export_turbine_curves(sorted({enercon_e82['turbine_type'], *turbine_types}))
+
+
+if __name__ == '__main__':
+    main()
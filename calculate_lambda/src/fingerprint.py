@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+import ast
+import json
+import hashlib
+import inspect
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import Humidity_Calculations as HC
+import energy_calc_func
+import power
+import sed
+from common import summation
+from config import power_engine, sed_engine, compute_dtype, \
+    sed_table_T_range, sed_table_phi_range, \
+    sed_table_T_step, sed_table_phi_step
+
+# components of an output fingerprint, saved as s3 metadata of the output
+components = ['input', 'turbine', 'sed', 'code']
+# settings the lambda computed an output with, saved next to the components
+settings = ['mode', 'dtype', 'power_engine', 'sed_engine']
+
+# modules of the numeric kernels. the code component hashes their syntax
+# trees, so an edit of their code recomputes the outputs, while comment
+# and docstring edits do not
+kernel_modules = [energy_calc_func, power, sed, HC, summation]
+
+# bump it by hand with a change outside of the kernel modules that alters
+# the outputs, e.g. the group by or the columns of main
+model_version = 1
+
+
+def hash_values(*values) -> str:
+    '''
+    short sha256 of json / numpy values
+    '''
+    sha = hashlib.sha256()
+    for value in values:
+        if isinstance(value, np.ndarray):
+            sha.update(np.ascontiguousarray(value, dtype=np.float64).tobytes())
+        else:
+            sha.update(json.dumps(value, sort_keys=True, default=str).encode())
+    return sha.hexdigest()[:16]
+
+
+def input_fingerprint(etag: str, size: int) -> str:
+    return hash_values(etag.strip('"'), int(size))
+
+
+def turbine_fingerprint(engine: str = power_engine,
+                        turbines: Optional[List[Tuple[str, float]]] = None) -> str:
+    '''
+    turbine, model chain and roughness length used for the power output,
+    or the turbines and hub heights of a sweep
+    '''
+    if turbines is not None:
+        curves = []
+        for turbine_type, hub_height in turbines:
+            curve = energy_calc_func.get_turbine(turbine_type, hub_height) \
+                .power_coefficient_curve
+            curves += [np.asarray(curve['wind_speed']), np.asarray(curve['value'])]
+        return hash_values([list(config) for config in turbines],
+                           energy_calc_func.modelchain_data, power.roughness_length, *curves)
+    turbine = energy_calc_func.e82
+    curve = turbine.power_coefficient_curve
+    return hash_values(energy_calc_func.enercon_e82, energy_calc_func.modelchain_data,
+                       turbine.rotor_diameter, turbine.nominal_power,
+                       energy_calc_func.obstacle_height, energy_calc_func.hellman_exp,
+                       power.roughness_length, engine,
+                       np.asarray(curve['wind_speed']), np.asarray(curve['value']))
+
+
+def sed_fingerprint(engine: str = sed_engine) -> str:
+    '''
+    sed model coefficients, plus the lookup table grid for the table engine
+    '''
+    values = [HC.poly_coef, engine]
+    if engine == 'table':
+        values += [sed_table_T_range, sed_table_phi_range,
+                   sed_table_T_step, sed_table_phi_step]
+    return hash_values(*values)
+
+
+def syntax_values(node):
+    '''
+    json values of a syntax tree, without the empty fields, which the
+    ast.dump of different python versions shows differently
+    '''
+    if isinstance(node, ast.AST):
+        return [type(node).__name__] + [
+            [name, syntax_values(value)] for name, value in ast.iter_fields(node)
+            if value is not None and not (isinstance(value, list) and len(value) == 0)]
+    if isinstance(node, list):
+        return [syntax_values(item) for item in node]
+    return repr(node)
+
+
+def source_fingerprint(source: str) -> str:
+    '''
+    hash of the syntax tree of python source, without its comments and
+    docstrings
+    '''
+    tree = ast.parse(source)
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)) \
+                and len(node.body) > 0 and isinstance(node.body[0], ast.Expr) \
+                and isinstance(node.body[0].value, ast.Constant) \
+                and isinstance(node.body[0].value.value, str):
+            node.body = node.body[1:]
+    return hash_values(syntax_values(tree))
+
+
+def code_fingerprint(mode: str, output_all_columns: bool,
+                     dtype: str = compute_dtype) -> str:
+    '''
+    kernel modules, model version and the settings of the compute code
+    '''
+    kernels = [source_fingerprint(inspect.getsource(module)) for module in kernel_modules]
+    return hash_values(kernels, model_version, mode, output_all_columns, dtype)
+
+
+def model_fingerprint(mode: str, output_all_columns: bool,
+                      turbines: Optional[List[Tuple[str, float]]] = None,
+                      dtype: str = compute_dtype, power_engine: str = power_engine,
+                      sed_engine: str = sed_engine) -> Dict[str, str]:
+    '''
+    fingerprint components that do not depend on the input file, plus the
+    settings they are computed from. the defaults are the local config, a
+    lambda with another environment computes other outputs
+    '''
+    return {
+        'turbine': turbine_fingerprint(power_engine, turbines),
+        'sed': sed_fingerprint(sed_engine),
+        'code': code_fingerprint(mode, output_all_columns, dtype),
+        'mode': mode,
+        'dtype': dtype,
+        'power_engine': power_engine,
+        'sed_engine': sed_engine
+    }
+
+
+def output_metadata(model: Dict[str, str], etag: str, size: int) -> Dict[str, str]:
+    '''
+    s3 metadata of an output, the components and settings plus the
+    combined fingerprint
+    '''
+    metadata = {**model, 'input': input_fingerprint(etag, size)}
+    metadata['fingerprint'] = hash_values(
+        [metadata[component] for component in components])
+    return metadata
+
+
+def changed_components(expected: Dict[str, str], metadata: Dict[str, str]) -> List[str]:
+    '''
+    components of an existing output that differ from the expected ones,
+    all of them if the output has no fingerprint
+    '''
+    if 'fingerprint' not in metadata:
+        return list(components)
+    if metadata['fingerprint'] == expected['fingerprint']:
+        return []
+    return [component for component in components
+            if metadata.get(component) != expected[component]]
@@ -1,26 +1,56 @@
 #!/usr/bin/env python3
 import os
 import json
+import sys
+import struct
+import shutil
 from time import time
 import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
 
+import numpy as np
 import xarray as xr
-import boto3
 
 from dotenv import load_dotenv
 
-from power import get_power
-from sed import get_sed
+# common/ is next to main.py in the image, two folders up locally
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from power import get_power, get_wind_speed, get_power_wind_speed, get_power_sweep_wind_speed
+from sed import get_sed, get_sed_array
+from fingerprint import model_fingerprint, output_metadata
+from config import process_mode, in_memory_io, in_memory_max_bytes, \
+    prefetch_depth, prefetch_max_bytes, output_format, compute_dtype, \
+    sweep_turbine_types, sweep_hub_heights, cache_max_bytes
+from common.summation import compensated_nansum
+from common.cache import ObjectCache, process_folder
+from common.storage import get_storage, NotModified
+from common.catalog import event_key
+from common import metrics
 
 load_dotenv()
 
-s3 = boto3.client('s3')
+# the bucket, or data/ with STORAGE=local (common/storage.py)
+storage = get_storage()
 
-s3_bucket = 'tori-calculate-wind-power'
+tmp_folder = '/tmp'
+
+# chunk size for streaming inputs to /tmp
+copy_buffer_size = 1024 ** 2
 
 input_bucket_folder = 'World_2019'
+# global grid mode, one global MERRA file per day instead of one per
+# country and day. the reduce lambda splits the sums into countries
+input_global = 'World_2019_global'
+output_global = 'output_global'
 output_main = 'output'
 output_compressed = 'output_compressed'
+# turbine / hub height sweep, power output with a config dimension
+output_sweep = 'output_sweep'
+
+# inputs downloaded by earlier invocations of this container
+input_cache = ObjectCache(process_folder(os.path.join(tmp_folder, 'cache')), cache_max_bytes)
 
 
 def combine_dict(dict_1: dict, dict_2: dict) -> dict:
@@ -30,75 +60,578 @@ def combine_dict(dict_1: dict, dict_2: dict) -> dict:
     return output
 
 
-def process_file(file_path, output_all_columns=False) -> None:
-    input_file_path = os.path.join('/tmp', os.path.basename(file_path))
+def input_key(file_path: str, global_grid: bool = False) -> str:
+    input_folder = input_global if global_grid else input_bucket_folder
+    return os.path.join(input_folder, file_path)
 
-    remote_input_file_path = os.path.join(input_bucket_folder, file_path)
-    s3.download_file(s3_bucket, remote_input_file_path, input_file_path)
 
-    # first read the MERRA data
+def download_input(file_path: str, in_memory: bool = in_memory_io,
+                   global_grid: bool = False) -> Tuple[Union[str, bytes], Dict]:
+    '''
+    fetches the MERRA file. returns its bytes if in_memory is set and the
+    object is not larger than in_memory_max_bytes, otherwise downloads it
+    to the cache in /tmp and returns the path, pinned until remove_input.
+    also returns the etag and size of the object that was read, for the
+    output fingerprint
 
-    start_time = time()
-    with xr.open_mfdataset(input_file_path, combine='by_coords') as ds_wind:
-        df_main = ds_wind.to_dataframe()
+    a file cached by an earlier invocation is only used if it is still
+    the current version, the conditional get does not send the data then.
+    with local storage the file is read in place
+    '''
+    with metrics.span('download', **metrics.file_fields(file_path)) as record:
+        remote_input_file_path = input_key(file_path, global_grid)
+
+        local_path = storage.local_path(remote_input_file_path)
+        if local_path is not None:
+            info = storage.head(remote_input_file_path)
+            record.update(source='local', bytes=info['size'])
+            return local_path, {'etag': info['etag'], 'size': info['size']}
+
+        cached = input_cache.get(remote_input_file_path, pin=True)
+        try:
+            # one get for the etag and the data, so both belong to one version
+            response = storage.get(remote_input_file_path,
+                                   if_none_match=cached['etag'] if cached is not None else None)
+        except NotModified:
+            response = None
+        except Exception:
+            if cached is not None:
+                input_cache.release(cached['path'])
+            raise
+
+        if response is None:
+            input_cache.record(True, cached['size'])
+            record.update(source='cache', bytes=cached['size'])
+            input_object = {'etag': cached['etag'], 'size': cached['size']}
+            if in_memory and cached['size'] <= in_memory_max_bytes:
+                try:
+                    with open(cached['path'], 'rb') as f:
+                        return f.read(), input_object
+                finally:
+                    input_cache.release(cached['path'])
+            return cached['path'], input_object
+        if cached is not None:
+            input_cache.release(cached['path'])
+
+        input_cache.record(False)
+        record.update(source='storage', bytes=response['size'])
+        input_object = {'etag': response['etag'], 'size': response['size']}
+        if in_memory and response['size'] <= in_memory_max_bytes:
+            input_data = response['body'].read()
+            input_cache.put_bytes(remote_input_file_path, input_data, response['etag'])
+            return input_data, input_object
+
+        part_path = input_cache.part_path()
+        try:
+            with open(part_path, 'wb') as f:
+                shutil.copyfileobj(response['body'], f, copy_buffer_size)
+        except Exception:
+            os.remove(part_path)
+            raise
+        entry = input_cache.put(remote_input_file_path, part_path, response['etag'], pin=True)
+        return entry['path'], input_object
 
-    print('time open df', time() - start_time)
-    print('df size', len(df_main))
+
+def open_input(input_data: Union[str, bytes]) -> xr.Dataset:
+    '''
+    opens the MERRA file from a path or from the bytes in memory
+    '''
+    if isinstance(input_data, bytes):
+        import netCDF4
+        nc = netCDF4.Dataset('input.nc4', mode='r', memory=input_data)
+        return xr.open_dataset(xr.backends.NetCDF4DataStore(nc))
+    return xr.open_dataset(input_data)
+
+
+def hdf5_image_size(buffer: memoryview) -> int:
+    '''
+    size of the hdf5 file image in buffer, read from the end of file
+    address in the superblock. the in-memory netcdf4 file is allocated
+    in 64KB increments, the rest of the buffer is unused
+    '''
+    # end of file address offset for superblock versions 0, 1 and 2+
+    offset = {0: 40, 1: 44}.get(buffer[8], 28)
+    size = struct.unpack_from('<Q', buffer, offset)[0]
+    return size if 0 < size <= len(buffer) else len(buffer)
+
+
+def dataset_to_bytes(ds: xr.Dataset) -> bytes:
+    '''
+    serializes the dataset to netcdf4 in memory, same format as to_netcdf
+    '''
+    import netCDF4
+    nc = netCDF4.Dataset('output.nc4', mode='w', memory=2 ** 16)
+    ds.dump_to_store(xr.backends.NetCDF4DataStore(nc))
+    buffer = nc.close()
+    return buffer[:hdf5_image_size(buffer)].tobytes()
+
+
+def compute_output_dataframe(ds_wind: xr.Dataset, output_all_columns: bool = False,
+                             dtype: str = compute_dtype) -> xr.Dataset:
+    '''
+    per cell sums of sed and power output, going through a data frame
+    indexed by (time, lat, lon). the groupby sum of pandas is compensated
+    '''
+    with metrics.span('open') as record:
+        df_main = ds_wind.to_dataframe()
+        record['cells_hours'] = len(df_main)
+    metrics.update(cells_hours=len(df_main))
 
     # get data
-    output_df = get_power(df_main, output_all_columns)
-    start_time = time()
-    sed_df = get_sed(df_main)
-    print('time calculate sed', time() - start_time)
+    output_df = get_power(df_main, output_all_columns, dtype=dtype)
+    with metrics.span('sed'):
+        sed_df = get_sed(df_main, dtype=dtype)
 
     output_df['sed'] = sed_df['sed']
-    output_df = output_df.groupby(['lat', 'lon'])[
-        ['sed', 'power_output']].sum()
+    with metrics.span('group_by'):
+        output_df = output_df.groupby(['lat', 'lon'])[
+            ['sed', 'power_output']].sum()
+
+    print(output_df.head())
+    print(output_df.shape)
+
+    return xr.Dataset.from_dataframe(output_df)
+
+
+def open_arrays(ds_wind: xr.Dataset) -> xr.Dataset:
+    '''
+    reads the variables of the array kernels as (time, lat, lon) arrays
+    '''
+    with metrics.span('open') as record:
+        ds_wind = ds_wind[['U50M', 'V50M', 'PS', 'T10M', 'QV2M', 'T2M']] \
+            .transpose('time', 'lat', 'lon').load()
+        record['cells_hours'] = metrics.cells_hours(ds_wind['U50M'].shape)
+    metrics.update(cells_hours=record['cells_hours'])
+    return ds_wind
+
+
+def compute_output_array(ds_wind: xr.Dataset, dtype: str = compute_dtype) -> xr.Dataset:
+    '''
+    per cell sums of sed and power output, keeping the data as
+    (time, lat, lon) arrays and summing over the time axis, compensated
+    for float32
+    '''
+    ds_wind = open_arrays(ds_wind)
+
+    # get data
+    with metrics.span('wind'):
+        wind_speed = get_wind_speed(ds_wind['U50M'].values, ds_wind['V50M'].values, dtype)
+    with metrics.span('power'):
+        power_output = get_power_wind_speed(wind_speed, ds_wind['PS'].values,
+                                            ds_wind['T10M'].values, dtype=dtype)
+
+    with metrics.span('sed'):
+        sed = get_sed_array(ds_wind['QV2M'].values, ds_wind['PS'].values,
+                            ds_wind['T2M'].values, dtype=dtype)
+
+    time_sum = np.nansum if np.dtype(dtype) == np.float64 else compensated_nansum
+    # the sums over the hours of every cell
+    with metrics.span('group_by'):
+        sums = {'sed': time_sum(sed, axis=0), 'power_output': time_sum(power_output, axis=0)}
+    output_ds = xr.Dataset({
+        'sed': (('lat', 'lon'), sums['sed']),
+        'power_output': (('lat', 'lon'), sums['power_output']),
+    }, coords={
+        'lat': ds_wind['lat'].values,
+        'lon': ds_wind['lon'].values,
+    })
+    print(output_ds.sizes)
+
+    return output_ds
+
+
+def sweep_configs(turbine_types: List[str] = sweep_turbine_types,
+                  hub_heights: List[float] = sweep_hub_heights) -> List[Tuple[str, float]]:
+    '''
+    every turbine type with every hub height
+    '''
+    return [(turbine_type, float(hub_height))
+            for turbine_type in turbine_types for hub_height in hub_heights]
+
+
+def compute_output_sweep(ds_wind: xr.Dataset, turbines: List[Tuple[str, float]],
+                         dtype: str = compute_dtype) -> xr.Dataset:
+    '''
+    per cell sums like compute_output_array, with the power output of
+    every (turbine type, hub height) along a config dimension. the weather
+    data is read once, the sed does not depend on the turbine
+    '''
+    ds_wind = open_arrays(ds_wind)
+
+    time_sum = np.nansum if np.dtype(dtype) == np.float64 else compensated_nansum
+
+    # get data
+    with metrics.span('wind'):
+        wind_speed = get_wind_speed(ds_wind['U50M'].values, ds_wind['V50M'].values, dtype)
+    # the sums over the hours are part of the power span, one config at a time
+    with metrics.span('power', configs=len(turbines)):
+        power_output = np.empty((len(turbines), ds_wind.sizes['lat'], ds_wind.sizes['lon']),
+                                dtype=dtype)
+        for i, config_power_output in get_power_sweep_wind_speed(
+                wind_speed, ds_wind['PS'].values, ds_wind['T10M'].values, turbines, dtype):
+            power_output[i] = time_sum(config_power_output, axis=0)
+
+    with metrics.span('sed'):
+        sed = get_sed_array(ds_wind['QV2M'].values, ds_wind['PS'].values,
+                            ds_wind['T2M'].values, dtype=dtype)
+
+    with metrics.span('group_by'):
+        sed_sum = time_sum(sed, axis=0)
+    output_ds = xr.Dataset({
+        'sed': (('lat', 'lon'), sed_sum),
+        'power_output': (('config', 'lat', 'lon'), power_output),
+    }, coords={
+        'config': np.arange(len(turbines)),
+        'turbine_type': ('config', [turbine_type for turbine_type, _ in turbines]),
+        'hub_height': ('config', [hub_height for _, hub_height in turbines]),
+        'lat': ds_wind['lat'].values,
+        'lon': ds_wind['lon'].values,
+    })
+    print(output_ds.sizes)
+
+    return output_ds
+
+
+def compute_file(input_data: Union[str, bytes], output_all_columns: bool = False,
+                 mode: str = process_mode, dtype: str = compute_dtype,
+                 turbines: Optional[List[Tuple[str, float]]] = None) -> xr.Dataset:
+    '''
+    @param turbines: List[Tuple[str, float]], (turbine type, hub height)
+                     of a sweep (array mode only), None for the E-82
+    '''
+    # first read the MERRA data
+    with open_input(input_data) as ds_wind:
+        if turbines is not None:
+            return compute_output_sweep(ds_wind, turbines, dtype)
+        if mode == 'array':
+            return compute_output_array(ds_wind, dtype)
+        elif mode == 'dataframe':
+            return compute_output_dataframe(ds_wind, output_all_columns, dtype)
+        raise ValueError(f'invalid process mode {mode}')
+
+
+def get_output_format(output_all_columns: bool = False, global_grid: bool = False,
+                      file_format: str = output_format, sweep: bool = False) -> str:
+    '''
+    only the compressed per country outputs go to the parquet store
+    '''
+    if file_format not in ('netcdf', 'parquet'):
+        raise ValueError(f'invalid output format {file_format}')
+    if output_all_columns or global_grid or sweep:
+        return 'netcdf'
+    return file_format
 
-    output_file_path = input_file_path
+
+def write_output(file_path: str, output_ds: xr.Dataset,
+                 in_memory: bool = in_memory_io,
+                 file_format: str = 'netcdf') -> Union[str, bytes]:
+    '''
+    serializes the output, to bytes if in_memory is set, otherwise to
+    a file in /tmp. returns the bytes or the path
+    '''
+    if file_format == 'parquet':
+        from common import store
+        table = store.dataset_to_table(output_ds, store.file_date(file_path))
+        if in_memory:
+            return store.write_table(table)
+    elif in_memory:
+        return dataset_to_bytes(output_ds)
+
+    output_file_path = os.path.join(tmp_folder, 'output', file_path)
     output_directory = os.path.dirname(output_file_path)
     if not os.path.exists(output_directory):
         os.makedirs(output_directory)
 
-    print(output_df.head())
-    print(output_df.shape)
-    xr.Dataset.from_dataframe(output_df).to_netcdf(path=output_file_path)
+    if file_format == 'parquet':
+        store.write_table(table, output_file_path)
+    else:
+        output_ds.to_netcdf(path=output_file_path)
+    return output_file_path
+
+
+def get_model_fingerprint(output_all_columns: bool = False, mode: str = process_mode,
+                          turbines: Optional[List[Tuple[str, float]]] = None,
+                          **settings) -> Dict[str, str]:
+    '''
+    fingerprint components of the turbine, sed model and compute code,
+    shared by all outputs of one configuration. settings overrides the
+    dtype and engines of the config, see model_fingerprint
+    '''
+    return model_fingerprint(mode, output_all_columns, turbines, **settings)
+
+
+def output_key(file_path: str, output_all_columns: bool = False,
+               global_grid: bool = False, file_format: str = 'netcdf',
+               sweep: bool = False) -> str:
+    if file_format == 'parquet':
+        from common.store import daily_key
+        return daily_key(file_path)
+    if sweep:
+        output_bucket_folder = output_sweep
+    elif global_grid:
+        output_bucket_folder = output_global
+    else:
+        output_bucket_folder = output_main if output_all_columns else output_compressed
+    return os.path.join(output_bucket_folder, file_path)
+
+
+def upload_output(file_path: str, output_data: Union[str, bytes],
+                  output_all_columns: bool = False, metadata: Dict[str, str] = {},
+                  global_grid: bool = False, file_format: str = 'netcdf',
+                  sweep: bool = False) -> dict:
+    '''
+    @returns record: dict with key, size, etag and metadata of the output
+    '''
+    remote_output_file_path = output_key(file_path, output_all_columns, global_grid,
+                                         file_format, sweep)
 
-    output_bucket_folder = output_main if output_all_columns else output_compressed
     # save to remote
-    remote_output_file_path = os.path.join(output_bucket_folder, file_path)
-    s3.upload_file(output_file_path, s3_bucket, remote_output_file_path)
+    with metrics.span('upload') as record:
+        if isinstance(output_data, bytes):
+            info = storage.put(remote_output_file_path, output_data, metadata)
+        else:
+            info = storage.upload(output_data, remote_output_file_path, metadata)
 
-    # remove output file
-    if input_file_path != output_file_path:
-        os.remove(output_file_path)
+            # remove output file
+            os.remove(output_data)
+        record['bytes'] = info['size']
 
-    # remove file
-    os.remove(input_file_path)
+    return {
+        'key': remote_output_file_path,
+        'size': info['size'],
+        'etag': info['etag'],
+        'metadata': metadata
+    }
 
 
-def lambda_handler(event, _context=None):
-    file_paths = event['files']
-    compressed = 'compressed' in event and event['compressed']
-    print(f'lambda start {file_paths[0]} end {file_paths[-1]}')
+def write_catalog_event(records: List[dict]) -> None:
+    '''
+    saves the records of the uploaded outputs as one event object, the key
+    starts with the utc time so the catalog can list only new events
+    '''
+    if len(records) == 0:
+        return
+    storage.put(event_key(), json.dumps({'records': records}).encode())
+
 
-    for i, file_path in enumerate(file_paths):
-        file_name = os.path.basename(file_path)
-        country_name = os.path.basename(os.path.dirname(file_path))
-        print(
-            f'processing file {i + 1}, {file_name} for country {country_name}')
+def remove_input(input_data: Union[str, bytes, None]) -> None:
+    '''
+    releases a downloaded input, the cache removes it if it is over budget
+    '''
+    if isinstance(input_data, str) and input_data.startswith(input_cache.folder + os.sep):
+        input_cache.release(input_data)
+    # other paths are read in place from the local storage
+
+
+def process_file(file_path, output_all_columns=False, mode=process_mode,
+                 in_memory=in_memory_io, global_grid=False,
+                 file_format=output_format, turbines=None) -> None:
+    start_time = time()
+    sweep = turbines is not None
+    file_format = get_output_format(output_all_columns, global_grid, file_format, sweep)
+    with metrics.context(**metrics.file_fields(file_path)):
+        input_data, input_object = download_input(file_path, in_memory, global_grid)
         try:
-            start_time = time()
-            process_file(file_path, not compressed)
+            output_ds = compute_file(input_data, output_all_columns, mode, turbines=turbines)
+        finally:
+            # remove file
+            remove_input(input_data)
+
+        with metrics.span('write'):
+            output_data = write_output(file_path, output_ds, in_memory, file_format)
+        metadata = output_metadata(get_model_fingerprint(output_all_columns, mode, turbines),
+                                   input_object['etag'], input_object['size'])
+        # runtime for the cost estimates of the batches in start_lambdas
+        metadata['seconds'] = f'{time() - start_time:.3f}'
+        record = upload_output(file_path, output_data, output_all_columns, metadata,
+                               global_grid, file_format, sweep)
+    write_catalog_event([record])
+
+
+def process_files(file_paths: List[str], output_all_columns: bool = False,
+                  mode: str = process_mode, in_memory: bool = in_memory_io,
+                  depth: int = prefetch_depth, max_bytes: int = prefetch_max_bytes,
+                  global_grid: bool = False, file_format: str = output_format,
+                  turbines: Optional[List[Tuple[str, float]]] = None,
+                  sizes: Optional[Dict[str, int]] = None) -> List[Dict[str, str]]:
+    '''
+    processes the files in order, while background threads download the
+    next files and upload the outputs of the previous ones. returns the
+    files that failed, with the error. the uploaded outputs are saved as
+    one catalog event at the end
+
+    at most depth files are downloaded ahead of the one being computed,
+    depth 0 downloads each file when it is computed. a download ahead only
+    starts if the object sizes of the files ahead, downloading or done,
+    stay below max_bytes. the sizes are the ones of the listing (sizes, by
+    file path, from start_lambdas), or of a head request. reading / writing
+    netcdf stays on this thread, the background threads only move bytes
+
+    with turbines, every file is computed for all (turbine type, hub
+    height) configs of the sweep, see compute_output_sweep
+    '''
+    download_pool = ThreadPoolExecutor(max_workers=max(depth, 1),
+                                       thread_name_prefix='download')
+    upload_pool = ThreadPoolExecutor(max_workers=1,
+                                     thread_name_prefix='upload')
+
+    sweep = turbines is not None
+    model = get_model_fingerprint(output_all_columns, mode, turbines)
+    file_format = get_output_format(output_all_columns, global_grid, file_format, sweep)
+
+    downloads = deque()
+    uploads = deque()
+    failed = []
+    records = []
+    num_submitted = 0
+
+    def add_failed(file_path: str) -> None:
+        error = traceback.format_exc()
+        print(f'error processing file: {file_path}', error)
+        failed.append({'file': file_path, 'error': error.strip().splitlines()[-1]})
+
+    # object sizes by file path, a head request for the ones not given
+    input_sizes = dict(sizes or {})
+
+    def input_size(file_path: str) -> int:
+        if file_path not in input_sizes:
+            try:
+                input_sizes[file_path] = storage.head(input_key(file_path, global_grid))['size']
+            except Exception:
+                # the download reports the error
+                input_sizes[file_path] = 0
+        return input_sizes[file_path]
+
+    def submit() -> None:
+        nonlocal num_submitted
+        file_path = file_paths[num_submitted]
+        downloads.append((file_path, download_pool.submit(
+            download_input, file_path, in_memory, global_grid)))
+        num_submitted += 1
+
+    def prefetch() -> None:
+        '''
+        downloads ahead of the file being computed, up to depth files and
+        max_bytes of them
+        '''
+        while num_submitted < len(file_paths) and len(downloads) < depth:
+            ahead_bytes = sum(input_size(file_path) for file_path, _ in downloads)
+            if ahead_bytes + input_size(file_paths[num_submitted]) > max_bytes:
+                break
+            submit()
+
+    def wait_upload() -> None:
+        file_path, future, start_time = uploads.popleft()
+        try:
+            with metrics.context(**metrics.file_fields(file_path)), metrics.span('upload_wait'):
+                catalog_record = future.result()
+            records.append(catalog_record)
             print('time to process', time() - start_time)
         except Exception:
+            add_failed(file_path)
+
+    try:
+        for i, file_path in enumerate(file_paths):
+            if len(downloads) == 0:
+                # not prefetched, depth 0 or over max_bytes
+                submit()
+            _, future = downloads.popleft()
+
+            file_name = os.path.basename(file_path)
+            country_name = os.path.basename(os.path.dirname(file_path))
             print(
-                f'error processing file: {file_path}', traceback.format_exc())
+                f'processing file {i + 1}, {file_name} for country {country_name}')
+
+            start_time = time()
+            input_data = None
+            try:
+                with metrics.context(**metrics.file_fields(file_path)):
+                    # the part of the download that the computation of the
+                    # previous file did not hide
+                    with metrics.span('download_wait'):
+                        input_data, input_object = future.result()
+                    # start the next download while this file is computed
+                    prefetch()
+                    output_ds = compute_file(input_data, output_all_columns, mode,
+                                             turbines=turbines)
+                    with metrics.span('write'):
+                        output_data = write_output(file_path, output_ds, in_memory,
+                                                   file_format)
+                    metadata = output_metadata(model, input_object['etag'],
+                                               input_object['size'])
+                    # time this file added to the invocation, including waiting
+                    # for its download, for the batch cost estimates
+                    metadata['seconds'] = f'{time() - start_time:.3f}'
+                    # the upload thread gets the file fields of the spans
+                    uploads.append((file_path, upload_pool.submit(
+                        metrics.bind(upload_output), file_path, output_data,
+                        output_all_columns, metadata, global_grid, file_format,
+                        sweep), start_time))
+            except Exception:
+                add_failed(file_path)
+            finally:
+                # remove file
+                remove_input(input_data)
+
+            while len(uploads) > depth:
+                wait_upload()
+
+        while len(uploads) > 0:
+            wait_upload()
+    finally:
+        download_pool.shutdown()
+        upload_pool.shutdown()
+
+        try:
+            write_catalog_event(records)
+        except Exception:
+            # the outputs are uploaded, the catalog picks them up on refresh
+            print('error writing catalog event', traceback.format_exc())
+
+    return failed
+
+
+def lambda_handler(event, _context=None):
+    file_paths = event['files']
+    compressed = 'compressed' in event and event['compressed']
+    mode = event.get('mode', process_mode)
+    in_memory = event.get('in_memory', in_memory_io)
+    depth = event.get('prefetch_depth', prefetch_depth)
+    max_bytes = event.get('prefetch_max_bytes', prefetch_max_bytes)
+    # object sizes of the files from the listing, for the prefetch budget
+    sizes = event.get('sizes')
+    global_grid = event.get('global', False)
+    file_format = event.get('format', output_format)
+    # {'turbine_types': [...], 'hub_heights': [...]}, or true for the defaults
+    sweep = event.get('sweep')
+    turbines = None
+    if global_grid:
+        # only the per cell sums, without the full dataframe of the globe
+        compressed = True
+        mode = 'array'
+    if sweep:
+        if global_grid:
+            raise ValueError('the sweep is not supported with the global grid')
+        if not isinstance(sweep, dict):
+            sweep = {}
+        turbines = sweep_configs(sweep.get('turbine_types', sweep_turbine_types),
+                                 sweep.get('hub_heights', sweep_hub_heights))
+        compressed = True
+        mode = 'array'
+    print(f'lambda start {file_paths[0]} end {file_paths[-1]}')
+
+    metrics.start_run(getattr(_context, 'aws_request_id', None))
+    failed = process_files(file_paths, not compressed, mode, in_memory, depth,
+                           max_bytes, global_grid=global_grid, file_format=file_format,
+                           turbines=turbines, sizes=sizes)
+    print(input_cache.stats())
+    metrics.end_run(function='calculate', files=len(file_paths), failed=len(failed))
 
     return {
         'statusCode': 200,
         'body': json.dumps({
-            'message': f'done processing for {len(file_paths)} files'
+            'message': f'done processing for {len(file_paths)} files',
+            'failed': failed
         })
     }
 
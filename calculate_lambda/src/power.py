@@ -1,16 +1,19 @@
 #!/usr/bin/env python3
-from typing import Dict, Tuple, Union
+from typing import Dict, Iterator, List, Tuple, Union
 import numpy as np
 import pandas as pd
 import xarray as xr
-from time import time
-from energy_calc_func import energy_calc
+from common.metrics import span
+from energy_calc_func import energy_calc, energy_calc_array, energy_calc_sweep
+from config import power_engine, compute_dtype
 
 roughness_length = 0.15
 
 
 def get_power(df_main: pd.DataFrame,
-              output_all_columns: bool = True) -> Union[pd.DataFrame, Dict[Tuple[float, float], pd.Series]]:
+              output_all_columns: bool = True,
+              engine: str = power_engine,
+              dtype: str = compute_dtype) -> Union[pd.DataFrame, Dict[Tuple[float, float], pd.Series]]:
     '''
     this function translates merra data, seperates each latitude 
     and longitude, and calculates the power output for each 
@@ -18,21 +21,111 @@ def get_power(df_main: pd.DataFrame,
 
     @param df_main: pd.DataFrame
     @param output_dict: bool
+    @param engine: str, 'array' (energy_calc_array) or 'windpowerlib' (ModelChain)
+    @param dtype: str, float type of the array engine, 'float64' or 'float32'
     @returns power_data: Dict[Tuple[float, float], pd.Series]
     '''
     output_df = df_main.copy() if output_all_columns else None
 
+    if engine == 'array':
+        with span('wind'):
+            wind_speed = np.sqrt(df_main['V50M'].to_numpy(dtype=dtype)**2
+                                 + df_main['U50M'].to_numpy(dtype=dtype)**2)
+
+        with span('power'):
+            power_output = pd.Series(energy_calc_array(
+                wind_speed, df_main['PS'].to_numpy(), df_main['T10M'].to_numpy(),
+                roughness_length, dtype=dtype), index=df_main.index)
+    elif engine == 'windpowerlib':
+        power_output = get_power_modelchain(df_main)
+    else:
+        raise ValueError(f'invalid power engine {engine}')
+
+    output_col = 'power_output'
+
+    if output_df is not None:
+        output_df[output_col] = power_output.values
+    else:
+        output_df = power_output.to_frame(name=output_col)
+
+    return output_df
+
+
+def get_power_array(u50m: np.ndarray, v50m: np.ndarray, ps: np.ndarray,
+                    t10m: np.ndarray, out: np.ndarray = None,
+                    dtype: str = compute_dtype) -> np.ndarray:
+    '''
+    power output for merra arrays of any shape, e.g. (time, lat, lon),
+    without going through a data frame
+
+    @param u50m, v50m: np.ndarray, wind components at 50m in m/s
+    @param ps: np.ndarray, surface pressure in Pa
+    @param t10m: np.ndarray, temperature at 10m in K
+    @param out: np.ndarray, optional preallocated output
+    @param dtype: str, float type of the calculation, 'float64' or 'float32'
+    @returns power_output: np.ndarray
+    '''
+    return get_power_wind_speed(get_wind_speed(u50m, v50m, dtype), ps, t10m, out, dtype)
+
+
+def get_wind_speed(u50m: np.ndarray, v50m: np.ndarray,
+                   dtype: str = compute_dtype) -> np.ndarray:
+    '''
+    wind speed at 50m in m/s from its components, any shape
+    '''
+    wind_speed = np.square(u50m, dtype=dtype)
+    wind_speed += np.square(v50m, dtype=dtype)
+    np.sqrt(wind_speed, out=wind_speed)
+    return wind_speed
+
+
+def get_power_wind_speed(wind_speed: np.ndarray, ps: np.ndarray, t10m: np.ndarray,
+                         out: np.ndarray = None, dtype: str = compute_dtype) -> np.ndarray:
+    '''
+    power output from the wind speed at 50m, the second step of
+    get_power_array, so the two can be timed on their own
+    '''
+    return energy_calc_array(wind_speed, ps, t10m, roughness_length, out=out, dtype=dtype)
+
+
+def get_power_sweep(u50m: np.ndarray, v50m: np.ndarray, ps: np.ndarray,
+                    t10m: np.ndarray, turbines: List[Tuple[str, float]],
+                    dtype: str = compute_dtype) -> Iterator[Tuple[int, np.ndarray]]:
+    '''
+    power output of every (turbine type, hub height) for merra arrays,
+    the wind speed is computed once for all of them
+
+    @returns power_outputs: Iterator[Tuple[int, np.ndarray]], see energy_calc_sweep
+    '''
+    return get_power_sweep_wind_speed(get_wind_speed(u50m, v50m, dtype), ps, t10m,
+                                      turbines, dtype)
+
+
+def get_power_sweep_wind_speed(wind_speed: np.ndarray, ps: np.ndarray, t10m: np.ndarray,
+                               turbines: List[Tuple[str, float]],
+                               dtype: str = compute_dtype) -> Iterator[Tuple[int, np.ndarray]]:
+    '''
+    get_power_sweep from the wind speed at 50m
+    '''
+    return energy_calc_sweep(wind_speed, ps, t10m, roughness_length, turbines, dtype=dtype)
+
+
+def get_power_modelchain(df_main: pd.DataFrame) -> pd.Series:
+    '''
+    builds the MultiIndex weather data frame windpowerlib expects
+    and runs the ModelChain on it
+
+    @param df_main: pd.DataFrame
+    @returns power_output: pd.Series
+    '''
+
     # find the exact wind speed at 10 and 50m and put it back into df
     # sqrt((V50M)^2+(U50M)^2)=wind_speed
     # sqrt((V10M)^2+(U10M)^2)=wind_speed
 
-    start_time = time()
-    new_col10 = np.sqrt(df_main['V10M']**2 + df_main['U10M']**2)
-    print('time wind 1', time() - start_time)
-
-    start_time = time()
-    new_col50 = np.sqrt(df_main['V50M']**2 + df_main['U50M']**2)
-    print('time wind 2', time() - start_time)
+    with span('wind'):
+        new_col10 = np.sqrt(df_main['V10M']**2 + df_main['U10M']**2)
+        new_col50 = np.sqrt(df_main['V50M']**2 + df_main['U50M']**2)
 
     df_main['wind_speed'] = new_col10
     df_main['wind_speed_1'] = new_col50
@@ -63,22 +156,10 @@ def get_power(df_main: pd.DataFrame,
 
     df_main.columns = columns
 
-    power_output = energy_calc(df_main)
-
-    print('calculate power time', time() - start_time)
-
-    output_col = 'power_output'
-
-    start_time = time()
-
-    if output_df is not None:
-        output_df[output_col] = power_output.values
-    else:
-        output_df = power_output.to_frame(name=output_col)
-
-    print('add to output time', time() - start_time)
+    with span('power'):
+        power_output = energy_calc(df_main)
 
-    return output_df
+    return power_output
 
 
 if __name__ == '__main__':
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+import os
+from glob import glob
+from time import time
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from main import compute_file
+from config import process_mode
+from common.summation import neumaier_add
+
+# compares the float32 compute mode (COMPUTE_DTYPE=float32) to float64 on
+# the local files of sample countries: the daily sums, and the yearly sums
+# accumulated like the reduce lambda, with and without compensation
+
+data_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../data'))
+country_data_folder = os.path.join(data_folder, 'World_2019', '11111')
+report_file_path = os.path.join(data_folder, 'precision_report.csv')
+
+variables = ['sed', 'power_output']
+
+
+def relative_error(values: np.ndarray, reference: np.ndarray) -> float:
+    '''
+    largest difference relative to the largest reference value
+    '''
+    scale = np.nanmax(np.abs(reference))
+    if scale == 0:
+        return 0.
+    return float(np.nanmax(np.abs(values - reference)) / scale)
+
+
+def compare_country(country_name: str, max_files: int = -1,
+                    mode: str = process_mode) -> List[Dict]:
+    file_paths = sorted(glob(os.path.join(country_data_folder, country_name, '*.nc4')))
+    if max_files != -1:
+        file_paths = file_paths[:max_files]
+    if len(file_paths) == 0:
+        raise ValueError(f'no files for {country_name}')
+
+    reference = {}
+    naive = {}
+    compensated = {}
+    compensation = {}
+    daily_error = {name: 0. for name in variables}
+    seconds = {'float64': 0., 'float32': 0.}
+    for file_path in file_paths:
+        outputs = {}
+        for dtype in seconds:
+            start_time = time()
+            outputs[dtype] = compute_file(file_path, False, mode, dtype)
+            seconds[dtype] += time() - start_time
+
+        for name in variables:
+            values_64 = np.nan_to_num(outputs['float64'][name].transpose('lat', 'lon').values)
+            values_32 = np.nan_to_num(outputs['float32'][name].transpose('lat', 'lon').values)
+            daily_error[name] = max(daily_error[name], relative_error(values_32, values_64))
+            if name not in reference:
+                reference[name] = np.zeros(values_64.shape, dtype=np.float64)
+                naive[name] = np.zeros(values_32.shape, dtype=np.float32)
+                compensated[name] = np.zeros(values_32.shape, dtype=np.float32)
+                compensation[name] = np.zeros(values_32.shape, dtype=np.float32)
+            reference[name] += values_64
+            naive[name] += values_32.astype(np.float32)
+            neumaier_add(compensated[name], compensation[name], values_32.astype(np.float32))
+
+    rows = []
+    for name in variables:
+        total = compensated[name] + compensation[name]
+        rows.append({
+            'country': country_name,
+            'variable': name,
+            'files': len(file_paths),
+            'max_daily_cell_error': daily_error[name],
+            'max_cell_error': relative_error(total, reference[name]),
+            'max_cell_error_uncompensated': relative_error(naive[name], reference[name]),
+            'total_error': float(abs(total.sum(dtype=np.float64) - reference[name].sum())
+                                 / abs(reference[name].sum())),
+            'seconds_float64': seconds['float64'],
+            'seconds_float32': seconds['float32'],
+        })
+    return rows
+
+
+def main(country_names: List[str] = ['Germany', 'Afghanistan', 'United States'],
+         max_files: int = -1, mode: str = process_mode) -> pd.DataFrame:
+    '''
+    saves the report to data/precision_report.csv, the errors are relative
+    to the largest float64 value of the country
+    '''
+    rows = []
+    for country_name in country_names:
+        rows.extend(compare_country(country_name, max_files, mode))
+    report = pd.DataFrame(rows)
+
+    report.to_csv(report_file_path, index=False)
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(report)
+    print('saved', report_file_path)
+
+    return report
+
+
+if __name__ == '__main__':
+    main()
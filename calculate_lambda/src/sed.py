@@ -6,18 +6,70 @@ import numpy as np
 import xarray as xr
 
 import Humidity_Calculations as HC
+from config import sed_engine, compute_dtype
 
 
-def get_sed(df: pd.DataFrame) -> pd.DataFrame:
-    df['RH2M'] = df.apply(
-        lambda x: HC.convert_SH_to_RH(x.QV2M, x.PS, x.T2M), axis=1)
+def get_sed(df: pd.DataFrame, engine: str = sed_engine,
+            dtype: str = compute_dtype) -> pd.DataFrame:
+    '''
+    calculates the sed for every row of the merra data
+
+    @param df: pd.DataFrame
+    @param engine: str, 'exact' or 'table' (see sed_table.py)
+    @param dtype: str, float type of the sed column, 'float64' or 'float32'
+    @returns df: pd.DataFrame with sed column
+    '''
+    df['RH2M'] = HC.convert_SH_to_RH_array(
+        df['QV2M'].to_numpy(dtype=dtype),
+        df['PS'].to_numpy(dtype=dtype),
+        df['T2M'].to_numpy(dtype=dtype))
     df['T2M'] = df['T2M'] - 273.15
-    df = HC.Poly_Fit_Optimized_Energy(
-        df, 'T2M', 'RH2M', 'sed')
+
+    if engine == 'table':
+        from sed_table import get_sed_table
+        df['sed'] = get_sed_table().evaluate(
+            df['T2M'].to_numpy(dtype=dtype) + 273.15,
+            df['RH2M'].to_numpy(dtype=dtype) * 100,
+            out=np.empty(len(df), dtype=dtype))
+    elif engine == 'exact':
+        df = HC.Poly_Fit_Optimized_Energy(
+            df, 'T2M', 'RH2M', 'sed', dtype)
+    else:
+        raise ValueError(f'invalid sed engine {engine}')
 
     return df
 
 
+def get_sed_array(qv2m: np.ndarray, ps: np.ndarray, t2m: np.ndarray,
+                  engine: str = sed_engine, out: np.ndarray = None,
+                  dtype: str = compute_dtype) -> np.ndarray:
+    '''
+    sed for merra arrays of any shape, e.g. (time, lat, lon),
+    without going through a data frame
+
+    @param qv2m: np.ndarray, specific humidity at 2m
+    @param ps: np.ndarray, surface pressure in Pa
+    @param t2m: np.ndarray, temperature at 2m in K
+    @param engine: str, 'exact' or 'table' (see sed_table.py)
+    @param out: np.ndarray, optional preallocated output
+    @param dtype: str, float type of the arrays, 'float64' or 'float32'
+    @returns sed: np.ndarray
+    '''
+    t2m = np.asarray(t2m, dtype=dtype)
+    phi_amb = np.empty(t2m.shape, dtype=dtype)
+    HC.convert_SH_to_RH_array(qv2m, ps, t2m, out=phi_amb)
+    phi_amb *= 100  # Convert to [%]
+    if out is None:
+        out = np.empty(t2m.shape, dtype=dtype)
+
+    if engine == 'table':
+        from sed_table import get_sed_table
+        return get_sed_table().evaluate(t2m, phi_amb, out=out)
+    elif engine == 'exact':
+        return HC.evaluate_poly(t2m, phi_amb, out=out)
+    raise ValueError(f'invalid sed engine {engine}')
+
+
 if __name__ == '__main__':
     input_file_path = '../data/World_2019/11111/Afghanistan/MERRA2_400.tavg1_2d_slv_Nx.20190101.nc4'
     with xr.open_mfdataset(input_file_path, combine='by_coords') as ds_wind:
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+import os
+import hashlib
+from time import time
+from typing import Optional, Tuple
+
+import numpy as np
+
+import Humidity_Calculations as HC
+from config import sed_fit_T_range, sed_fit_phi_range, \
+    sed_table_T_range, sed_table_phi_range, \
+    sed_table_T_step, sed_table_phi_step, sed_table_max_rel_error
+
+table_file_path = os.path.join(os.path.dirname(__file__), 'sed_table.npz')
+
+
+def table_key(T_range: Tuple[float, float], phi_range: Tuple[float, float],
+              T_step: float, phi_step: float, coef: np.ndarray) -> str:
+    '''
+    hash of the grid definition and the model coefficients, used to
+    check that a saved table still belongs to the current config / model
+    '''
+    sha = hashlib.sha256()
+    sha.update(np.array([*T_range, *phi_range, T_step, phi_step],
+                        dtype=np.float64).tobytes())
+    sha.update(np.ascontiguousarray(coef, dtype=np.float64).tobytes())
+    return sha.hexdigest()
+
+
+class SEDTable:
+    '''
+    precomputed sed polynomial on a dense (T_amb, phi_amb) grid,
+    evaluated with bilinear interpolation. samples outside of the
+    grid fall back to the exact polynomial
+
+    T_amb in [K], phi_amb in [%], same as HC.evaluate_poly
+    '''
+
+    def __init__(self, T_range: Tuple[float, float], phi_range: Tuple[float, float],
+                 T_step: float, phi_step: float, coef: np.ndarray = HC.poly_coef,
+                 grid: Optional[np.ndarray] = None,
+                 errors: Optional[Tuple[float, float]] = None):
+        self.key = table_key(T_range, phi_range, T_step, phi_step, coef)
+        self.coef = coef
+        self.T_min = T_range[0]
+        self.phi_min = phi_range[0]
+        self.T_step = T_step
+        self.phi_step = phi_step
+        num_T = int(round((T_range[1] - T_range[0]) / T_step)) + 1
+        num_phi = int(round((phi_range[1] - phi_range[0]) / phi_step)) + 1
+        self.T_axis = self.T_min + T_step * np.arange(num_T)
+        self.phi_axis = self.phi_min + phi_step * np.arange(num_phi)
+        self.T_max = self.T_axis[-1]
+        self.phi_max = self.phi_axis[-1]
+
+        if grid is None:
+            T_grid, phi_grid = np.meshgrid(
+                self.T_axis, self.phi_axis, indexing='ij')
+            grid = HC.evaluate_poly(T_grid, phi_grid, coef)
+        self.grid = grid
+
+        if errors is None:
+            errors = self.error_bound()
+        self.max_abs_error, self.max_rel_error = errors
+
+    def interpolate(self, T_amb: np.ndarray, phi_amb: np.ndarray,
+                    out: np.ndarray) -> None:
+        '''
+        bilinear interpolation for samples inside of the grid
+        '''
+        fi = (T_amb - self.T_min) / self.T_step
+        fj = (phi_amb - self.phi_min) / self.phi_step
+        i = np.clip(fi.astype(np.intp), 0, len(self.T_axis) - 2)
+        j = np.clip(fj.astype(np.intp), 0, len(self.phi_axis) - 2)
+        wi = fi - i
+        wj = fj - j
+
+        g = self.grid
+        out[:] = (1 - wi) * ((1 - wj) * g[i, j] + wj * g[i, j + 1]) \
+            + wi * ((1 - wj) * g[i + 1, j] + wj * g[i + 1, j + 1])
+
+    def evaluate(self, T_amb, phi_amb, out=None) -> np.ndarray:
+        '''
+        Input: T_amb in [K] and phi_amb in [%] as arrays of one shape
+               out: optional preallocated C contiguous float array for the result
+
+        Output: Array with the predicted energy demand (out, if given)
+        '''
+        T_amb = np.asarray(T_amb)
+        phi_amb = np.asarray(phi_amb)
+        if out is None:
+            out = np.empty(T_amb.shape, dtype=np.float64)
+        elif not out.flags.c_contiguous:
+            # reshape(-1) would copy it, the result would not be written to out
+            raise ValueError('out must be a C contiguous array')
+
+        inside = (T_amb >= self.T_min) & (T_amb <= self.T_max) \
+            & (phi_amb >= self.phi_min) & (phi_amb <= self.phi_max)
+
+        if inside.all():
+            self.interpolate(T_amb.reshape(-1), phi_amb.reshape(-1),
+                             out.reshape(-1))
+            return out
+
+        result = np.empty(inside.sum(), dtype=out.dtype)
+        self.interpolate(T_amb[inside], phi_amb[inside], result)
+        out[inside] = result
+
+        outside = ~inside
+        out[outside] = HC.evaluate_poly(
+            T_amb[outside], phi_amb[outside], self.coef)
+        return out
+
+    def error_bound(self) -> Tuple[float, float]:
+        '''
+        max absolute and relative interpolation error against the exact
+        polynomial over the fitted domain. the bilinear interpolation of a
+        cell differs from the function by at most
+        T_step^2 / 8 * max|f_TT| + phi_step^2 / 8 * max|f_phiphi|, with the
+        second derivatives at their max over the corners and the center of
+        the cell, relative to the smallest value at its corners
+        '''
+        T_in = (self.T_axis >= sed_fit_T_range[0]) & (self.T_axis <= sed_fit_T_range[1])
+        phi_in = (self.phi_axis >= sed_fit_phi_range[0]) \
+            & (self.phi_axis <= sed_fit_phi_range[1])
+        T_nodes = self.T_axis[T_in]
+        phi_nodes = self.phi_axis[phi_in]
+        if len(T_nodes) < 2 or len(phi_nodes) < 2:
+            return np.nan, np.nan
+
+        # coefficients of the second derivatives, coef[i, j] multiplies
+        # T_amb^i * phi_amb^j
+        powers = np.arange(self.coef.shape[0])
+        coef_TT = np.zeros_like(self.coef)
+        coef_TT[:-2] = (powers * (powers - 1))[2:, None] * self.coef[2:]
+        coef_phiphi = np.zeros_like(self.coef)
+        coef_phiphi[:, :-2] = (powers * (powers - 1))[None, 2:] * self.coef[:, 2:]
+
+        T_centers = (T_nodes[1:] + T_nodes[:-1]) / 2
+        phi_centers = (phi_nodes[1:] + phi_nodes[:-1]) / 2
+        values = np.abs(self.grid[np.ix_(T_in, phi_in)])
+
+        def cell_max(nodes: np.ndarray, centers: np.ndarray) -> np.ndarray:
+            return np.maximum.reduce([nodes[:-1, :-1], nodes[:-1, 1:], nodes[1:, :-1],
+                                      nodes[1:, 1:], centers])
+
+        abs_errors = np.zeros((len(T_centers), len(phi_centers)))
+        for coef, step in [(coef_TT, self.T_step), (coef_phiphi, self.phi_step)]:
+            nodes = np.abs(HC.evaluate_poly(*np.meshgrid(T_nodes, phi_nodes, indexing='ij'),
+                                            coef))
+            centers = np.abs(HC.evaluate_poly(
+                *np.meshgrid(T_centers, phi_centers, indexing='ij'), coef))
+            abs_errors += step ** 2 / 8 * cell_max(nodes, centers)
+
+        min_values = np.minimum.reduce([values[:-1, :-1], values[:-1, 1:],
+                                        values[1:, :-1], values[1:, 1:]])
+        return float(abs_errors.max()), float((abs_errors / min_values).max())
+
+    def check(self, max_rel_error: float = sed_table_max_rel_error) -> None:
+        '''
+        raises if the error bound of the grid is above the configured one
+        '''
+        if not self.max_rel_error <= max_rel_error:
+            raise ValueError(f'sed table max rel error {self.max_rel_error:.3g} is above '
+                             f'{max_rel_error:.3g}, use smaller SED_TABLE_T_STEP / '
+                             f'SED_TABLE_PHI_STEP')
+
+    def save(self, file_path: str = table_file_path) -> None:
+        np.savez(file_path, grid=self.grid, key=self.key,
+                 errors=[self.max_abs_error, self.max_rel_error])
+
+
+def load_sed_table(file_path: str = table_file_path) -> Optional[SEDTable]:
+    '''
+    loads the table saved at build time, if it matches the configured
+    grid and the current model coefficients
+    '''
+    key = table_key(sed_table_T_range, sed_table_phi_range,
+                    sed_table_T_step, sed_table_phi_step, HC.poly_coef)
+    if not os.path.exists(file_path):
+        return None
+    with np.load(file_path) as data:
+        if str(data['key']) != key:
+            return None
+        return SEDTable(sed_table_T_range, sed_table_phi_range,
+                        sed_table_T_step, sed_table_phi_step,
+                        grid=data['grid'], errors=tuple(data['errors']))
+
+
+_table: Optional[SEDTable] = None
+
+
+def get_sed_table() -> SEDTable:
+    '''
+    returns the sed table for the configured grid, loaded from the file
+    generated at build time, or built once at startup if it is missing
+    or does not match the current model / grid
+    '''
+    global _table
+    if _table is not None:
+        return _table
+
+    start_time = time()
+    table = load_sed_table()
+    if table is None:
+        table = SEDTable(sed_table_T_range, sed_table_phi_range,
+                         sed_table_T_step, sed_table_phi_step)
+
+    print('sed table', table.grid.shape, 'time', time() - start_time)
+    print('sed table max abs error', table.max_abs_error,
+          'max rel error', table.max_rel_error)
+    table.check()
+
+    _table = table
+    return _table
+
+
+if __name__ == '__main__':
+    table = SEDTable(sed_table_T_range, sed_table_phi_range,
+                     sed_table_T_step, sed_table_phi_step)
+    print('max abs error', table.max_abs_error,
+          'max rel error', table.max_rel_error)
+    # fails the image build
+    table.check()
+    table.save()
+    print('saved sed table', table.grid.shape, 'to', table_file_path)
@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 import os
-from time import sleep
-from typing import List
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from time import sleep, time
+from typing import Dict, List, Optional, Tuple
 
-import numpy as np
 import boto3
 import json
 
@@ -12,47 +14,286 @@ from glob import glob
 from click import confirm, prompt
 from tqdm import tqdm
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from common.catalog import Catalog, stages  # noqa: E402
+from common.store import daily_folder, input_file_path  # noqa: E402
+from common.storage import get_storage  # noqa: E402
+from batching import estimate_seconds, pack_batches  # noqa: E402
+from config import batch_target_seconds, process_mode, output_format, \
+    compute_dtype, power_engine, sed_engine  # noqa: E402
+
 load_dotenv()
 
 # account lambda limit
 lambda_limit = 1200
 
-s3 = boto3.client('s3')
+# parallel head requests when comparing output fingerprints
+num_head_workers = 32
+
+# the bucket, or data/ with STORAGE=local, which only local runs can read
+storage = get_storage(max_pool_connections=num_head_workers)
 lmda = boto3.client('lambda')
 
 lambda_function = 'tori-wind-lambda'
-s3_bucket = 'tori-calculate-wind-power'
 output_main = 'output'
 output_compressed = 'output_compressed'
 input_bucket_folder = 'World_2019'
+# global grid mode, see main.input_global
+input_global = 'World_2019_global'
+output_global = 'output_global'
+# turbine / hub height sweep, see main.compute_output_sweep
+output_sweep = 'output_sweep'
 
 data_folder = os.path.abspath(os.path.join(
     os.path.dirname(__file__), '../../data', 'World_2019', '11111'))
+global_data_folder = os.path.abspath(os.path.join(
+    os.path.dirname(__file__), '../../data', input_global))
 
 
-def get_s3_keys(prefix='') -> List[str]:
-    paginator = s3.get_paginator('list_objects_v2')
-    for page in tqdm(paginator.paginate(Bucket=s3_bucket, Prefix=prefix)):
-        for content in page.get('Contents', ()):
-            yield content['Key']
-
-
-def main(num_per_lambda: int = 50, use_filesystem=True, folder_names=[], exclude_folder_names=[],
-         check_file_complete=False, compressed=False, max_lambdas=-1, run_local=False):
+def lambda_settings(run_local: bool) -> Dict[str, str]:
+    '''
+    dtype and engines the outputs are computed with: the local config for
+    local runs, else the environment of the deployed function, with the
+    defaults of config.py for the variables it does not set
+    '''
+    if run_local:
+        return {'dtype': compute_dtype, 'power_engine': power_engine,
+                'sed_engine': sed_engine}
+    variables = lmda.get_function_configuration(FunctionName=lambda_function) \
+        .get('Environment', {}).get('Variables', {})
+    return {'dtype': variables.get('COMPUTE_DTYPE', 'float64'),
+            'power_engine': variables.get('POWER_ENGINE', 'array'),
+            'sed_engine': variables.get('SED_ENGINE', 'exact')}
+
+
+def get_metadata(key: str) -> Dict[str, str]:
+    return storage.head(key)['metadata']
+
+
+def get_catalog_files(catalog: Catalog, folder: str, country_name: str = None) -> Dict[str, dict]:
+    '''
+    catalog objects of a bucket folder, by file path relative to the folder.
+    the daily store objects by the input file they were computed from
+    '''
+    stage = stages.get(folder, folder)
+    if folder == daily_folder:
+        return {input_file_path(key): info
+                for key, info in catalog.objects(stage, country_name).items()}
+    return {key.split(folder)[1][1:]: info
+            for key, info in catalog.objects(stage, country_name).items()}
+
+
+def get_stale_files(all_files: List[str], catalog: Catalog, input_folder: str,
+                    output_bucket_folder: str, compressed: bool, mode: str = process_mode,
+                    country_name: str = None,
+                    turbines: Optional[List[Tuple[str, float]]] = None,
+                    settings: Optional[Dict[str, str]] = None) -> List[str]:
+    '''
+    files without an output, or whose output fingerprint does not match
+    the input etag / size and the turbine, sed model and code of the run,
+    settings are the dtype and engines it runs with, see lambda_settings.
+    prints which components changed. output metadata missing from the
+    catalog is fetched once and saved in it
+    '''
+    from main import get_model_fingerprint
+    from fingerprint import output_metadata, changed_components, settings as setting_keys
+
+    model = get_model_fingerprint(not compressed, mode, turbines, **(settings or {}))
+    print('compute with', {key: model[key] for key in setting_keys})
+
+    input_objects = get_catalog_files(catalog, input_folder, country_name)
+    output_objects = get_catalog_files(catalog, output_bucket_folder, country_name)
+
+    unknown = [info['key'] for info in output_objects.values() if info['metadata'] is None]
+    if len(unknown) > 0:
+        print(f'get metadata of {len(unknown)} outputs...')
+        with ThreadPoolExecutor(max_workers=num_head_workers) as pool:
+            all_metadata = dict(zip(unknown, tqdm(pool.map(get_metadata, unknown),
+                                                  total=len(unknown))))
+        catalog.set_metadata(all_metadata)
+        output_objects = get_catalog_files(catalog, output_bucket_folder, country_name)
+
+    changed = Counter()
+    stale_files = []
+    for file_name in all_files:
+        if file_name not in output_objects:
+            changed['missing'] += 1
+            stale_files.append(file_name)
+        elif file_name not in input_objects:
+            # not on s3, the lambda will report it as failed
+            changed['no input'] += 1
+            stale_files.append(file_name)
+        else:
+            input_object = input_objects[file_name]
+            expected = output_metadata(model, input_object['etag'], input_object['size'])
+            changed_file = changed_components(expected, output_objects[file_name]['metadata'])
+            if len(changed_file) > 0:
+                changed.update(changed_file)
+                stale_files.append(file_name)
+
+    print(f'{len(stale_files)} of {len(all_files)} files to compute, by cause:', dict(changed))
+    return stale_files
+
+
+def batch_sizes(files: List[str], sizes: Dict[str, int]) -> Dict[str, int]:
+    '''
+    input sizes of the files of a batch, for the prefetch budget of the lambda
+    '''
+    return {file_path: sizes[file_path] for file_path in files if file_path in sizes}
+
+
+def run_local_batch(files: List[str], compressed: bool, global_grid: bool = False,
+                    file_format: str = output_format, sweep: Optional[dict] = None,
+                    sizes: Optional[Dict[str, int]] = None) -> List[Dict[str, str]]:
+    '''
+    runs one batch through lambda_handler in a worker process
+
+    @returns failed: List[Dict[str, str]], the files that failed with the error
+    '''
+    from main import lambda_handler
+    response = lambda_handler({
+        'files': files,
+        'compressed': compressed,
+        'global': global_grid,
+        'format': file_format,
+        'sweep': sweep,
+        'sizes': sizes
+    })
+    return json.loads(response['body'])['failed']
+
+
+def run_local_batches(batches: List[List[str]], compressed: bool, num_workers: int,
+                      global_grid: bool = False, file_format: str = output_format,
+                      sweep: Optional[dict] = None,
+                      sizes: Dict[str, int] = {}) -> List[Dict[str, str]]:
+    '''
+    runs the batches on a local process pool, showing progress and
+    throughput, and prints a summary of the files that failed
+
+    @returns failed: List[Dict[str, str]], the files that failed with the error
+    '''
+    num_files = sum(len(batch) for batch in batches)
+    failed: List[Dict[str, str]] = []
+    start_time = time()
+
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        futures = {pool.submit(run_local_batch, batch, compressed, global_grid,
+                               file_format, sweep, batch_sizes(batch, sizes)): batch
+                   for batch in batches}
+        with tqdm(total=num_files, unit='file') as progress:
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    failed.extend(future.result())
+                except Exception as error:
+                    # the whole batch failed, e.g. the worker died
+                    failed.extend({'file': file_path, 'error': repr(error)}
+                                  for file_path in batch)
+                progress.update(len(batch))
+                progress.set_postfix(
+                    files_per_s=f'{progress.n / (time() - start_time):.2f}',
+                    failed=len(failed))
+
+    duration = time() - start_time
+    print(f'processed {num_files} files in {len(batches)} batches with '
+          f'{num_workers} workers, {duration:.1f}s, {num_files / duration:.2f} files/s')
+
+    if len(failed) > 0:
+        print(f'{len(failed)} of {num_files} files failed:')
+        for failure in sorted(failed, key=lambda failure: failure['file']):
+            print(f"  {failure['file']}: {failure['error']}")
+    return failed
+
+
+def get_costs(all_files: List[str], catalog: Catalog, input_folder: str,
+              output_bucket_folder: str, files_folder: Optional[str], country_name: str = None):
+    '''
+    input sizes and measured runtimes of the files, from the local files
+    folder (if given) or the catalog, and the runtime estimates from them
+
+    @returns sizes: Dict[str, int], estimates: Dict[str, float]
+    '''
+    if files_folder is not None:
+        sizes = {file_name: os.path.getsize(os.path.join(files_folder, file_name))
+                 for file_name in all_files}
+    else:
+        sizes = {file_name: info['size'] for file_name, info
+                 in get_catalog_files(catalog, input_folder, country_name).items()}
+
+    seconds = {}
+    for file_name, info in get_catalog_files(catalog, output_bucket_folder, country_name).items():
+        if info['metadata'] is not None and 'seconds' in info['metadata']:
+            seconds[file_name] = float(info['metadata']['seconds'])
+    print(f'measured runtimes for {len(seconds)} files')
+
+    return sizes, estimate_seconds(all_files, sizes, seconds)
+
+
+def main(target_seconds: float = batch_target_seconds, max_per_lambda: int = -1,
+         use_filesystem=True, folder_names=[], exclude_folder_names=[],
+         check_file_complete=False, check_fingerprint=True, compressed=False,
+         max_lambdas=-1, run_local=False, num_workers=os.cpu_count(),
+         use_catalog=True, refresh_catalog=False, global_grid=False,
+         file_format=output_format, sweep=None):
+    '''
+    global_grid processes one global file per day (World_2019_global)
+    instead of the per country files, the country filters do not apply.
+    file_format 'parquet' writes the compressed outputs to the daily store.
+    sweep ({'turbine_types': [...], 'hub_heights': [...]}, or True for the
+    defaults of the config) computes the power output of every turbine
+    type and hub height to output_sweep. a local run returns the files
+    that failed, see run_local_batches
+    '''
     folder_names = set(folder_names)
+    turbines = None
     exclude_folder_names = set(exclude_folder_names)
+    country_name = list(folder_names)[0] if len(folder_names) == 1 else None
+    if global_grid:
+        compressed = True
+        mode = 'array'
+        input_folder = input_global
+        output_bucket_folder = output_global
+        files_folder = global_data_folder
+    elif sweep:
+        from main import sweep_configs
+        if not isinstance(sweep, dict):
+            sweep = {}
+        turbines = sweep_configs(**sweep)
+        compressed = True
+        mode = 'array'
+        input_folder = input_bucket_folder
+        output_bucket_folder = output_sweep
+        files_folder = data_folder
+    else:
+        mode = process_mode
+        input_folder = input_bucket_folder
+        output_bucket_folder = output_compressed if compressed else output_main
+        if compressed and file_format == 'parquet':
+            output_bucket_folder = daily_folder
+        files_folder = data_folder
+
+    # the outputs have the measured runtimes for the batch cost estimates
+    folders = [output_bucket_folder]
+    if not use_filesystem or (check_file_complete and check_fingerprint):
+        folders.append(input_folder)
+
+    if use_catalog:
+        catalog = Catalog()
+        catalog.update(storage, folders, refresh=refresh_catalog)
+    else:
+        # list the bucket every time, into a catalog that is not saved
+        catalog = Catalog(':memory:')
+        for folder in folders:
+            catalog.refresh(storage, os.path.join(folder, country_name or ''))
 
     if use_filesystem:
-        all_files = glob(os.path.join(data_folder, '**/*.nc4'))
-        all_files = [file_path.split(data_folder)[1][1:]
+        # the global files are not in country folders
+        pattern = '*.nc4' if global_grid else '**/*.nc4'
+        all_files = glob(os.path.join(files_folder, pattern))
+        all_files = [file_path.split(files_folder)[1][1:]
                      for file_path in all_files]
     else:
-        prefix = input_bucket_folder
-        if len(folder_names) == 1:
-            prefix = os.path.join(prefix, list(folder_names)[0])
-        all_files = get_s3_keys(prefix)
-        all_files = [file_path.split(input_bucket_folder)[1][1:]
-                     for file_path in all_files]
+        all_files = list(get_catalog_files(catalog, input_folder, country_name))
 
     if len(folder_names) > 0:
         new_all_files = []
@@ -72,20 +313,25 @@ def main(num_per_lambda: int = 50, use_filesystem=True, folder_names=[], exclude
                 new_all_files.append(file_path)
         all_files = new_all_files
 
+    # the outputs to recompute depend on the settings of the lambda or the
+    # local config they are computed with
+    run_local = confirm('Run locally?', default=run_local or storage.local)
+    if not run_local and storage.local:
+        raise ValueError('the lambdas can not read the local storage, run locally')
+
     if check_file_complete:
         print('check completed files...')
-        output_bucket_folder = output_compressed if compressed else output_main
-
-        prefix = output_bucket_folder
-        if len(folder_names) == 1:
-            prefix = os.path.join(prefix, list(folder_names)[0])
-
-        all_output_keys = {key.split(output_bucket_folder)[
-            1][1:] for key in get_s3_keys(prefix)}
-        # print(all_output_keys)
+        if check_fingerprint:
+            all_files = get_stale_files(all_files, catalog, input_folder, output_bucket_folder,
+                                        compressed, mode, country_name, turbines,
+                                        lambda_settings(run_local))
+        else:
+            all_output_files = get_catalog_files(
+                catalog, output_bucket_folder, country_name)
+            # print(all_output_files)
 
-        all_files = [file_name for file_name in all_files
-                     if file_name not in all_output_keys]
+            all_files = [file_name for file_name in all_files
+                         if file_name not in all_output_files]
 
     all_files.sort()
 
@@ -93,25 +339,31 @@ def main(num_per_lambda: int = 50, use_filesystem=True, folder_names=[], exclude
 
     if len(all_files) == 0:
         print('no files')
+        catalog.close()
         return
 
-    run_local = confirm('Run locally?', default=run_local)
+    sizes, estimates = get_costs(all_files, catalog, input_folder, output_bucket_folder,
+                                 files_folder if use_filesystem else None, country_name)
+    catalog.close()
 
     if not run_local:
-        num_per_lambda = prompt('Number files per lambda',
-                                type=int, default=num_per_lambda)
+        target_seconds = prompt('Target seconds per lambda',
+                                type=float, default=target_seconds)
     else:
-        num_per_lambda = len(all_files)
+        num_workers = prompt('Number of local workers',
+                             type=int, default=num_workers)
+        target_seconds = prompt('Target seconds per batch',
+                                type=float, default=target_seconds)
 
-    if num_per_lambda < 1:
-        raise ValueError(f'num per lambda {num_per_lambda} is less than 1')
+    if target_seconds <= 0:
+        raise ValueError(f'target seconds {target_seconds} is not positive')
 
-    num_lambdas = np.ceil(len(all_files) / num_per_lambda)
+    batches = pack_batches(all_files, estimates, sizes, target_seconds,
+                           max_files=max_per_lambda)
 
     if not run_local:
-        print('num lambdas:', num_lambdas)
-
-    assert max_lambdas != -1 or num_lambdas <= lambda_limit
+        print('num lambdas:', len(batches))
+        assert max_lambdas != -1 or len(batches) <= lambda_limit
 
     if confirm('Show files?', default=False):
         print(all_files)
@@ -119,26 +371,32 @@ def main(num_per_lambda: int = 50, use_filesystem=True, folder_names=[], exclude
     if not confirm('Do you want to continue?', default=True):
         exit()
 
+    if max_lambdas != -1:
+        batches = batches[:max_lambdas]
+
     if run_local:
-        from main import lambda_handler
+        return run_local_batches(batches, compressed, num_workers, global_grid, file_format,
+                                 sweep, sizes)
 
-    for i, curr_files in enumerate(np.array_split(all_files, num_lambdas)):
-        curr_files = curr_files.tolist()
+    for i, curr_files in enumerate(batches):
         print('curr files', curr_files)
 
         payload = json.dumps({
             'files': curr_files,
-            'compressed': compressed
+            'compressed': compressed,
+            # the mode of the fingerprint check, not the one of the lambda environment
+            'mode': mode,
+            'global': global_grid,
+            'format': file_format,
+            'sweep': sweep,
+            'sizes': batch_sizes(curr_files, sizes)
         })
 
-        if run_local:
-            response = lambda_handler(json.loads(payload))
-        else:
-            response = lmda.invoke(
-                FunctionName=lambda_function,
-                InvocationType='Event',
-                Payload=payload
-            )
+        response = lmda.invoke(
+            FunctionName=lambda_function,
+            InvocationType='Event',
+            Payload=payload
+        )
         print(response)
 
         if i == max_lambdas - 1:
@@ -146,22 +404,17 @@ def main(num_per_lambda: int = 50, use_filesystem=True, folder_names=[], exclude
 
 
 if __name__ == '__main__':
-    large_files = ['Antarctica', 'Canada',
-                   'New Zealand', 'Russia', 'United States']
-
-    main(num_per_lambda=100, check_file_complete=True, compressed=True,
-         use_filesystem=True, run_local=False,
-         exclude_folder_names=large_files
-         )
-
-    main(num_per_lambda=10, check_file_complete=True, compressed=True,
-         use_filesystem=True, run_local=False,
-         folder_names=large_files
-         )
+    failed = main(check_file_complete=True, compressed=True,
+                  use_filesystem=True, run_local=False,
+                  ) or []
 
     # wait, then run the rest
 
     sleep(60 * 15)
-    main(num_per_lambda=10, check_file_complete=True, compressed=True,
-         use_filesystem=True, run_local=False,
-         )
+    failed += main(check_file_complete=True, compressed=True,
+                   use_filesystem=True, run_local=False,
+                   ) or []
+
+    # a local run with failed files exits with an error, for cron and ci
+    if len(failed) > 0:
+        sys.exit(f'{len(failed)} files failed')
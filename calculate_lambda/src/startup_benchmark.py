@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+from glob import glob
+from time import perf_counter
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from config import process_mode
+
+# cold start benchmark. every run is a new python process, like a new
+# lambda container: the time until lambda_handler can be called (python
+# start up and the imports of main, the lambda init phase), then the time
+# of a first lambda_handler event of one file in that process, which
+# includes the modules only imported on first use and the download, write,
+# upload and catalog event of the file. the storage is a local one
+# (STORAGE=local) in a temporary folder, s3 is not used
+
+data_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../data'))
+country_data_folder = os.path.join(data_folder, 'World_2019', '11111')
+report_file_path = os.path.join(data_folder, 'startup_benchmark.csv')
+
+# modules that should not be imported by a cold start. xarray imports
+# dask on first use if it is installed, the lambda image does not have it
+heavy_modules = ['sklearn', 'scipy', 'windpowerlib', 'dask']
+
+run_code = '''
+import json
+import sys
+from time import perf_counter
+start_time = perf_counter()
+
+import main
+
+import_seconds = perf_counter() - start_time
+imported = [name for name in {heavy_modules} if name in sys.modules]
+
+start_time = perf_counter()
+response = main.lambda_handler({{'files': [{event_file!r}], 'compressed': True,
+                                 'mode': {mode!r}}})
+first_call_seconds = perf_counter() - start_time
+failed = json.loads(response['body'])['failed']
+if len(failed) > 0:
+    raise RuntimeError(failed)
+imported_first_call = [name for name in {heavy_modules}
+                       if name in sys.modules and name not in imported]
+
+print(json.dumps({{
+    'import_seconds': import_seconds,
+    'first_call_seconds': first_call_seconds,
+    'heavy_modules': ','.join(imported),
+    'heavy_modules_first_call': ','.join(imported_first_call),
+}}))
+'''
+
+
+def stage_input(file_path: str, root: str) -> str:
+    '''
+    links a MERRA-2 file into a local storage root, where the lambda
+    reads World_2019 from (see common/storage.py)
+
+    @returns event_file: str, <country>/<file name>, the file of an event
+    '''
+    event_file = os.path.join(os.path.basename(os.path.dirname(file_path)),
+                              os.path.basename(file_path))
+    staged_path = os.path.join(root, 'World_2019', '11111', event_file)
+    os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+    try:
+        os.link(file_path, staged_path)
+    except OSError:
+        shutil.copyfile(file_path, staged_path)
+    return event_file
+
+
+def run_once(event_file: str, root: str, mode: str = process_mode) -> Dict:
+    code = run_code.format(heavy_modules=heavy_modules, event_file=event_file, mode=mode)
+    env = {**os.environ, 'STORAGE': 'local', 'LOCAL_STORAGE_ROOT': root,
+           'METRICS_OUTPUT': 'off'}
+    start_time = perf_counter()
+    result = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(__file__),
+                            env=env, capture_output=True, text=True, check=True)
+    process_seconds = perf_counter() - start_time
+    # lambda_handler prints, the result is the last line
+    run = json.loads(result.stdout.strip().splitlines()[-1])
+    run['process_seconds'] = process_seconds
+    return run
+
+
+def main(num_runs: int = 20, file_path: Optional[str] = None,
+         mode: str = process_mode) -> pd.DataFrame:
+    '''
+    saves the runs to data/startup_benchmark.csv and prints the median and
+    p90 of the import, first call and whole process times
+
+    @param file_path: str, MERRA-2 file of the first call, the first local
+                      file of Germany by default
+    '''
+    if file_path is None:
+        file_paths = sorted(glob(os.path.join(country_data_folder, 'Germany', '*.nc4')))
+        if len(file_paths) == 0:
+            raise ValueError('no local files for Germany, pass a file path')
+        file_path = file_paths[0]
+
+    root = tempfile.mkdtemp()
+    try:
+        event_file = stage_input(file_path, root)
+        # one run first, so all measured runs read the modules from the page cache
+        run_once(event_file, root, mode)
+        report = pd.DataFrame([run_once(event_file, root, mode) for _ in range(num_runs)])
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    os.makedirs(data_folder, exist_ok=True)
+    report.to_csv(report_file_path, index=False)
+
+    for column in ['import_seconds', 'first_call_seconds', 'process_seconds']:
+        values = report[column].to_numpy()
+        print(f'{column}: median {np.median(values):.3f}s, '
+              f'p90 {np.percentile(values, 90):.3f}s')
+    for column, name in [('heavy_modules', 'main'),
+                         ('heavy_modules_first_call', 'the first call')]:
+        imported = set(','.join(report[column].fillna('')).split(',')) - {''}
+        print(f'heavy modules imported by {name}:', ', '.join(sorted(imported)) or 'none')
+    print('saved', report_file_path)
+
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# the lambda modules import each other by name from src, and common from
+# the repository root, like in the lambda image
+tests_folder = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(tests_folder, '../src')))
+sys.path.insert(0, os.path.abspath(os.path.join(tests_folder, '../..')))
+os.environ.setdefault('METRICS_OUTPUT', 'off')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
@@ -0,0 +1,49 @@
+import os
+
+from common.cache import ObjectCache
+
+
+def put(cache, key, data, etag, pin=False):
+    part_path = cache.part_path()
+    with open(part_path, 'wb') as f:
+        f.write(data)
+    return cache.put(key, part_path, etag, pin=pin)
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_replacing_a_pinned_entry_keeps_its_file(tmp_path):
+    cache = ObjectCache(str(tmp_path / 'cache'), 1024)
+    old = put(cache, 'a/x.nc', b'old', 'etag-1', pin=True)
+    new = put(cache, 'a/x.nc', b'new', 'etag-2', pin=True)
+
+    assert new['path'] != old['path']
+    assert read(old['path']) == b'old'
+    assert read(new['path']) == b'new'
+    assert cache.get('a/x.nc')['etag'] == 'etag-2'
+
+    # the reader of the old version does not unpin the new one
+    cache.release(old['path'])
+    assert not os.path.exists(old['path'])
+    cache.max_bytes = 0
+    cache.release(cache.get('a/x.nc', pin=True)['path'])
+    assert read(new['path']) == b'new'
+
+    cache.release(new['path'])
+    assert cache.get('a/x.nc') is None
+    assert not os.path.exists(new['path'])
+    assert cache.pins == {} and cache.retired == {}
+    assert os.listdir(os.path.join(cache.folder, '.versions')) == []
+
+
+def test_replacing_an_unpinned_entry_reuses_its_path(tmp_path):
+    cache = ObjectCache(str(tmp_path / 'cache'), 1024)
+    old = put(cache, 'x.nc', b'old', 'etag-1')
+    new = put(cache, 'x.nc', b'new', 'etag-2')
+
+    assert new['path'] == old['path'] == cache.file_path('x.nc')
+    assert read(new['path']) == b'new'
+    assert cache.num_bytes() == 3
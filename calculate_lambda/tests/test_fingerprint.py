@@ -0,0 +1,29 @@
+import fingerprint
+
+source = '''
+def wind_speed(u, v):
+    """magnitude of the wind"""
+    return (u ** 2 + v ** 2) ** 0.5
+'''
+
+
+def test_source_fingerprint_ignores_comments_and_docstrings():
+    edited = source.replace('"""magnitude of the wind"""', '# in [m/s]\n    """speed"""')
+    assert fingerprint.source_fingerprint(edited) == fingerprint.source_fingerprint(source)
+    assert fingerprint.source_fingerprint(source.replace('v ** 2', 'v ** 2 ')) \
+        == fingerprint.source_fingerprint(source)
+
+
+def test_source_fingerprint_changes_with_the_code():
+    assert fingerprint.source_fingerprint(source.replace('0.5', '0.25')) \
+        != fingerprint.source_fingerprint(source)
+
+
+def test_code_fingerprint_follows_kernel_modules(monkeypatch):
+    expected = fingerprint.code_fingerprint('array', False, 'float64')
+    assert fingerprint.code_fingerprint('array', False, 'float64') == expected
+
+    get_source = fingerprint.inspect.getsource
+    monkeypatch.setattr(fingerprint.inspect, 'getsource', lambda module: get_source(module)
+                        + ('\nroughness_length = 0.2\n' if module is fingerprint.power else ''))
+    assert fingerprint.code_fingerprint('array', False, 'float64') != expected
@@ -0,0 +1,109 @@
+import json
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+import Humidity_Calculations as HC
+
+src_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../src')
+
+
+def load_pickle(file_name: str):
+    pytest.importorskip('sklearn')
+    with open(os.path.join(src_folder, file_name), 'rb') as f:
+        return pickle.load(f)
+
+
+@pytest.fixture(scope='module')
+def samples():
+    rng = np.random.default_rng(0)
+    T_amb = rng.uniform(253.15, 303.15, 5000)  # in [K]
+    phi_amb = rng.uniform(0., 100., 5000)  # in [%]
+    return T_amb, phi_amb
+
+
+def test_evaluate_poly_matches_model(samples):
+    model = load_pickle('model.pkl')
+    poly = load_pickle('poly.pkl')
+    T_amb, phi_amb = samples
+    expected = model.predict(poly.fit_transform(np.column_stack([T_amb, phi_amb]))).ravel()
+    # blocks smaller than the input, with a partial last block
+    actual = HC.evaluate_poly(T_amb, phi_amb, block_size=1024)
+    np.testing.assert_allclose(actual, expected, rtol=1e-9, atol=1e-6)
+
+
+def test_evaluate_poly_float32(samples):
+    T_amb, phi_amb = samples
+    expected = HC.evaluate_poly(T_amb, phi_amb)
+    out = np.empty(T_amb.shape, dtype=np.float32)
+    actual = HC.evaluate_poly(T_amb.astype(np.float32), phi_amb.astype(np.float32), out=out)
+    assert actual is out
+    np.testing.assert_allclose(actual, expected, rtol=1e-3, atol=1e-2)
+
+
+def test_evaluate_poly_empty():
+    out = HC.evaluate_poly(np.empty((0, 3)), np.empty((0, 3)))
+    assert out.shape == (0, 3)
+
+
+def test_evaluate_poly_non_contiguous_out(samples):
+    T_amb, phi_amb = (values[:12].reshape(3, 4) for values in samples)
+    out = np.empty((3, 8))[:, ::2]
+    with pytest.raises(ValueError):
+        HC.evaluate_poly(T_amb, phi_amb, out=out)
+
+
+def test_convert_SH_to_RH_array_matches_scalar():
+    rng = np.random.default_rng(1)
+    sh = rng.uniform(1e-4, 2e-2, 500)
+    p_ambient = rng.uniform(60000., 105000., 500)  # in [Pa]
+    T_ambient = rng.uniform(220., 320., 500)  # in [K]
+    expected = np.array([HC.convert_SH_to_RH(*values)
+                         for values in zip(sh, p_ambient, T_ambient)])
+
+    np.testing.assert_allclose(HC.convert_SH_to_RH_array(sh, p_ambient, T_ambient),
+                               expected, rtol=1e-12)
+    out = np.empty_like(sh)
+    assert HC.convert_SH_to_RH_array(sh, p_ambient, T_ambient, out=out) is out
+    np.testing.assert_allclose(out, expected, rtol=1e-12)
+
+
+def test_coefficients_match_pickles():
+    from export_data import get_poly_coefficients
+    coef = get_poly_coefficients(load_pickle('model.pkl'), load_pickle('poly.pkl'))
+    with open(HC.coefficients_file_path) as f:
+        saved = np.array(json.load(f)['poly_coef'])
+    np.testing.assert_array_equal(saved, coef)
+    np.testing.assert_array_equal(HC.poly_coef, coef)
+
+
+def test_sed_table_matches_polynomial(samples):
+    from sed_table import SEDTable
+    table = SEDTable((253.15, 303.15), (0., 100.), 0.5, 0.5)
+    T_amb, phi_amb = samples
+    # a few samples outside of the table use the exact polynomial
+    T_amb = np.concatenate([T_amb, [240., 310.]])
+    phi_amb = np.concatenate([phi_amb, [50., 50.]])
+    expected = HC.evaluate_poly(T_amb, phi_amb)
+    np.testing.assert_allclose(table.evaluate(T_amb, phi_amb), expected,
+                               rtol=table.max_rel_error)
+
+    with pytest.raises(ValueError):
+        table.evaluate(T_amb[:12].reshape(3, 4), phi_amb[:12].reshape(3, 4),
+                       out=np.empty((3, 8))[:, ::2])
+
+
+def test_sed_table_error_bound(samples):
+    from sed_table import SEDTable
+    table = SEDTable((253.15, 303.15), (0., 100.), 0.5, 0.5)
+    T_amb, phi_amb = samples
+    expected = HC.evaluate_poly(T_amb, phi_amb)
+    errors = np.abs(table.evaluate(T_amb, phi_amb) - expected)
+    assert errors.max() <= table.max_abs_error
+    assert (errors / np.abs(expected)).max() <= table.max_rel_error
+
+    table.check(table.max_rel_error)
+    with pytest.raises(ValueError):
+        table.check(table.max_rel_error / 2)
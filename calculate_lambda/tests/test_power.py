@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from common import synthetic
+from power import get_power
+
+
+@pytest.fixture(scope='module')
+def df_main() -> pd.DataFrame:
+    return synthetic.make_input('Andorra').to_dataframe()
+
+
+@pytest.fixture(scope='module')
+def expected(df_main) -> np.ndarray:
+    return get_power(df_main, False, engine='windpowerlib')['power_output'].to_numpy()
+
+
+def test_array_engine_matches_modelchain(df_main, expected):
+    actual = get_power(df_main, False, engine='array', dtype='float64')['power_output']
+    assert actual.index.equals(df_main.index)
+    # the synthetic winds cover the whole power curve
+    assert expected.min() == 0 and expected.max() > 2e6
+    np.testing.assert_allclose(actual.to_numpy(), expected, rtol=1e-6, atol=1e-3)
+
+
+def test_array_engine_float32(df_main, expected):
+    actual = get_power(df_main, False, engine='array', dtype='float32')['power_output']
+    np.testing.assert_allclose(actual.to_numpy(), expected, rtol=1e-4, atol=1.)
+
+
+def test_output_all_columns(df_main):
+    output_df = get_power(df_main, True, engine='array')
+    assert list(output_df.columns) == list(df_main.columns) + ['power_output']
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+import io
+import os
+import json
+import platform
+import subprocess
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# timing helpers of the benchmark scripts (benchmark.py in both lambdas).
+# the results are saved as json with the commit and the library versions,
+# data/benchmark/<suite>_<commit>.json, so the runs of two versions can be
+# compared with compare_results
+
+results_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '../data/benchmark'))
+
+# a case is a regression if its median time grew by more than this, and
+# by more than min seconds, the times of the smallest cases are noise
+regression_tolerance = 0.2
+regression_min_seconds = 0.002
+
+
+def git_commit() -> str:
+    '''
+    short hash of the checked out commit, with a + if there are changes
+    '''
+    folder = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=folder,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        changes = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                 cwd=folder, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return commit + ('+' if changes else '')
+
+
+def environment() -> Dict[str, str]:
+    import pandas as pd
+    import xarray as xr
+    return {
+        'commit': git_commit(),
+        'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'xarray': xr.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': str(os.cpu_count()),
+    }
+
+
+def measure(fn: Callable, setup: Optional[Callable[[], Tuple]] = None,
+            repeats: int = 5, quiet: bool = True) -> Dict[str, float]:
+    '''
+    times fn(*setup()) repeats times after a warm up call, setup is not
+    timed. then one more call under tracemalloc for the peak memory
+    allocated by the call, numpy arrays included, the buffers of the
+    netcdf / hdf5 libraries are not. the prints of fn are dropped if quiet
+
+    @returns measurement: dict, median and min seconds, peak_mb
+    '''
+    setup = setup or tuple
+
+    def call(args: Tuple) -> None:
+        if quiet:
+            with redirect_stdout(io.StringIO()):
+                fn(*args)
+        else:
+            fn(*args)
+
+    call(setup())
+    seconds = []
+    for _ in range(repeats):
+        args = setup()
+        start_time = perf_counter()
+        call(args)
+        seconds.append(perf_counter() - start_time)
+
+    args = setup()
+    tracemalloc.start()
+    try:
+        call(args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'seconds': float(np.median(seconds)),
+        'seconds_min': float(np.min(seconds)),
+        'peak_mb': peak / 1024 ** 2,
+    }
+
+
+def case_result(benchmark: str, mode: str, country_name: str, cells: int, hours: int,
+                measurement: Dict[str, float]) -> Dict:
+    '''
+    one row of the results, the throughput is in cells * hours per second
+    '''
+    return {
+        'benchmark': benchmark,
+        'mode': mode,
+        'country': country_name,
+        'cells': cells,
+        'hours': hours,
+        **measurement,
+        'cells_hours_per_second': cells * hours / measurement['seconds'],
+    }
+
+
+def results_file_path(suite: str, commit: Optional[str] = None) -> str:
+    return os.path.join(results_folder, f'{suite}_{commit or git_commit()}.json')
+
+
+def save_results(suite: str, results: List[Dict]) -> str:
+    '''
+    @returns file_path: str
+    '''
+    env = environment()
+    os.makedirs(results_folder, exist_ok=True)
+    file_path = results_file_path(suite, env['commit'])
+    with open(file_path, 'w') as f:
+        json.dump({'suite': suite, 'environment': env, 'results': results}, f, indent=1)
+    return file_path
+
+
+def load_results(file_path: str) -> Dict:
+    with open(file_path) as f:
+        return json.load(f)
+
+
+def case_key(result: Dict) -> Tuple:
+    return (result['benchmark'], result.get('mode', ''), result['country'],
+            result.get('dtype', ''))
+
+
+def compare_results(results: List[Dict], baseline: List[Dict],
+                    tolerance: float = regression_tolerance) -> List[Dict]:
+    '''
+    compares the median times of the cases in both runs
+
+    @returns regressions: List[dict], cases more than tolerance slower
+    '''
+    baseline_by_case = {case_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        base = baseline_by_case.get(case_key(result))
+        if base is None:
+            continue
+        ratio = result['seconds'] / base['seconds']
+        if ratio > 1 + tolerance and \
+                result['seconds'] - base['seconds'] > regression_min_seconds:
+            regressions.append({**dict(zip(['benchmark', 'mode', 'country', 'dtype'],
+                                           case_key(result))),
+                                'seconds': result['seconds'],
+                                'baseline_seconds': base['seconds'], 'ratio': ratio})
+    return regressions
+
+
+def print_results(results: List[Dict]) -> None:
+    for result in results:
+        name = result['benchmark'] + (f'[{result["mode"]}]' if result.get('mode') else '')
+        print(f'{name:28} {result["country"]:14} {result["cells"]:7} cells '
+              f'{result["seconds"]:8.4f}s {result["cells_hours_per_second"]:12.0f} cell h/s '
+              f'{result["peak_mb"]:8.1f} MB')
+
+
+def report(suite: str, results: List[Dict], baseline_commit: Optional[str] = None,
+           tolerance: float = regression_tolerance) -> List[Dict]:
+    '''
+    prints and saves the results, and compares them to the results of the
+    baseline commit if given
+
+    @returns regressions: List[dict], see compare_results
+    '''
+    print_results(results)
+    # before saving, the baseline may be an earlier run of this commit
+    baseline = None
+    if baseline_commit is not None:
+        baseline = load_results(results_file_path(suite, baseline_commit))['results']
+    print('saved', save_results(suite, results))
+    if baseline is None:
+        return []
+
+    regressions = compare_results(results, baseline, tolerance)
+    for regression in regressions:
+        print(f'regression {regression["benchmark"]}[{regression["mode"]}] '
+              f'{regression["country"]}: {regression["seconds"]:.4f}s, '
+              f'{regression["ratio"]:.2f}x of {regression["baseline_seconds"]:.4f}s')
+    if len(regressions) == 0:
+        print(f'no regressions against {baseline_commit}')
+    return regressions
+
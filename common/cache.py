@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# local copies of s3 objects that outlive one lambda invocation. a warm
+# container keeps the process and /tmp, so a module level cache lets
+# retries and re-runs that land on it skip the downloads. an entry is
+# only used for the etag it was downloaded with, and the least recently
+# used entries are evicted to keep the files below a byte budget (the
+# ephemeral storage is 512 MB by default, up to 10 GB)
+
+
+def process_folder(folder: str) -> str:
+    '''
+    cache folder of this process under folder, processes that share /tmp
+    (the workers of a local pool) keep their files apart. the folders of
+    processes that ended, e.g. of a lambda runtime that was restarted,
+    are removed
+    '''
+    if os.path.isdir(folder):
+        for name in os.listdir(folder):
+            if name.isdigit() and int(name) != os.getpid() and not running(int(name)):
+                shutil.rmtree(os.path.join(folder, name), ignore_errors=True)
+    return os.path.join(folder, str(os.getpid()))
+
+
+def running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # a process of another user
+        pass
+    return True
+
+
+class ObjectCache:
+    '''
+    index of the cached files by s3 key, in memory, most recently used
+    last. entries in use are pinned and never evicted, callers pin an
+    entry while they read its file and release it afterwards, so with a
+    budget of 0 nothing is kept once released. pins are per file, so an
+    entry replaced while pinned keeps its file until its readers release
+    it, and the new version is written under another path
+    '''
+
+    def __init__(self, folder: str, max_bytes: int):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.entries: 'OrderedDict[str, dict]' = OrderedDict()
+        # pin counts by file path, one path per version of a key
+        self.pins: Dict[str, int] = {}
+        # replaced entries by file path, kept until they are released
+        self.retired: Dict[str, dict] = {}
+        # parsed objects by key, with the etag of the file they came from
+        self.parsed: Dict[str, Tuple[str, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.hit_bytes = 0
+        self.lock = threading.Lock()
+        # files of an earlier process are not in the index. the folder is
+        # only used by this process, see process_folder
+        shutil.rmtree(folder, ignore_errors=True)
+
+    def file_path(self, key: str) -> str:
+        return os.path.join(self.folder, key)
+
+    def num_bytes(self) -> int:
+        entries = list(self.entries.values()) + list(self.retired.values())
+        return sum(entry['size'] for entry in entries)
+
+    def get(self, key: str, etag: Optional[str] = None, pin: bool = False) -> Optional[dict]:
+        '''
+        the entry of key if its file is cached with this etag (any etag if
+        None), and marks it as recently used
+
+        @returns entry: dict with path, etag, version_id and size, None if
+                 it is not cached
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or (etag is not None and entry['etag'] != etag):
+                return None
+            if not os.path.exists(entry['path']):
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            if pin:
+                self.pins[entry['path']] = self.pins.get(entry['path'], 0) + 1
+            return dict(entry)
+
+    def put(self, key: str, file_path: str, etag: str, version_id: Optional[str] = None,
+            pin: bool = False) -> dict:
+        '''
+        moves a downloaded file into the cache as the entry of key,
+        replacing the entry of another version, then evicts down to the
+        budget. the replaced entry is kept until it is released if it is
+        pinned
+
+        @returns entry: dict, see get
+        '''
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            path = self.file_path(key)
+            if path in self.retired:
+                # the path is still read by the pins of an older version
+                path = os.path.join(self.folder, '.versions', os.urandom(8).hex(),
+                                    os.path.basename(key))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(file_path, path)
+            entry = {'path': path, 'etag': etag, 'version_id': version_id,
+                     'size': os.path.getsize(path)}
+            self.entries[key] = entry
+            if pin:
+                self.pins[path] = self.pins.get(path, 0) + 1
+            self._evict()
+            return dict(entry)
+
+    def put_bytes(self, key: str, data: bytes, etag: str,
+                  version_id: Optional[str] = None) -> Optional[dict]:
+        '''
+        same as put, for an object read into memory. it is only written if
+        it fits in the free part of the budget, so it never evicts the
+        files of other keys
+        '''
+        with self.lock:
+            if self.num_bytes() + len(data) > self.max_bytes:
+                return None
+        part_path = self.part_path()
+        with open(part_path, 'wb') as f:
+            f.write(data)
+        return self.put(key, part_path, etag, version_id)
+
+    def link(self, entry: dict, file_path: str) -> None:
+        '''
+        makes the file of an entry also available at file_path, a hard
+        link that stays valid when the entry is evicted
+        '''
+        try:
+            os.link(entry['path'], file_path)
+        except OSError:
+            # another file system
+            shutil.copyfile(entry['path'], file_path)
+
+    def part_path(self) -> str:
+        '''
+        path for a download in progress, moved into the cache with put
+        '''
+        folder = os.path.join(self.folder, '.part')
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, os.urandom(8).hex())
+
+    def fetch(self, key: str, etag: Optional[str], download: Callable[[str], dict],
+              pin: bool = False) -> dict:
+        '''
+        the cached file of key if it has this etag, otherwise downloads it
+        with download(file_path), which returns a dict with the etag (and
+        version_id) of what it downloaded
+
+        @returns entry: dict, see get
+        '''
+        entry = self.get(key, etag, pin)
+        if entry is not None:
+            self.record(True, entry['size'])
+            return entry
+
+        self.record(False)
+        part_path = self.part_path()
+        try:
+            info = download(part_path)
+        except Exception:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+        return self.put(key, part_path, info['etag'], info.get('version_id'), pin)
+
+    def parse(self, key: str, etag: str, parse: Callable[[str], Any],
+              download: Callable[[str], dict]) -> Any:
+        '''
+        parse(file_path) of the object, parsed once per etag and kept in
+        memory, e.g. grid metadata read on every invocation
+        '''
+        with self.lock:
+            parsed = self.parsed.get(key)
+        if parsed is not None and parsed[0] == etag:
+            self.record(True)
+            return parsed[1]
+
+        entry = self.fetch(key, etag, download, pin=True)
+        try:
+            value = parse(entry['path'])
+        finally:
+            self.release(entry['path'])
+        with self.lock:
+            self.parsed[key] = (entry['etag'], value)
+        return value
+
+    def release(self, path: str) -> None:
+        '''
+        unpins the entry with the file path pinned by get, put or fetch,
+        the path of the entry they returned
+        '''
+        with self.lock:
+            if self.pins.get(path, 0) > 1:
+                self.pins[path] -= 1
+            else:
+                self.pins.pop(path, None)
+                if path in self.retired:
+                    self._delete(self.retired.pop(path))
+            self._evict()
+
+    def record(self, hit: bool, num_bytes: int = 0) -> None:
+        with self.lock:
+            if hit:
+                self.hits += 1
+                self.hit_bytes += num_bytes
+            else:
+                self.misses += 1
+
+    def stats(self) -> str:
+        return (f'cache {self.hits} hits ({self.hit_bytes / 1024 ** 2:.1f} MB not downloaded), '
+                f'{self.misses} misses, {len(self.entries)} files, '
+                f'{self.num_bytes() / 1024 ** 2:.1f} of {self.max_bytes / 1024 ** 2:.0f} MB')
+
+    def _remove(self, key: str) -> None:
+        entry = self.entries.pop(key)
+        if entry['path'] in self.pins:
+            self.retired[entry['path']] = entry
+        else:
+            self._delete(entry)
+
+    def _delete(self, entry: dict) -> None:
+        if os.path.exists(entry['path']):
+            os.remove(entry['path'])
+        folder = os.path.dirname(entry['path'])
+        if os.path.dirname(folder) == os.path.join(self.folder, '.versions'):
+            os.rmdir(folder)
+
+    def _evict(self) -> None:
+        '''
+        removes the least recently used entries that are not pinned until
+        the files fit in the budget, with the lock held
+        '''
+        num_bytes = self.num_bytes()
+        for key in list(self.entries):
+            if num_bytes <= self.max_bytes:
+                break
+            if self.entries[key]['path'] in self.pins:
+                continue
+            num_bytes -= self.entries[key]['size']
+            self._remove(key)
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+import os
+import re
+import json
+import sqlite3
+from time import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional
+
+from common.storage import storage_backend
+
+# local index of the objects in the bucket, so scheduling and status
+# reports do not list the whole bucket every time. the local storage
+# (STORAGE=local) has an index of its own
+catalog_file_path = os.getenv('CATALOG_PATH', os.path.abspath(os.path.join(
+    os.path.dirname(__file__), '../data',
+    'catalog.sqlite' if storage_backend == 's3' else f'catalog_{storage_backend}.sqlite')))
+
+# the lambdas write one json object per invocation here, listing the
+# objects they wrote: {"records": [{"key", "size", "etag", "metadata"}]}.
+# the keys start with the utc time, so new events sort after old ones
+events_folder = 'catalog_events'
+
+# events are listed starting this long before the newest event applied,
+# so events written late by a slow lambda are not skipped
+event_overlap = timedelta(minutes=20)
+
+stages = {
+    'World_2019': 'input',
+    'World_2019_global': 'input_global',
+    'output': 'output',
+    'output_compressed': 'output_compressed',
+    'output_global': 'output_global',
+    'output_aggregated': 'output_aggregated',
+    # turbine / hub height sweep
+    'output_sweep': 'output_sweep',
+    'output_aggregated_sweep': 'output_aggregated_sweep',
+    # parquet store, see common/store.py
+    'store_daily': 'store_daily',
+    'store_aggregated': 'store_aggregated',
+}
+
+date_pattern = re.compile(r'\.(\d{8})\.(?:nc4|parquet)$')
+
+schema = '''
+create table if not exists objects (
+    key text primary key,
+    stage text not null,
+    country text,
+    date text,
+    size integer,
+    etag text,
+    metadata text,
+    updated real not null
+);
+create index if not exists objects_stage_country on objects (stage, country);
+create table if not exists events (key text primary key);
+create table if not exists listings (folder text primary key, updated real not null);
+'''
+
+
+def list_objects(storage, prefix: str = '', start_after: str = '',
+                 progress: bool = True) -> Iterator[dict]:
+    '''
+    all objects under prefix, see list of common/storage.py
+    '''
+    # not in the lambda images, which only import event_key
+    from tqdm import tqdm
+    return tqdm(storage.list(prefix, start_after), disable=not progress, unit=' objects')
+
+
+def event_key(now: Optional[datetime] = None) -> str:
+    '''
+    key of a new event object of a lambda, see events_folder
+    '''
+    now = now if now is not None else datetime.now(timezone.utc)
+    return os.path.join(events_folder, f'{now:%Y%m%dT%H%M%S%f}-{os.urandom(8).hex()}.json')
+
+
+def event_time(key: str) -> datetime:
+    return datetime.strptime(os.path.basename(key).split('-')[0], '%Y%m%dT%H%M%S%f')
+
+
+def parse_key(key: str) -> Dict[str, Optional[str]]:
+    '''
+    stage, country and date of an object key, None where it does not apply
+    '''
+    parts = key.split('/')
+    stage = stages.get(parts[0], parts[0])
+    country = None
+    if stage in ('output_aggregated', 'output_aggregated_sweep') and len(parts) == 2:
+        country = os.path.splitext(parts[1])[0]
+    elif len(parts) >= 3:
+        country = parts[1]
+    match = date_pattern.search(key)
+    date = match.group(1) if match is not None else None
+    return {'stage': stage, 'country': country, 'date': date}
+
+
+class Catalog:
+    '''
+    sqlite index of the bucket with key, size, etag, country, date and
+    stage of every object. kept up to date from the event objects the
+    lambdas write, or from a full listing of a folder
+    '''
+
+    def __init__(self, file_path: str = catalog_file_path):
+        '''
+        @param file_path: str, ':memory:' for a catalog that is not saved
+        '''
+        if os.path.dirname(file_path) != '':
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        self.connection = sqlite3.connect(file_path)
+        self.connection.executescript(schema)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def upsert(self, key: str, size: int, etag: Optional[str],
+               metadata: Optional[Dict[str, str]] = None) -> None:
+        '''
+        adds or updates one object. metadata of an unchanged object is kept
+        if none is given, it is dropped if the etag changed
+        '''
+        etag = etag.strip('"') if etag is not None else None
+        info = parse_key(key)
+        self.connection.execute('''
+            insert into objects (key, stage, country, date, size, etag, metadata, updated)
+            values (?, ?, ?, ?, ?, ?, ?, ?)
+            on conflict (key) do update set
+                size = excluded.size,
+                etag = excluded.etag,
+                metadata = case
+                    when excluded.metadata is not null then excluded.metadata
+                    when objects.etag is excluded.etag then objects.metadata
+                    else null end,
+                updated = excluded.updated
+            ''', (key, info['stage'], info['country'], info['date'], size, etag,
+                  json.dumps(metadata) if metadata is not None else None, time()))
+
+    def set_metadata(self, all_metadata: Dict[str, Dict[str, str]]) -> None:
+        '''
+        saves the s3 metadata of objects by key
+        '''
+        self.connection.executemany('update objects set metadata = ? where key = ?',
+                                    [(json.dumps(metadata), key)
+                                     for key, metadata in all_metadata.items()])
+        self.connection.commit()
+
+    def refresh(self, storage, folder: str) -> None:
+        '''
+        lists the folder and applies the difference to the catalog, adding
+        new, updating changed and removing deleted objects
+        '''
+        start_time = time()
+        prefix = folder.rstrip('/') + '/'
+        known = {key: etag for key, etag in self.connection.execute(
+            'select key, etag from objects where substr(key, 1, ?) = ?',
+            (len(prefix), prefix))}
+
+        num_added = 0
+        num_changed = 0
+        for content in list_objects(storage, prefix):
+            key = content['key']
+            etag = content['etag'].strip('"')
+            if key not in known:
+                num_added += 1
+            elif known[key] != etag:
+                num_changed += 1
+            if known.pop(key, None) != etag:
+                self.upsert(key, content['size'], etag)
+
+        self.connection.executemany('delete from objects where key = ?',
+                                    [(key,) for key in known])
+        self.connection.execute('insert or replace into listings values (?, ?)',
+                                (folder, time()))
+        self.connection.commit()
+        print(f'catalog refresh {folder}: {num_added} added, {num_changed} changed, '
+              f'{len(known)} removed, time {time() - start_time:.1f}s')
+
+    def apply_events(self, storage) -> None:
+        '''
+        applies the event objects written since the last call
+        '''
+        start_time = time()
+        newest = self.connection.execute('select max(key) from events').fetchone()[0]
+        start_after = ''
+        if newest is not None:
+            start_after = os.path.join(
+                events_folder, f'{event_time(newest) - event_overlap:%Y%m%dT%H%M%S%f}')
+
+        num_events = 0
+        num_records = 0
+        for content in list_objects(storage, events_folder + '/', start_after, progress=False):
+            key = content['key']
+            if self.connection.execute('select 1 from events where key = ?', (key,)).fetchone():
+                continue
+            event = json.loads(storage.read(key))
+            for record in event['records']:
+                self.upsert(record['key'], record['size'], record.get('etag'),
+                            record.get('metadata'))
+            self.connection.execute('insert into events values (?)', (key,))
+            num_events += 1
+            num_records += len(event['records'])
+
+        self.connection.commit()
+        print(f'catalog applied {num_events} events with {num_records} objects, '
+              f'time {time() - start_time:.1f}s')
+
+    def update(self, storage, folders: List[str], refresh: bool = False) -> None:
+        '''
+        brings the catalog up to date for the folders, with a full listing
+        of the ones never listed before (or all if refresh), then the events
+        '''
+        for folder in folders:
+            listed = self.connection.execute(
+                'select 1 from listings where folder = ?', (folder,)).fetchone()
+            if refresh or listed is None:
+                self.refresh(storage, folder)
+        self.apply_events(storage)
+
+    def objects(self, stage: str, country: Optional[str] = None) -> Dict[str, dict]:
+        '''
+        objects of a stage (and country) by key
+        '''
+        query = 'select key, country, date, size, etag, metadata from objects where stage = ?'
+        args = [stage]
+        if country is not None:
+            query += ' and country = ?'
+            args.append(country)
+        return {key: {'key': key, 'country': country, 'date': date, 'size': size, 'etag': etag,
+                      'metadata': json.loads(metadata) if metadata is not None else None}
+                for key, country, date, size, etag, metadata
+                in self.connection.execute(query, args)}
+
+    def keys(self, stage: str, country: Optional[str] = None) -> List[str]:
+        query = 'select key from objects where stage = ?'
+        args = [stage]
+        if country is not None:
+            query += ' and country = ?'
+            args.append(country)
+        return [key for key, in self.connection.execute(query + ' order by key', args)]
+
+    def countries(self, stage: str) -> List[str]:
+        return [country for country, in self.connection.execute(
+            'select distinct country from objects where stage = ? and country is not null '
+            'order by country', (stage,))]
+
+    def counts(self, stage: str) -> Dict[str, int]:
+        '''
+        number of objects per country in a stage
+        '''
+        return dict(self.connection.execute(
+            'select country, count(*) from objects where stage = ? and country is not null '
+            'group by country order by country', (stage,)))
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+import io
+import os
+import sys
+import json
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from time import perf_counter
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# end to end load test of the pipeline without aws. the synthetic inputs
+# (synthetic.py) are written to a local s3 stand-in (local_s3.py), then
+# the lambda_handler of the calculate lambda and of the reduce lambda run
+# on pools of worker processes against it. a worker is like a warm lambda
+# container, it imports main once and runs one invocation after the other.
+# reports files/s, the bytes moved and the latency of the invocations of
+# each stage, and saves them to data/benchmark/load_test_<commit>.json.
+# with storage='local' the workers use the local storage of storage.py on
+# the same folder instead, to compare with the in place reads
+
+repository_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(repository_folder)
+lambda_folders = {
+    'calculate': os.path.join(repository_folder, 'calculate_lambda', 'src'),
+    'reduce': os.path.join(repository_folder, 'reduce_lambda', 'src'),
+}
+
+s3_bucket = 'tori-calculate-wind-power'
+input_bucket_folder = 'World_2019'
+
+percentiles = [50, 90, 99]
+
+# state of a worker process, set by init_worker
+worker = {}
+
+
+def init_worker(stage: str, root: str, environment: Dict[str, str], request_seconds: float,
+                bandwidth: Optional[float], storage: str = 's3') -> None:
+    '''
+    imports main of the stage with the environment (config.py reads it on
+    import), and points it at the stand-in (or the local storage) and at a
+    /tmp of its own
+    '''
+    os.environ.update(environment)
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.chdir(lambda_folders[stage])
+    sys.path.insert(0, lambda_folders[stage])
+
+    from common.cache import ObjectCache
+    from common.local_s3 import LocalS3
+    from common.storage import S3Storage, LocalStorage
+    with redirect_stdout(io.StringIO()):
+        import main
+
+    tmp_folder = os.path.join(root, '.lambda_tmp', str(os.getpid()))
+    os.makedirs(tmp_folder, exist_ok=True)
+    if storage == 'local':
+        main.storage = LocalStorage(os.path.join(root, s3_bucket), mounts={})
+        worker['stats'] = dict
+    else:
+        client = LocalS3(root, request_seconds=request_seconds, bandwidth=bandwidth)
+        main.storage = S3Storage(s3_bucket, client=client)
+        worker['stats'] = client.stats
+    main.tmp_folder = tmp_folder
+    # the module level cache is under /tmp, keep the files under root
+    cache_name = 'input_cache' if stage == 'calculate' else 'cache'
+    old_cache = getattr(main, cache_name)
+    setattr(main, cache_name, ObjectCache(os.path.join(tmp_folder, 'cache'), old_cache.max_bytes))
+
+    worker['main'] = main
+    worker['stage'] = stage
+
+
+def run_invocation(event: dict) -> dict:
+    '''
+    one lambda invocation in a worker
+
+    @returns invocation: dict with the seconds, the failed files and the
+             requests and bytes of the invocation
+    '''
+    from common.metrics import parse_spans
+
+    main = worker['main']
+    before = worker['stats']()
+    start_time = perf_counter()
+    failed = []
+    output = io.StringIO()
+    try:
+        with redirect_stdout(output):
+            response = main.lambda_handler(event)
+        failed = json.loads(response['body']).get('failed', [])
+    except Exception as error:
+        failed = [{'event': json.dumps(event), 'error': repr(error)}]
+    seconds = perf_counter() - start_time
+    after = worker['stats']()
+
+    return {
+        'stage': worker['stage'],
+        'pid': os.getpid(),
+        'seconds': seconds,
+        'files': len(event['files']) if 'files' in event else 1,
+        'failed': failed,
+        'io': {name: after[name] - before.get(name, 0) for name in after},
+        # the json lines of the stage spans (common/metrics.py)
+        'spans': parse_spans(output.getvalue().splitlines()),
+    }
+
+
+def seed_inputs(root: str, country_names: List[str], num_days: int) -> Dict[str, List[str]]:
+    '''
+    writes the synthetic inputs to the input folder of the bucket
+
+    @returns files: Dict[str, List[str]], file paths relative to the input
+             folder by country, as in the calculate events
+    '''
+    from common import synthetic
+    folder = os.path.join(root, s3_bucket, input_bucket_folder)
+    files = {}
+    for country_name in country_names:
+        file_paths = synthetic.write_inputs(folder, country_name, num_days)
+        files[country_name] = [os.path.relpath(file_path, folder) for file_path in file_paths]
+    return files
+
+
+def run_stage(stage: str, events: List[dict], root: str, num_workers: int,
+              environment: Dict[str, str], request_seconds: float,
+              bandwidth: Optional[float], storage: str = 's3') -> dict:
+    '''
+    runs the events on a pool of workers, in the order given. spawned
+    workers, so the main modules of the two stages do not mix
+
+    @returns summary: dict, see summarize
+    '''
+    context = multiprocessing.get_context('spawn')
+    invocations = []
+    start_time = perf_counter()
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=context,
+                             initializer=init_worker,
+                             initargs=(stage, root, environment, request_seconds,
+                                       bandwidth, storage)) as pool:
+        futures = [pool.submit(run_invocation, event) for event in events]
+        for future in as_completed(futures):
+            invocations.append(future.result())
+    seconds = perf_counter() - start_time
+
+    summary = summarize(stage, invocations, seconds)
+    print(f"{stage}: {summary['invocations']} invocations, {summary['files']} files "
+          f"in {seconds:.2f}s, {summary['files_per_second']:.2f} files/s, "
+          f"p50 {summary['latency_p50']:.3f}s, p99 {summary['latency_p99']:.3f}s, "
+          f"{summary['bytes_down'] / 1024 ** 2:.1f} MB down, "
+          f"{summary['bytes_up'] / 1024 ** 2:.1f} MB up, {len(summary['failed'])} failed")
+    for name, spans in sorted(summary['spans'].items(), key=lambda item: -item[1]['seconds']):
+        print(f"  {name}: {spans['spans']} spans, {spans['seconds']:.2f}s, "
+              f"p50 {spans['p50']:.4f}s, p99 {spans['p99']:.4f}s")
+    return summary
+
+
+def summarize(stage: str, invocations: List[dict], seconds: float) -> dict:
+    '''
+    files/s over the wall time of the stage, percentiles of the latency of
+    the invocations and of the seconds per file, the sums of the requests
+    and bytes, and the percentiles of the spans of every stage
+    '''
+    from common.metrics import summarize as summarize_spans
+
+    latencies = np.array([invocation['seconds'] for invocation in invocations])
+    per_file = np.array([invocation['seconds'] / max(invocation['files'], 1)
+                         for invocation in invocations])
+    files = sum(invocation['files'] for invocation in invocations)
+    io_totals = {}
+    for invocation in invocations:
+        for name, value in invocation['io'].items():
+            io_totals[name] = io_totals.get(name, 0) + value
+
+    summary = {
+        'stage': stage,
+        'invocations': len(invocations),
+        'files': files,
+        'workers': len({invocation['pid'] for invocation in invocations}),
+        'seconds': seconds,
+        'files_per_second': files / seconds,
+        'bytes_down': io_totals.pop('bytes_down', 0),
+        'bytes_up': io_totals.pop('bytes_up', 0),
+        'requests': io_totals,
+        'failed': [failure for invocation in invocations for failure in invocation['failed']],
+        'spans': summarize_spans([record for invocation in invocations
+                                  for record in invocation['spans']])['stages'],
+    }
+    for percentile in percentiles:
+        summary[f'latency_p{percentile}'] = float(np.percentile(latencies, percentile))
+        summary[f'file_seconds_p{percentile}'] = float(np.percentile(per_file, percentile))
+    summary['latency_max'] = float(latencies.max())
+    return summary
+
+
+def main(country_names: List[str] = ['Andorra', 'Germany', 'United States'],
+         num_days: int = 4, files_per_invocation: int = 2,
+         num_workers: int = os.cpu_count() or 1, file_format: str = 'netcdf',
+         request_seconds: float = 0., bandwidth: Optional[float] = None,
+         event_options: dict = {}, root: Optional[str] = None,
+         storage: str = 's3') -> List[dict]:
+    '''
+    @param files_per_invocation: int, files of a calculate invocation, the
+                                 batches are per country like in start_lambdas
+    @param file_format: str, daily outputs, 'netcdf' or 'parquet'
+    @param request_seconds, bandwidth: see LocalS3, e.g. 0.02 and 80e6 to
+                                       model s3 from a lambda
+    @param event_options: dict, more fields of the calculate events, e.g.
+                          {'in_memory': True, 'prefetch_depth': 2,
+                           'prefetch_max_bytes': 256 * 1024 ** 2}
+    @param root: str, folder of the stand-in, a temporary folder by default
+    @param storage: str, 's3' for the stand-in, 'local' for the local
+                    storage, without requests to count
+    @returns summaries: List[dict], of the calculate and reduce stages and
+             of the whole pipeline
+    '''
+    from common.benchmark import save_results
+
+    with tempfile.TemporaryDirectory() as tmp_root:
+        root = root or tmp_root
+        files = seed_inputs(root, country_names, num_days)
+        environment = {'INPUT_FORMAT': file_format, 'OUTPUT_FORMAT': file_format}
+
+        calculate_events = [
+            {'files': country_files[i:i + files_per_invocation], 'compressed': True,
+             'format': file_format, **event_options}
+            for country_files in files.values()
+            for i in range(0, len(country_files), files_per_invocation)]
+        reduce_events = [{'country': country_name, 'compressed': True, 'incremental': False}
+                         for country_name in country_names]
+
+        start_time = perf_counter()
+        summaries = [
+            run_stage('calculate', calculate_events, root, num_workers, environment,
+                      request_seconds, bandwidth, storage),
+            run_stage('reduce', reduce_events, root, num_workers, environment,
+                      request_seconds, bandwidth, storage),
+        ]
+        seconds = perf_counter() - start_time
+
+    num_files = summaries[0]['files']
+    pipeline = {
+        'stage': 'pipeline',
+        'countries': len(country_names),
+        'files': num_files,
+        'seconds': seconds,
+        'files_per_second': num_files / seconds,
+        'bytes_down': sum(summary['bytes_down'] for summary in summaries),
+        'bytes_up': sum(summary['bytes_up'] for summary in summaries),
+        'workers': num_workers,
+        'files_per_invocation': files_per_invocation,
+        'file_format': file_format,
+        'request_seconds': request_seconds,
+        'bandwidth': bandwidth,
+        'event_options': event_options,
+        'storage': storage,
+    }
+    print(f"pipeline: {num_files} files of {len(country_names)} countries in {seconds:.2f}s, "
+          f"{pipeline['files_per_second']:.2f} files/s, "
+          f"{(pipeline['bytes_down'] + pipeline['bytes_up']) / 1024 ** 2:.1f} MB moved")
+
+    summaries.append(pipeline)
+    print('saved', save_results('load_test', summaries))
+    return summaries
+
+
+if __name__ == '__main__':
+    main()
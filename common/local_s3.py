@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+import io
+import os
+import json
+import shutil
+import hashlib
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from time import sleep, time_ns
+from typing import Dict, Iterator, Optional
+
+from botocore.exceptions import ClientError
+
+# local stand-in for the s3 client of the lambdas, for load tests without
+# aws (see load_test.py). a folder is the storage, root/<bucket>/<key> is
+# the current version of an object, so files copied into it (e.g. the
+# synthetic inputs) are objects too. the etag, version id and metadata are
+# in root/.meta/<bucket>/<key>.json, computed on first use for files put
+# there by hand, and older versions are kept in root/.versions if
+# versioning is on. several processes can share a root as long as they do
+# not write the same key at the same time, like the lambda stages
+#
+# only the calls of this repository are supported: get_object (VersionId,
+# IfNoneMatch), head_object, put_object, upload_file, download_file,
+# list_objects_v2 and its paginator. request latency and bandwidth can be
+# set to model s3 instead of the local disk
+
+page_size = 1000
+
+
+def client_error(code: str, status: int, operation: str, message: str = '') -> ClientError:
+    return ClientError({
+        'Error': {'Code': code, 'Message': message},
+        'ResponseMetadata': {'HTTPStatusCode': status},
+    }, operation)
+
+
+class LocalS3:
+    '''
+    @param request_seconds: float, latency added to every request
+    @param bandwidth: float, bytes per second of each transfer, None for
+                      the speed of the disk
+    '''
+
+    def __init__(self, root: str, versioning: bool = True, request_seconds: float = 0.,
+                 bandwidth: Optional[float] = None):
+        self.root = root
+        self.versioning = versioning
+        self.request_seconds = request_seconds
+        self.bandwidth = bandwidth
+        # requests by operation, and bytes_down / bytes_up
+        self.counters = Counter()
+        self.lock = threading.Lock()
+
+    def object_path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, key)
+
+    def meta_path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, '.meta', bucket, key + '.json')
+
+    def version_path(self, bucket: str, key: str, version_id: str) -> str:
+        return os.path.join(self.root, '.versions', bucket, key, version_id)
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counters)
+
+    def request(self, operation: str, num_bytes: int = 0, direction: str = 'down') -> None:
+        '''
+        counts a request and sleeps for the modelled latency and transfer
+        '''
+        with self.lock:
+            self.counters[operation] += 1
+            self.counters[f'bytes_{direction}'] += num_bytes
+        seconds = self.request_seconds
+        if self.bandwidth is not None:
+            seconds += num_bytes / self.bandwidth
+        if seconds > 0:
+            sleep(seconds)
+
+    def read_meta(self, bucket: str, key: str) -> Optional[dict]:
+        '''
+        etag, version id and metadata of the current version, None if the
+        object does not exist
+        '''
+        file_path = self.object_path(bucket, key)
+        try:
+            stat = os.stat(file_path)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        try:
+            with open(self.meta_path(bucket, key)) as f:
+                meta = json.load(f)
+            if meta['size'] == stat.st_size and meta['mtime_ns'] == stat.st_mtime_ns:
+                return meta
+        except (FileNotFoundError, ValueError):
+            pass
+
+        # a file put there by hand, or changed since
+        md5 = hashlib.md5()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(2 ** 20), b''):
+                md5.update(block)
+        meta = {'etag': f'"{md5.hexdigest()}"', 'version_id': 'null', 'metadata': {},
+                'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        self.write_meta(self.meta_path(bucket, key), meta)
+        return meta
+
+    def write_meta(self, meta_path: str, meta: dict) -> None:
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        tmp_path = f'{meta_path}.{os.getpid()}.{threading.get_ident()}'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def response(self, meta: dict) -> dict:
+        return {
+            'ETag': meta['etag'],
+            'VersionId': meta['version_id'],
+            'ContentLength': meta['size'],
+            'Metadata': dict(meta['metadata']),
+            'LastModified': datetime.fromtimestamp(meta['mtime_ns'] / 1e9, timezone.utc),
+        }
+
+    def get_object(self, Bucket: str, Key: str, VersionId: Optional[str] = None,
+                   IfNoneMatch: Optional[str] = None, **_kwargs) -> dict:
+        with self.lock:
+            meta = self.read_meta(Bucket, Key)
+            if meta is None:
+                raise client_error('NoSuchKey', 404, 'GetObject', Key)
+            file_path = self.object_path(Bucket, Key)
+            if VersionId is not None and VersionId != meta['version_id']:
+                file_path = self.version_path(Bucket, Key, VersionId)
+                try:
+                    with open(file_path + '.json') as f:
+                        meta = json.load(f)
+                except FileNotFoundError:
+                    raise client_error('NoSuchVersion', 404, 'GetObject', VersionId)
+            if IfNoneMatch is not None and IfNoneMatch == meta['etag']:
+                not_modified = True
+            else:
+                not_modified = False
+                # an open file keeps its data if the object is replaced
+                f = open(file_path, 'rb')
+
+        if not_modified:
+            self.request('get_object')
+            raise client_error('304', 304, 'GetObject', 'Not Modified')
+        with f:
+            data = f.read()
+        self.request('get_object', len(data))
+        return {**self.response(meta), 'Body': io.BytesIO(data)}
+
+    def head_object(self, Bucket: str, Key: str, **_kwargs) -> dict:
+        with self.lock:
+            meta = self.read_meta(Bucket, Key)
+        self.request('head_object')
+        if meta is None:
+            raise client_error('404', 404, 'HeadObject', 'Not Found')
+        return self.response(meta)
+
+    def put_file(self, bucket: str, key: str, source: io.IOBase,
+                 metadata: Optional[Dict[str, str]] = None) -> dict:
+        '''
+        writes the object from a file object, then replaces the current
+        version, keeping it as an older version if versioning is on
+        '''
+        tmp_folder = os.path.join(self.root, '.tmp')
+        os.makedirs(tmp_folder, exist_ok=True)
+        tmp_path = os.path.join(tmp_folder, os.urandom(8).hex())
+        md5 = hashlib.md5()
+        with open(tmp_path, 'wb') as f:
+            for block in iter(lambda: source.read(2 ** 20), b''):
+                md5.update(block)
+                f.write(block)
+        num_bytes = os.path.getsize(tmp_path)
+
+        file_path = self.object_path(bucket, key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with self.lock:
+            old_meta = self.read_meta(bucket, key)
+            if self.versioning and old_meta is not None:
+                version_path = self.version_path(bucket, key, old_meta['version_id'])
+                os.makedirs(os.path.dirname(version_path), exist_ok=True)
+                os.replace(file_path, version_path)
+                self.write_meta(version_path + '.json', old_meta)
+            os.replace(tmp_path, file_path)
+            stat = os.stat(file_path)
+            meta = {'etag': f'"{md5.hexdigest()}"',
+                    'version_id': f'{time_ns():x}{os.urandom(4).hex()}' if self.versioning
+                    else 'null',
+                    'metadata': dict(metadata or {}),
+                    'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+            self.write_meta(self.meta_path(bucket, key), meta)
+
+        self.request('put_object', num_bytes, 'up')
+        return {'ETag': meta['etag'], 'VersionId': meta['version_id']}
+
+    def put_object(self, Bucket: str, Key: str, Body=b'',
+                   Metadata: Optional[Dict[str, str]] = None, **_kwargs) -> dict:
+        if isinstance(Body, (bytes, bytearray, memoryview)):
+            Body = io.BytesIO(Body)
+        return self.put_file(Bucket, Key, Body, Metadata)
+
+    def upload_file(self, Filename: str, Bucket: str, Key: str,
+                    ExtraArgs: Optional[dict] = None, **_kwargs) -> None:
+        with open(Filename, 'rb') as f:
+            self.put_file(Bucket, Key, f, (ExtraArgs or {}).get('Metadata'))
+
+    def download_file(self, Bucket: str, Key: str, Filename: str, **_kwargs) -> None:
+        response = self.get_object(Bucket, Key)
+        with open(Filename, 'wb') as f:
+            shutil.copyfileobj(response['Body'], f)
+
+    def list_keys(self, bucket: str, prefix: str = '', start_after: str = '') -> Iterator[str]:
+        '''
+        sorted keys under prefix, from the folder of the prefix down
+        '''
+        bucket_folder = os.path.join(self.root, bucket)
+        folder = os.path.join(bucket_folder, os.path.dirname(prefix))
+        keys = []
+        for dir_path, _, file_names in os.walk(folder):
+            for file_name in file_names:
+                key = os.path.relpath(os.path.join(dir_path, file_name), bucket_folder)
+                if key.startswith(prefix) and key > start_after:
+                    keys.append(key)
+        return iter(sorted(keys))
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = '', StartAfter: str = '',
+                        ContinuationToken: Optional[str] = None, MaxKeys: int = page_size,
+                        **_kwargs) -> dict:
+        keys = self.list_keys(Bucket, Prefix, ContinuationToken or StartAfter)
+        contents = []
+        truncated = False
+        for key in keys:
+            if len(contents) == MaxKeys:
+                truncated = True
+                break
+            with self.lock:
+                meta = self.read_meta(Bucket, key)
+            if meta is None:
+                # removed since the walk
+                continue
+            response = self.response(meta)
+            contents.append({'Key': key, 'Size': meta['size'], 'ETag': meta['etag'],
+                             'LastModified': response['LastModified']})
+        self.request('list_objects_v2')
+
+        page = {'KeyCount': len(contents), 'IsTruncated': truncated}
+        if len(contents) > 0:
+            page['Contents'] = contents
+        if truncated:
+            page['NextContinuationToken'] = contents[-1]['Key']
+        return page
+
+    def get_paginator(self, operation: str) -> 'Paginator':
+        if operation != 'list_objects_v2':
+            raise ValueError(f'no paginator for {operation}')
+        return Paginator(self)
+
+
+class Paginator:
+    def __init__(self, client: LocalS3):
+        self.client = client
+
+    def paginate(self, **kwargs) -> Iterator[dict]:
+        token = None
+        while True:
+            page = self.client.list_objects_v2(ContinuationToken=token, **kwargs)
+            yield page
+            if not page['IsTruncated']:
+                return
+            token = page['NextContinuationToken']
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import threading
+import contextvars
+from contextlib import contextmanager
+from time import perf_counter, time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+# per stage timing of the lambdas. a span is one stage of one file, e.g.
+# the download, open, wind, power, sed, group_by, write or upload of a
+# MERRA-2 file, with the file, the country and the cell x hour count of
+# the file. every span is one json line on stdout (the lambda log) or in
+# a file, and lambda_handler ends with a summary line of its run:
+# percentiles of every stage and the slowest countries per cell x hour.
+#   {"type": "span", "stage": "power", "seconds": 0.012, "file": ...}
+# spans of pool threads (downloads ahead, uploads) are background, they
+# overlap the main thread, which times its waits for them instead
+# python metrics.py <log files> rolls up the spans of many runs, e.g. the
+# lines of the CloudWatch logs of a fleet
+
+# 'stdout', a file path to append the json lines to, or 'off'
+metrics_output = os.getenv('METRICS_OUTPUT', 'stdout')
+
+percentiles = [50, 90, 99]
+# countries listed by seconds per cell x hour in a summary
+num_outliers = 5
+
+# file, country and cell x hour count of the spans started in this
+# context. the threads of a pool do not have it, see bind
+fields_var: contextvars.ContextVar = contextvars.ContextVar('metrics_fields', default={})
+
+# spans of the current run, for the summary at its end
+run = {'id': None, 'spans': []}
+lock = threading.Lock()
+output_lock = threading.Lock()
+
+
+def file_fields(file_path: str) -> Dict[str, Optional[str]]:
+    '''
+    file and country of a file path like Germany/<file>.nc4, no country
+    for the global files
+    '''
+    return {'file': file_path, 'country': os.path.basename(os.path.dirname(file_path)) or None}
+
+
+def cells_hours(sizes) -> int:
+    '''
+    cell x hour count of dataset sizes (or a shape), lat x lon x time
+    '''
+    count = 1
+    for size in (sizes.values() if hasattr(sizes, 'values') else sizes):
+        count *= int(size)
+    return count
+
+
+@contextmanager
+def context(**fields) -> Iterator[None]:
+    '''
+    adds fields to the spans started inside, e.g. the file being processed
+    '''
+    token = fields_var.set({**fields_var.get(), **fields})
+    try:
+        yield
+    finally:
+        fields_var.reset(token)
+
+
+def bind(fn: Callable) -> Callable:
+    '''
+    fn with the fields of the calling context, for the tasks of a thread pool
+    '''
+    fields = fields_var.get()
+
+    def bound(*args, **kwargs):
+        with context(**fields):
+            return fn(*args, **kwargs)
+    return bound
+
+
+def update(**fields) -> None:
+    '''
+    adds fields to the current context, e.g. the cell x hour count once
+    the file is opened
+    '''
+    fields_var.set({**fields_var.get(), **fields})
+
+
+@contextmanager
+def span(stage: str, **fields) -> Iterator[dict]:
+    '''
+    times the block. the yielded record can take more fields, they are
+    emitted with the span when the block ends, also if it raises
+    '''
+    record = {'type': 'span', 'stage': stage, **fields_var.get(), **fields}
+    if threading.current_thread() is not threading.main_thread():
+        record['background'] = True
+    start_time = perf_counter()
+    try:
+        yield record
+    except BaseException as error:
+        record['error'] = type(error).__name__
+        raise
+    finally:
+        record['seconds'] = perf_counter() - start_time
+        if metrics_output != 'off':
+            record['time'] = time()
+            record['run'] = run['id']
+            with lock:
+                run['spans'].append(record)
+            emit(record)
+
+
+def emit(record: dict) -> None:
+    line = json.dumps(record, default=str)
+    with output_lock:
+        if metrics_output == 'stdout':
+            print(line, flush=True)
+        else:
+            with open(metrics_output, 'a') as f:
+                f.write(line + '\n')
+
+
+def start_run(run_id: Optional[str] = None) -> None:
+    '''
+    starts collecting the spans of a run, e.g. one lambda invocation
+    '''
+    with lock:
+        run['id'] = run_id or os.urandom(8).hex()
+        run['spans'] = []
+
+
+def end_run(**fields) -> dict:
+    '''
+    emits and returns the summary of the spans since start_run
+    '''
+    with lock:
+        spans = run['spans']
+        run['spans'] = []
+    summary = {'type': 'summary', 'run': run['id'], **fields, **summarize(spans)}
+    if metrics_output != 'off':
+        emit(summary)
+    return summary
+
+
+def stage_summary(seconds: List[float], counts: List[int]) -> dict:
+    values = np.array(seconds)
+    summary = {'spans': len(values), 'seconds': float(values.sum())}
+    for percentile in percentiles:
+        summary[f'p{percentile}'] = float(np.percentile(values, percentile))
+    summary['max'] = float(values.max())
+    if len(counts) == len(seconds) and summary['seconds'] > 0:
+        summary['cells_hours_per_second'] = sum(counts) / summary['seconds']
+    return summary
+
+
+def summarize(spans: List[dict]) -> dict:
+    '''
+    percentiles of the seconds of every stage, the seconds of every
+    country, and the countries with the most seconds per cell x hour. the
+    seconds of a country are the ones of its main thread spans, the
+    background spans overlap them
+    '''
+    by_stage: Dict[str, List[dict]] = {}
+    countries: Dict[str, dict] = {}
+    for record in spans:
+        by_stage.setdefault(record['stage'], []).append(record)
+        country = record.get('country')
+        if country is not None:
+            totals = countries.setdefault(country, {'seconds': 0., 'files': {}})
+            if not record.get('background'):
+                totals['seconds'] += record['seconds']
+            # the download of a file is timed before its size is known
+            files = totals['files']
+            files[record.get('file')] = max(files.get(record.get('file'), 0),
+                                            record.get('cells_hours') or 0)
+
+    stages = {}
+    for stage, records in by_stage.items():
+        stages[stage] = stage_summary(
+            [record['seconds'] for record in records],
+            [record['cells_hours'] for record in records if record.get('cells_hours')])
+
+    for totals in countries.values():
+        totals['cells_hours'] = sum(totals['files'].values())
+        totals['files'] = len(totals['files'])
+        if totals['cells_hours'] > 0:
+            totals['seconds_per_million_cells_hours'] = \
+                totals['seconds'] / totals['cells_hours'] * 1e6
+    outliers = sorted((country for country in countries
+                       if 'seconds_per_million_cells_hours' in countries[country]),
+                      key=lambda country: countries[country]['seconds_per_million_cells_hours'],
+                      reverse=True)[:num_outliers]
+
+    return {'stages': stages, 'countries': countries, 'outliers': outliers}
+
+
+def parse_spans(lines: Iterable[str]) -> List[dict]:
+    '''
+    the spans of log lines, other lines are skipped
+    '''
+    spans = []
+    for line in lines:
+        line = line.strip()
+        # cloudwatch exports prefix the lines with a timestamp
+        start = line.find('{"type": "span"')
+        if start == -1:
+            continue
+        try:
+            spans.append(json.loads(line[start:]))
+        except ValueError:
+            continue
+    return spans
+
+
+def read_spans(file_paths: List[str]) -> List[dict]:
+    spans = []
+    for file_path in file_paths:
+        with open(file_path) as f:
+            spans.extend(parse_spans(f))
+    return spans
+
+
+def main(file_paths: List[str]) -> dict:
+    spans = read_spans(file_paths)
+    summary = summarize(spans)
+    print(f"{len(spans)} spans of {len({record.get('run') for record in spans})} runs")
+    for stage, stage_stats in sorted(summary['stages'].items(),
+                                     key=lambda item: -item[1]['seconds']):
+        print(f"{stage:>13}: {stage_stats['spans']} spans, {stage_stats['seconds']:.1f}s, "
+              + ', '.join(f"p{percentile} {stage_stats[f'p{percentile}']:.3f}s"
+                          for percentile in percentiles)
+              + f", max {stage_stats['max']:.3f}s")
+    for country in summary['outliers']:
+        totals = summary['countries'][country]
+        print(f"{country}: {totals['seconds_per_million_cells_hours']:.3f}s per million "
+              f"cells x hours, {totals['files']} files, {totals['seconds']:.1f}s")
+    return summary
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+import os
+import json
+import shutil
+import threading
+from datetime import datetime, timezone
+from typing import BinaryIO, Dict, Iterator, Optional
+
+# storage of the objects of the pipeline: the MERRA-2 inputs, the daily
+# outputs and sums, the checkpoints and the catalog events. both lambdas,
+# the start scripts and the analysis scripts get it from get_storage:
+#   STORAGE=s3     the bucket, through one pooled client per process
+#   STORAGE=local  a folder (data/ by default, LOCAL_STORAGE_ROOT), where
+#                  the downloaded MERRA-2 files are read in place and the
+#                  outputs are written next to them, without the network
+# keys are the same for both, e.g. World_2019/Germany/<file>.nc4 or
+# output_compressed/Germany/<file>.nc4
+
+s3_bucket = 'tori-calculate-wind-power'
+
+storage_backend = os.getenv('STORAGE', 's3')
+local_storage_root = os.getenv('LOCAL_STORAGE_ROOT', os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../data')))
+
+# connections of the shared client, the download / upload threads of a
+# process use one each
+s3_max_pool_connections = int(os.getenv('S3_MAX_POOL_CONNECTIONS', 32))
+s3_max_attempts = int(os.getenv('S3_MAX_ATTEMPTS', 5))
+# objects above the threshold are uploaded and downloaded by the transfer
+# manager in parts of the chunk size, max concurrency parts at a time
+multipart_threshold = int(os.getenv('S3_MULTIPART_THRESHOLD_MB', 16)) * 1024 ** 2
+multipart_chunksize = int(os.getenv('S3_MULTIPART_CHUNKSIZE_MB', 16)) * 1024 ** 2
+transfer_max_concurrency = int(os.getenv('S3_TRANSFER_MAX_CONCURRENCY', 10))
+
+# local folders of key prefixes, the layout of the downloads in data/
+local_mounts = {
+    'World_2019': os.path.join('World_2019', '11111'),
+}
+
+
+class ObjectNotFound(Exception):
+    pass
+
+
+class NotModified(Exception):
+    '''
+    the object still has the etag of a conditional get
+    '''
+    pass
+
+
+class S3Storage:
+    '''
+    objects of the bucket. the responses are dicts with the etag,
+    version_id, size and metadata of the object
+
+    @param client: boto3 s3 client, or a stand-in (local_s3.py), a pooled
+                   client with retries by default
+    '''
+    local = False
+
+    def __init__(self, bucket: str = s3_bucket, client=None,
+                 max_pool_connections: int = s3_max_pool_connections,
+                 max_attempts: int = s3_max_attempts):
+        from boto3.s3.transfer import TransferConfig
+
+        if client is None:
+            import boto3
+            from botocore.config import Config
+            client = boto3.client('s3', config=Config(
+                max_pool_connections=max_pool_connections,
+                tcp_keepalive=True,
+                retries={'max_attempts': max_attempts, 'mode': 'standard'}))
+        self.bucket = bucket
+        self.client = client
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=transfer_max_concurrency,
+            use_threads=True)
+
+    def local_path(self, key: str) -> Optional[str]:
+        '''
+        path to read the object in place, None for s3
+        '''
+        return None
+
+    def translate_error(self, error: Exception, key: str) -> None:
+        '''
+        raises the errors of missing and not modified objects as
+        ObjectNotFound and NotModified, others as they are
+        '''
+        from botocore.exceptions import ClientError
+        if isinstance(error, ClientError):
+            code = error.response.get('Error', {}).get('Code')
+            if code in ('NoSuchKey', 'NoSuchVersion', '404'):
+                raise ObjectNotFound(key) from error
+            if code in ('304', 'NotModified'):
+                raise NotModified(key) from error
+        raise error
+
+    def head(self, key: str) -> dict:
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=key)
+        except Exception as error:
+            self.translate_error(error, key)
+        return {
+            'etag': response['ETag'],
+            'version_id': response.get('VersionId'),
+            'size': response['ContentLength'],
+            'metadata': response.get('Metadata', {}),
+        }
+
+    def get(self, key: str, version_id: Optional[str] = None,
+            if_none_match: Optional[str] = None) -> dict:
+        '''
+        one request for the data and the etag, so both belong to the same
+        version. raises NotModified if the etag is if_none_match
+
+        @returns response: dict, with the data as a stream in body
+        '''
+        kwargs = {}
+        if version_id is not None:
+            kwargs['VersionId'] = version_id
+        if if_none_match is not None:
+            kwargs['IfNoneMatch'] = if_none_match
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=key, **kwargs)
+        except Exception as error:
+            self.translate_error(error, key)
+        return {
+            'body': response['Body'],
+            'etag': response['ETag'],
+            'version_id': response.get('VersionId'),
+            'size': response['ContentLength'],
+            'metadata': response.get('Metadata', {}),
+        }
+
+    def read(self, key: str) -> bytes:
+        return self.get(key)['body'].read()
+
+    def download(self, key: str, file_path: str, version_id: Optional[str] = None,
+                 buffer_size: int = 1024 ** 2) -> dict:
+        '''
+        streams one object (or one version of it) to a file
+
+        @returns info: dict with etag, version_id and size of what was downloaded
+        '''
+        response = self.get(key, version_id)
+        with open(file_path, 'wb') as f:
+            shutil.copyfileobj(response['body'], f, buffer_size)
+        del response['body']
+        return response
+
+    def download_file(self, key: str, file_path: str) -> None:
+        '''
+        downloads with the transfer manager, large objects as parallel
+        ranged gets. no etag, use download if it matters
+        '''
+        self.client.download_file(self.bucket, key, file_path, Config=self.transfer_config)
+
+    def put(self, key: str, data: bytes, metadata: Optional[Dict[str, str]] = None) -> dict:
+        '''
+        @returns info: dict with etag, version_id and size of the object
+        '''
+        response = self.client.put_object(Bucket=self.bucket, Key=key, Body=data,
+                                          Metadata=metadata or {})
+        return {'etag': response['ETag'], 'version_id': response.get('VersionId'),
+                'size': len(data)}
+
+    def upload(self, file_path: str, key: str,
+               metadata: Optional[Dict[str, str]] = None) -> dict:
+        '''
+        uploads a file, in parts above the multipart threshold
+
+        @returns info: dict, see put
+        '''
+        self.client.upload_file(file_path, self.bucket, key,
+                                ExtraArgs={'Metadata': metadata or {}},
+                                Config=self.transfer_config)
+        # the etag of a multipart upload is only known to s3
+        info = self.head(key)
+        del info['metadata']
+        return info
+
+    def list(self, prefix: str = '', start_after: str = '') -> Iterator[dict]:
+        '''
+        objects under prefix in key order, dicts with key, size, etag and
+        last_modified
+        '''
+        paginator = self.client.get_paginator('list_objects_v2')
+        kwargs = {'StartAfter': start_after} if start_after != '' else {}
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, **kwargs):
+            for content in page.get('Contents', ()):
+                yield {'key': content['Key'], 'size': content['Size'],
+                       'etag': content['ETag'], 'last_modified': content['LastModified']}
+
+
+class LocalStorage:
+    '''
+    objects as files under root, root/<key> or the folder of a mounted
+    prefix. the etag is the size and modification time of the file (not
+    an md5 like s3), the metadata of put and upload is kept next to it in
+    root/.metadata. there are no older versions
+    '''
+    local = True
+
+    def __init__(self, root: str = local_storage_root, mounts: Dict[str, str] = local_mounts):
+        self.root = root
+        self.mounts = {prefix: os.path.join(root, folder) for prefix, folder in mounts.items()}
+        self.lock = threading.Lock()
+
+    def path(self, key: str) -> str:
+        for prefix, folder in self.mounts.items():
+            if key == prefix or key.startswith(prefix + '/'):
+                return os.path.join(folder, key[len(prefix) + 1:])
+        return os.path.join(self.root, key)
+
+    def local_path(self, key: str) -> Optional[str]:
+        return self.path(key)
+
+    def metadata_path(self, key: str) -> str:
+        return os.path.join(self.root, '.metadata', key + '.json')
+
+    def stat(self, key: str) -> os.stat_result:
+        try:
+            return os.stat(self.path(key))
+        except (FileNotFoundError, NotADirectoryError):
+            raise ObjectNotFound(key)
+
+    def info(self, key: str, stat: os.stat_result) -> dict:
+        return {'etag': f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"', 'version_id': None,
+                'size': stat.st_size}
+
+    def read_metadata(self, key: str, etag: str) -> Dict[str, str]:
+        '''
+        metadata of the object, if it was written for this etag
+        '''
+        try:
+            with open(self.metadata_path(key)) as f:
+                saved = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        return saved['metadata'] if saved['etag'] == etag else {}
+
+    def head(self, key: str) -> dict:
+        info = self.info(key, self.stat(key))
+        info['metadata'] = self.read_metadata(key, info['etag'])
+        return info
+
+    def get(self, key: str, version_id: Optional[str] = None,
+            if_none_match: Optional[str] = None) -> dict:
+        if version_id is not None:
+            raise ObjectNotFound(f'{key} version {version_id}')
+        try:
+            body = open(self.path(key), 'rb')
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            raise ObjectNotFound(key)
+        info = self.info(key, os.fstat(body.fileno()))
+        if if_none_match is not None and info['etag'] == if_none_match:
+            body.close()
+            raise NotModified(key)
+        info['metadata'] = self.read_metadata(key, info['etag'])
+        info['body'] = body
+        return info
+
+    def read(self, key: str) -> bytes:
+        with self.get(key)['body'] as f:
+            return f.read()
+
+    def download(self, key: str, file_path: str, version_id: Optional[str] = None) -> dict:
+        '''
+        links the file (copies it if it is on another file system), a
+        later put replaces the object by a new file, the link keeps the old
+        '''
+        response = self.get(key, version_id)
+        response['body'].close()
+        del response['body'], response['metadata']
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        try:
+            os.link(self.path(key), file_path)
+        except OSError:
+            shutil.copyfile(self.path(key), file_path)
+        return response
+
+    def download_file(self, key: str, file_path: str) -> None:
+        self.download(key, file_path)
+
+    def write(self, key: str, write_to: BinaryIO, metadata: Optional[Dict[str, str]]) -> dict:
+        '''
+        writes to a temporary file and moves it to the path of the key, so
+        readers see the old or the new file
+        '''
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            write_to(f)
+        with self.lock:
+            os.replace(tmp_path, path)
+            info = self.info(key, os.stat(path))
+            self.write_metadata(key, info['etag'], metadata)
+        return info
+
+    def write_metadata(self, key: str, etag: str, metadata: Optional[Dict[str, str]]) -> None:
+        metadata_path = self.metadata_path(key)
+        if not metadata:
+            if os.path.exists(metadata_path):
+                os.remove(metadata_path)
+            return
+        os.makedirs(os.path.dirname(metadata_path), exist_ok=True)
+        with open(metadata_path, 'w') as f:
+            json.dump({'etag': etag, 'metadata': metadata}, f)
+
+    def put(self, key: str, data: bytes, metadata: Optional[Dict[str, str]] = None) -> dict:
+        return self.write(key, lambda f: f.write(data), metadata)
+
+    def upload(self, file_path: str, key: str,
+               metadata: Optional[Dict[str, str]] = None) -> dict:
+        if os.path.abspath(file_path) == os.path.abspath(self.path(key)):
+            # written in place
+            with self.lock:
+                info = self.info(key, os.stat(file_path))
+                self.write_metadata(key, info['etag'], metadata)
+            return info
+
+        def copy(f: BinaryIO) -> None:
+            with open(file_path, 'rb') as source:
+                shutil.copyfileobj(source, f, 1024 ** 2)
+        return self.write(key, copy, metadata)
+
+    def list(self, prefix: str = '', start_after: str = '') -> Iterator[dict]:
+        # the mounted folders have keys of their own, walked from their
+        # mount keys, e.g. World_2019 with the prefix '' or 'World'
+        mount_folders = set(self.mounts.values())
+        keys = set()
+        for base_key, base_folder in [('', self.root), *self.mounts.items()]:
+            base = base_key + '/' if base_key != '' else ''
+            if prefix.startswith(base):
+                relative_folder = os.path.dirname(prefix[len(base):])
+            elif base.startswith(prefix):
+                relative_folder = ''
+            else:
+                continue
+            folder_key = os.path.join(base_key, relative_folder)
+            folder = os.path.join(base_folder, relative_folder)
+            for dir_path, dir_names, file_names in os.walk(folder):
+                dir_names[:] = [name for name in dir_names if not name.startswith('.')
+                                and os.path.join(dir_path, name) not in mount_folders]
+                for file_name in file_names:
+                    if file_name.endswith('.tmp'):
+                        continue
+                    file_path = os.path.join(dir_path, file_name)
+                    key = os.path.normpath(os.path.join(folder_key, os.path.relpath(
+                        file_path, folder)))
+                    # a file of the root under a mount key is not an object
+                    if key.startswith(prefix) and key > start_after \
+                            and os.path.normpath(self.path(key)) == os.path.normpath(file_path):
+                        keys.add(key)
+        for key in sorted(keys):
+            try:
+                stat = self.stat(key)
+            except ObjectNotFound:
+                continue
+            yield {**self.info(key, stat), 'key': key,
+                   'last_modified': datetime.fromtimestamp(stat.st_mtime, timezone.utc)}
+
+
+def get_storage(backend: str = storage_backend,
+                max_pool_connections: int = s3_max_pool_connections,
+                max_attempts: int = s3_max_attempts):
+    '''
+    @param backend: str, 's3' or 'local'
+    @param max_pool_connections, max_attempts: of the s3 client, e.g. one
+                                               connection per download thread
+    '''
+    if backend == 's3':
+        return S3Storage(max_pool_connections=max_pool_connections,
+                         max_attempts=max_attempts)
+    if backend == 'local':
+        return LocalStorage()
+    raise ValueError(f'invalid storage {backend}')
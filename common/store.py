@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+import os
+import re
+from datetime import date, datetime
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pyarrow as pa
+import pyarrow.dataset as pds
+import pyarrow.parquet as pq
+
+# parquet store of the outputs, partitioned by country folder:
+#   store_daily/<country>/<input file stem>.parquet, per cell sums of a day
+#   store_aggregated/<country>/<country>.parquet, per cell sums of the year
+# the rows of a file are sorted by (lat, lon), so the row group statistics
+# let readers skip row groups outside of a bounding box
+daily_folder = 'store_daily'
+aggregated_folder = 'store_aggregated'
+
+file_extension = '.parquet'
+compression = 'zstd'
+# rows per row group, about 1.5 MB of values
+row_group_size = 64 * 1024
+
+date_pattern = re.compile(r'\.(\d{8})\.')
+
+partitioning = pds.partitioning(pa.schema([('country', pa.string())]))
+
+
+def file_date(file_path: str) -> Optional[date]:
+    '''
+    day of a MERRA-2 file or daily output, from the YYYYMMDD in its name
+    '''
+    match = date_pattern.search(os.path.basename(file_path))
+    if match is None:
+        return None
+    return datetime.strptime(match.group(1), '%Y%m%d').date()
+
+
+def daily_key(file_path: str) -> str:
+    '''
+    store key of the daily output of an input file (<country>/<file name>)
+    '''
+    return os.path.join(daily_folder, os.path.splitext(file_path)[0] + file_extension)
+
+
+def input_file_path(key: str) -> str:
+    '''
+    input file (<country>/<file name>) of a daily store key, see daily_key
+    '''
+    file_path = key.split(daily_folder + '/', 1)[-1]
+    return os.path.splitext(file_path)[0] + '.nc4'
+
+
+def aggregated_key(country_name: str) -> str:
+    return os.path.join(aggregated_folder, country_name, country_name + file_extension)
+
+
+def dataset_to_table(ds: xr.Dataset, day: Optional[date] = None) -> pa.Table:
+    '''
+    flattens the (lat, lon) variables of the dataset to one row per cell,
+    with float32 coordinates and the day if given. float32 values (the
+    float32 compute mode) stay float32, other values are float64
+    '''
+    ds = ds.transpose('lat', 'lon')
+    lat, lon = np.meshgrid(ds['lat'].values, ds['lon'].values, indexing='ij')
+    columns = {}
+    if day is not None:
+        columns['date'] = pa.array(np.full(lat.size, np.datetime64(day, 'D')), pa.date32())
+    columns['lat'] = pa.array(lat.ravel().astype(np.float32))
+    columns['lon'] = pa.array(lon.ravel().astype(np.float32))
+    for name in ds.data_vars:
+        values = ds[name].values.ravel()
+        columns[name] = pa.array(values.astype(np.result_type(values.dtype, np.float32)))
+    return pa.table(columns)
+
+
+def dataframe_to_table(df: pd.DataFrame) -> pa.Table:
+    '''
+    same as dataset_to_table, for a data frame indexed by (lat, lon)
+    '''
+    df = df.reset_index()
+    df['lat'] = df['lat'].astype(np.float32)
+    df['lon'] = df['lon'].astype(np.float32)
+    df = df.sort_values(['lat', 'lon'])
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def table_to_dataset(table: pa.Table) -> xr.Dataset:
+    '''
+    (lat, lon) grid of the values of a table with one row per cell, the
+    coordinates as float64 like in the MERRA-2 files
+    '''
+    df = table.drop([name for name in ('date', 'country') if name in table.column_names]) \
+        .to_pandas()
+    df['lat'] = df['lat'].astype(np.float64)
+    df['lon'] = df['lon'].astype(np.float64)
+    return xr.Dataset.from_dataframe(df.set_index(['lat', 'lon']))
+
+
+def write_table(table: pa.Table, where: Union[str, pa.NativeFile, None] = None) -> Optional[bytes]:
+    '''
+    writes the table as zstd compressed parquet to a path, or returns the
+    bytes if where is None
+    '''
+    sink = pa.BufferOutputStream() if where is None else where
+    pq.write_table(table, sink, compression=compression, row_group_size=row_group_size)
+    return sink.getvalue().to_pybytes() if where is None else None
+
+
+def read_table(source: Union[str, bytes]) -> pa.Table:
+    if isinstance(source, bytes):
+        source = pa.BufferReader(source)
+    return pq.read_table(source)
+
+
+def s3_filesystem(region: Optional[str] = None):
+    '''
+    pyarrow filesystem of the bucket, with the credentials of the
+    environment (same as boto3)
+    '''
+    from pyarrow import fs
+    return fs.S3FileSystem(region=region or os.getenv('AWS_DEFAULT_REGION', 'us-east-1'))
+
+
+def build_filter(countries: Optional[List[str]] = None,
+                 start: Optional[date] = None, end: Optional[date] = None,
+                 bbox: Optional[Tuple[float, float, float, float]] = None):
+    '''
+    @param start, end: date, inclusive, only for the daily store
+    @param bbox: (lat_min, lon_min, lat_max, lon_max), inclusive
+    @returns expression: pyarrow dataset filter, None to read everything
+    '''
+    conditions = []
+    if countries is not None:
+        conditions.append(pds.field('country').isin(list(countries)))
+    if start is not None:
+        conditions.append(pds.field('date') >= pa.scalar(start, pa.date32()))
+    if end is not None:
+        conditions.append(pds.field('date') <= pa.scalar(end, pa.date32()))
+    if bbox is not None:
+        lat_min, lon_min, lat_max, lon_max = bbox
+        conditions += [pds.field('lat') >= np.float32(lat_min),
+                       pds.field('lat') <= np.float32(lat_max),
+                       pds.field('lon') >= np.float32(lon_min),
+                       pds.field('lon') <= np.float32(lon_max)]
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def open_store(root: str, folder: str = daily_folder, filesystem=None) -> pds.Dataset:
+    '''
+    @param root: str, local folder or bucket name (with an s3 filesystem)
+    '''
+    return pds.dataset(os.path.join(root, folder), format='parquet',
+                       partitioning=partitioning, filesystem=filesystem)
+
+
+def read_store(root: str, folder: str = daily_folder,
+               countries: Optional[List[str]] = None,
+               start: Optional[date] = None, end: Optional[date] = None,
+               bbox: Optional[Tuple[float, float, float, float]] = None,
+               columns: Optional[List[str]] = None, filesystem=None) -> pd.DataFrame:
+    '''
+    reads the rows of a store folder matching the filters, only the
+    partitions (countries) and row groups that can match are read
+
+    e.g. read_store('tori-calculate-wind-power', countries=['Germany'],
+                    start=date(2019, 1, 1), end=date(2019, 1, 31),
+                    filesystem=s3_filesystem())
+    '''
+    dataset = open_store(root, folder, filesystem)
+    table = dataset.to_table(columns=columns,
+                             filter=build_filter(countries, start, end, bbox))
+    return table.to_pandas()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+import numpy as np
+
+# compensated summation for the float32 mode, the rounding error of every
+# addition is kept in a second array and added back at the end, so a sum
+# of n float32 values has about the error of one rounding instead of n
+
+
+def neumaier_add(total: np.ndarray, compensation: np.ndarray, values: np.ndarray) -> None:
+    '''
+    adds values to total in place, with the lost low order bits added to
+    compensation (Neumaier's variant of Kahan summation, also exact when
+    a value is larger than the running total)
+    '''
+    new_total = total + values
+    larger = np.abs(total) >= np.abs(values)
+    # the part of the smaller operand that did not make it into new_total
+    error = np.where(larger, total - new_total, values - new_total)
+    error += np.where(larger, values, total)
+    compensation += error
+    total[...] = new_total
+
+
+def compensated_nansum(values: np.ndarray, axis: int = 0) -> np.ndarray:
+    '''
+    same as np.nansum(values, axis), with compensated summation along the
+    axis in the dtype of values
+    '''
+    values = np.moveaxis(np.asarray(values), axis, 0)
+    total = np.zeros(values.shape[1:], dtype=values.dtype)
+    compensation = np.zeros_like(total)
+    for step in values:
+        neumaier_add(total, compensation, np.nan_to_num(step))
+    total += compensation
+    return total
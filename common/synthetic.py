@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+import os
+from datetime import date, timedelta
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+# synthetic MERRA-2 files, shaped like the per country tavg1_2d_slv_Nx
+# files in World_2019 (24 hourly steps on the 0.5 x 0.625 degree grid, the
+# float32 variables of the download), and daily outputs like the ones the
+# calculate lambda writes. the values are random in realistic ranges, the
+# same for the same country, day and seed, so benchmarks do not need the
+# real data
+
+lat_step = 0.5
+lon_step = 0.625
+hours = 24
+
+# bounding boxes of the per country files on the MERRA-2 grid,
+# (lat_min, lon_min, lat_max, lon_max). the United States and Russia
+# files span (almost) every longitude, since their islands cross 180
+country_boxes = {
+    'Andorra': (42.5, 1.25, 43.0, 1.875),  # 2 x 2 cells
+    'Germany': (47.0, 5.625, 55.0, 15.0),  # 17 x 16 cells
+    'United States': (18.5, -179.375, 71.5, -66.875),  # 107 x 181 cells
+    'Russia': (41.0, -180.0, 82.0, 179.375),  # 83 x 576 cells
+}
+
+# variables of the download, with the range of their random values
+variable_ranges = {
+    'DISPH': (0., 5.),  # in [m]
+    'PS': (85000., 103000.),  # in [Pa]
+    'QV10M': (0.0005, 0.015),  # in [kg/kg]
+    'QV2M': None,  # from T2M, PS and a relative humidity
+    'T10M': (250., 310.),  # in [K]
+    'T2M': (250., 310.),  # in [K]
+    'TS': (250., 310.),  # in [K]
+    'U10M': (-15., 15.),  # in [m/s]
+    'U50M': (-20., 20.),  # in [m/s]
+    'V10M': (-15., 15.),  # in [m/s]
+    'V50M': (-20., 20.),  # in [m/s]
+}
+
+
+def file_name(day: date) -> str:
+    return f'MERRA2_400.tavg1_2d_slv_Nx.{day:%Y%m%d}.nc4'
+
+
+def country_grid(country_name: str) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    @returns lat, lon: np.ndarray, float64 like in the MERRA-2 files
+    '''
+    lat_min, lon_min, lat_max, lon_max = country_boxes[country_name]
+    lat = lat_min + lat_step * np.arange(round((lat_max - lat_min) / lat_step) + 1)
+    lon = lon_min + lon_step * np.arange(round((lon_max - lon_min) / lon_step) + 1)
+    return lat, lon
+
+
+def num_cells(country_name: str) -> int:
+    lat, lon = country_grid(country_name)
+    return lat.size * lon.size
+
+
+def get_rng(country_name: str, day: date, seed: int) -> np.random.Generator:
+    return np.random.default_rng([seed, day.toordinal(), sum(map(ord, country_name))])
+
+
+def make_input(country_name: str, day: date = date(2019, 1, 1), seed: int = 0) -> xr.Dataset:
+    '''
+    one day of hourly data of a country, (time, lat, lon) float32 variables
+    '''
+    rng = get_rng(country_name, day, seed)
+    lat, lon = country_grid(country_name)
+    shape = (hours, lat.size, lon.size)
+
+    data_vars = {}
+    for name, value_range in variable_ranges.items():
+        if value_range is not None:
+            low, high = value_range
+            data_vars[name] = rng.uniform(low, high, shape).astype(np.float32)
+
+    # specific humidity of a relative humidity between 5 and 100 %
+    t2m = data_vars['T2M'].astype(np.float64)
+    ps = data_vars['PS'].astype(np.float64)
+    e_s = 611 * np.exp(17.67 * (t2m - 273.15) / (t2m - 29.65))
+    w = rng.uniform(0.05, 1., shape) * e_s * 287.058 / ((ps - e_s) * 461.5)
+    data_vars['QV2M'] = (w / (1 + w)).astype(np.float32)
+
+    time = pd.date_range(pd.Timestamp(day) + pd.Timedelta(minutes=30), periods=hours, freq='h')
+    return xr.Dataset({
+        name: (('time', 'lat', 'lon'), data_vars[name]) for name in variable_ranges
+    }, coords={'time': time, 'lat': lat, 'lon': lon})
+
+
+def make_output(country_name: str, day: date = date(2019, 1, 1), seed: int = 0) -> xr.Dataset:
+    '''
+    daily output of a country, the (lat, lon) sums of sed and power output
+    '''
+    rng = get_rng(country_name, day, seed)
+    lat, lon = country_grid(country_name)
+    shape = (lat.size, lon.size)
+    return xr.Dataset({
+        'sed': (('lat', 'lon'), rng.uniform(0., 24 * 50., shape)),
+        'power_output': (('lat', 'lon'), rng.uniform(0., 24 * 2.3e6, shape)),
+    }, coords={'lat': lat, 'lon': lon})
+
+
+def write_inputs(folder: str, country_name: str, num_days: int = 1,
+                 start: date = date(2019, 1, 1), seed: int = 0) -> List[str]:
+    '''
+    writes num_days input files to folder/<country>/, zlib compressed
+    like the MERRA-2 downloads
+
+    @returns file_paths: List[str]
+    '''
+    country_folder = os.path.join(folder, country_name)
+    os.makedirs(country_folder, exist_ok=True)
+    file_paths = []
+    for i in range(num_days):
+        day = start + timedelta(days=i)
+        file_path = os.path.join(country_folder, file_name(day))
+        ds = make_input(country_name, day, seed)
+        ds.to_netcdf(file_path, encoding={
+            name: {'zlib': True, 'complevel': 2} for name in ds.data_vars})
+        file_paths.append(file_path)
+    return file_paths
+
+
+def write_outputs(folder: str, country_name: str, num_days: int = 1,
+                  start: date = date(2019, 1, 1), seed: int = 0,
+                  file_format: str = 'netcdf') -> List[str]:
+    '''
+    writes num_days daily outputs to folder/<country>/, as netcdf like
+    output_compressed or as parquet like store_daily
+
+    @returns file_paths: List[str]
+    '''
+    country_folder = os.path.join(folder, country_name)
+    os.makedirs(country_folder, exist_ok=True)
+    file_paths = []
+    for i in range(num_days):
+        day = start + timedelta(days=i)
+        ds = make_output(country_name, day, seed)
+        file_path = os.path.join(country_folder, file_name(day))
+        if file_format == 'parquet':
+            from common import store
+            file_path = os.path.splitext(file_path)[0] + store.file_extension
+            store.write_table(store.dataset_to_table(ds, day), file_path)
+        elif file_format == 'netcdf':
+            ds.to_netcdf(file_path)
+        else:
+            raise ValueError(f'invalid output format {file_format}')
+        file_paths.append(file_path)
+    return file_paths
+
+
+def main(folder: Optional[str] = None, num_days: int = 1) -> None:
+    '''
+    writes the input files of every country in country_boxes to
+    data/World_2019_synthetic/<country>/
+    '''
+    if folder is None:
+        folder = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                              '../data/World_2019_synthetic'))
+    for country_name in country_boxes:
+        file_paths = write_inputs(folder, country_name, num_days)
+        print(country_name, num_cells(country_name), 'cells,', len(file_paths), 'files')
+
+
+if __name__ == '__main__':
+    main()
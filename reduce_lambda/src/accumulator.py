@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from common.summation import neumaier_add
+
+
+class GridAccumulator:
+    '''
+    running per cell sum of the (lat, lon) variables of many daily output
+    files. the sums live in one preallocated array per variable on the
+    country's grid, so the memory does not depend on the number of days
+
+    variables can have dims before (lat, lon), e.g. the config dim of the
+    turbine sweep, their coords are kept from the first dataset added
+
+    missing values count as 0, same as adding data frames with fill_value=0.
+    float32 sums keep the rounding error of every addition in a second
+    array (compensated summation), float64 sums are plain
+    '''
+
+    def __init__(self, dtype=np.float64):
+        self.dtype = np.dtype(dtype)
+        self.compensated = self.dtype != np.float64
+        self.lat: Optional[np.ndarray] = None
+        self.lon: Optional[np.ndarray] = None
+        self.variables: List[str] = []
+        # dims of every variable, and the coords of the dims before (lat, lon)
+        self.dims: Dict[str, Tuple[str, ...]] = {}
+        self.coords: Dict[str, xr.Variable] = {}
+        self.sums: Dict[str, np.ndarray] = {}
+        self.compensation: Dict[str, np.ndarray] = {}
+        self.num_added = 0
+
+    def _allocate(self, ds: xr.Dataset) -> None:
+        self.lat = ds['lat'].values
+        self.lon = ds['lon'].values
+        self.variables = list(ds.data_vars)
+        self.dims = {name: ds[name].transpose(..., 'lat', 'lon').dims
+                     for name in self.variables}
+        self.coords = {name: xr.Variable(coord.dims, coord.values)
+                       for name, coord in ds.coords.items()
+                       if len(coord.dims) > 0
+                       and 'lat' not in coord.dims and 'lon' not in coord.dims}
+        self.sums = {name: np.zeros(ds[name].transpose(..., 'lat', 'lon').shape,
+                                    dtype=self.dtype)
+                     for name in self.variables}
+        if self.compensated:
+            self.compensation = {name: np.zeros_like(values)
+                                 for name, values in self.sums.items()}
+
+    def _grow(self, lat: np.ndarray, lon: np.ndarray) -> None:
+        '''
+        extends the grid to also cover lat / lon, only needed if the daily
+        files of a country do not share one grid
+        '''
+        new_lat = np.union1d(self.lat, lat)
+        new_lon = np.union1d(self.lon, lon)
+        lat_index = np.searchsorted(new_lat, self.lat)
+        lon_index = np.searchsorted(new_lon, self.lon)
+        for arrays in (self.sums, self.compensation):
+            for name, values in arrays.items():
+                grown = np.zeros(values.shape[:-2] + (len(new_lat), len(new_lon)),
+                                 dtype=values.dtype)
+                grown[(...,) + np.ix_(lat_index, lon_index)] = values
+                arrays[name] = grown
+        self.lat = new_lat
+        self.lon = new_lon
+
+    def add(self, ds: xr.Dataset, sign: float = 1.) -> None:
+        '''
+        adds the variables of one daily output dataset with dims (..., lat,
+        lon), or subtracts them with sign -1 to back out a file added before
+        '''
+        lat = ds['lat'].values
+        lon = ds['lon'].values
+        if self.lat is None:
+            self._allocate(ds)
+
+        same_grid = np.array_equal(lat, self.lat) and np.array_equal(lon, self.lon)
+        if not same_grid:
+            if not (np.isin(lat, self.lat).all() and np.isin(lon, self.lon).all()):
+                self._grow(lat, lon)
+            index = (...,) + np.ix_(np.searchsorted(self.lat, lat),
+                                    np.searchsorted(self.lon, lon))
+
+        for name in self.variables:
+            if name not in ds:
+                continue
+            values = np.nan_to_num(
+                ds[name].transpose(..., 'lat', 'lon').values.astype(self.dtype))
+            if sign != 1:
+                values *= sign
+            if self.compensated:
+                if same_grid:
+                    neumaier_add(self.sums[name], self.compensation[name], values)
+                else:
+                    sums = self.sums[name][index]
+                    compensation = self.compensation[name][index]
+                    neumaier_add(sums, compensation, values)
+                    self.sums[name][index] = sums
+                    self.compensation[name][index] = compensation
+            elif same_grid:
+                self.sums[name] += values
+            else:
+                self.sums[name][index] += values
+
+        self.num_added += int(sign)
+
+    def totals(self) -> Dict[str, np.ndarray]:
+        '''
+        the sums with the compensation added back
+        '''
+        if not self.compensated:
+            return self.sums
+        return {name: values + self.compensation[name] for name, values in self.sums.items()}
+
+    def to_dataset(self) -> xr.Dataset:
+        return xr.Dataset(
+            {name: (self.dims[name], values) for name, values in self.totals().items()},
+            coords={**self.coords, 'lat': self.lat, 'lon': self.lon},
+            attrs={'num_added': self.num_added})
+
+    @classmethod
+    def from_dataset(cls, ds: xr.Dataset, dtype=np.float64):
+        '''
+        restores an accumulator saved with to_dataset
+        '''
+        accumulator = cls(dtype)
+        accumulator._allocate(ds)
+        for name in accumulator.variables:
+            accumulator.sums[name][:] = ds[name].transpose(..., 'lat', 'lon').values
+        accumulator.num_added = int(ds.attrs.get('num_added', 0))
+        return accumulator
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return self.to_dataset().to_dataframe()
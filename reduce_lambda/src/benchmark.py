@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+import os
+import sys
+import tempfile
+from typing import Dict, List, Optional
+
+# the kernels are timed here, without the json lines of their spans
+os.environ.setdefault('METRICS_OUTPUT', 'off')
+# common/ is two folders up
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from main import read_data  # noqa: E402
+from config import accumulate_dtype  # noqa: E402
+from common import synthetic  # noqa: E402
+from common.benchmark import measure, case_result, report  # noqa: E402
+
+# benchmark of the reduce lambda on synthetic daily outputs of a small, a
+# medium and two huge countries (common/synthetic.py): read_data of a month
+# of netcdf (output_compressed) and parquet (store_daily) files. the
+# results go to data/benchmark/reduce_<commit>.json, pass the commit of an
+# earlier run as baseline to list the cases that got slower
+
+countries = ['Andorra', 'Germany', 'United States', 'Russia']
+file_formats = ['netcdf', 'parquet']
+
+
+def benchmark_country(folder: str, country_name: str, num_days: int = 31,
+                      repeats: int = 5) -> List[Dict]:
+    cells = synthetic.num_cells(country_name)
+    results = []
+    for file_format in file_formats:
+        format_folder = os.path.join(folder, file_format)
+        synthetic.write_outputs(format_folder, country_name, num_days, file_format=file_format)
+        folder_path = os.path.join(format_folder, country_name)
+
+        print(f'read_data[{file_format}] {country_name}')
+        result = case_result('read_data', file_format, country_name, cells,
+                             num_days * synthetic.hours,
+                             measure(read_data, lambda: (folder_path,), repeats))
+        result['dtype'] = accumulate_dtype
+        result['files'] = num_days
+        results.append(result)
+    return results
+
+
+def main(country_names: List[str] = countries, num_days: int = 31, repeats: int = 5,
+         baseline: Optional[str] = None) -> List[Dict]:
+    '''
+    @param baseline: str, commit of the results to compare to
+    @returns regressions: List[dict], see common.benchmark.compare_results
+    '''
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        for country_name in country_names:
+            results.extend(benchmark_country(folder, country_name, num_days, repeats))
+    return report('reduce', results, baseline)
+
+
+if __name__ == '__main__':
+    main(baseline=sys.argv[1] if len(sys.argv) > 1 else None)
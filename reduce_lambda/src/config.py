@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# number of threads (and pooled s3 connections) used to download the
+# daily outputs of a country
+download_workers = int(os.getenv('DOWNLOAD_WORKERS', 32))
+# attempts per file for transient s3 / network errors
+download_attempts = int(os.getenv('DOWNLOAD_ATTEMPTS', 5))
+
+# keep per country partial sums and a manifest of the daily files in them
+# under output_checkpoint/<input folder>/<country>, later runs only fold in
+# new / changed files
+incremental = os.getenv('INCREMENTAL', 'true').lower() == 'true'
+
+# format of the daily outputs to read, 'netcdf' (output_compressed /
+# output) or 'parquet' (store_daily, see common/store.py)
+input_format = os.getenv('INPUT_FORMAT', 'netcdf')
+# formats of the aggregated output of a country, 'csv' for
+# output_aggregated/<country>.csv and 'parquet' for store_aggregated
+output_formats = os.getenv('OUTPUT_FORMATS', 'csv,parquet').split(',')
+
+# daily outputs, checkpoints and the country mask kept in /tmp across the
+# invocations of a warm container (see common/cache.py), the least
+# recently used are evicted above the budget, 0 disables it. each process
+# has a folder of its own, /tmp/cache/<pid>
+cache_max_bytes = int(os.getenv('CACHE_MAX_MB', 256)) * 1024 ** 2
+
+# float type of the per cell sums, 'float32' halves the memory of the
+# sums and uses compensated summation over the days
+accumulate_dtype = os.getenv('ACCUMULATE_DTYPE', 'float64')
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+import os
+from glob import glob
+from time import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import xarray as xr
+
+# MERRA-2 grid, 0.5 deg latitude by 0.625 deg longitude
+lat_start = -90.
+lat_step = 0.5
+num_lat = 361
+lon_start = -180.
+lon_step = 0.625
+num_lon = 576
+
+# key in the bucket, and file name in the data / tmp folder
+mask_file_name = 'country_mask.npz'
+
+local_data_folder = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../../data'))
+country_data_folder = os.path.join(local_data_folder, 'World_2019', '11111')
+
+
+def grid_index(lat: np.ndarray, lon: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    indices of coordinates on the global grid
+    '''
+    lat_index = np.rint((np.asarray(lat) - lat_start) / lat_step).astype(np.intp)
+    lon_index = np.rint((np.asarray(lon) - lon_start) / lon_step).astype(np.intp)
+    return lat_index, lon_index
+
+
+class CountryMask:
+    '''
+    cells of every country on the global MERRA-2 grid, as flat indices
+    (lat_index * num_lon + lon_index). cells on a border belong to all
+    countries that share them, same as in the per country subsets.
+
+    the cells are the whole grid of the per country subset, so a country
+    has the same rows as in the per country mode. the cells the subset
+    has no data for (valid False) sum to 0 there, and are 0 here too
+    '''
+
+    def __init__(self, countries: List[str], cells: List[np.ndarray],
+                 valid: Optional[List[np.ndarray]] = None):
+        self.countries = countries
+        self.cells = dict(zip(countries, cells))
+        if valid is None:
+            valid = [np.ones(len(country_cells), dtype=bool) for country_cells in cells]
+        self.valid = dict(zip(countries, valid))
+
+    def country_cells(self, country_name: str) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        @returns lat_index, lon_index: np.ndarray, the cells of the country
+        '''
+        return np.divmod(self.cells[country_name], num_lon)
+
+    def save(self, file_path: str) -> None:
+        offsets = np.cumsum([0] + [len(self.cells[name]) for name in self.countries])
+        np.savez_compressed(file_path, countries=np.array(self.countries),
+                            cells=np.concatenate([self.cells[name] for name in self.countries]),
+                            valid=np.concatenate([self.valid[name] for name in self.countries]),
+                            offsets=offsets)
+
+    @classmethod
+    def load(cls, file_path: str):
+        with np.load(file_path) as data:
+            offsets = data['offsets']
+            cells = data['cells']
+            # masks saved without it only have the cells with data
+            valid = data['valid'] if 'valid' in data else np.ones(len(cells), dtype=bool)
+            ranges = list(zip(offsets[:-1], offsets[1:]))
+            return cls(data['countries'].tolist(),
+                       [cells[start:end] for start, end in ranges],
+                       [valid[start:end] for start, end in ranges])
+
+
+def country_cells(file_path: str) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    all cells of the grid of a per country subset, the rows of the per
+    country outputs, and whether the subset has data for them
+
+    @returns cells, valid: np.ndarray, sorted flat indices and booleans
+    '''
+    with xr.open_dataset(file_path) as ds:
+        valid = ds['T2M'].isel(time=0).transpose('lat', 'lon').notnull().values
+        lat_index, lon_index = grid_index(ds['lat'].values, ds['lon'].values)
+    lat_index, lon_index = np.meshgrid(lat_index, lon_index, indexing='ij')
+    cells = (lat_index * num_lon + lon_index).ravel()
+    order = np.argsort(cells)
+    return cells[order], valid.ravel()[order]
+
+
+def build_mask(data_folder: str = country_data_folder) -> CountryMask:
+    '''
+    builds the mask from one daily file of every country folder
+    '''
+    countries = sorted(name for name in os.listdir(data_folder)
+                       if os.path.isdir(os.path.join(data_folder, name)))
+    cells: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+    for country_name in countries:
+        file_paths = sorted(glob(os.path.join(data_folder, country_name, '*.nc4')))
+        if len(file_paths) == 0:
+            print(f'no files for {country_name}')
+            continue
+        cells[country_name] = country_cells(file_paths[0])
+    return CountryMask(list(cells), [cells[name][0] for name in cells],
+                       [cells[name][1] for name in cells])
+
+
+def scatter(sums: Dict[str, np.ndarray], lat: np.ndarray, lon: np.ndarray,
+            mask: CountryMask, country_name: str) -> Optional[Dict[str, np.ndarray]]:
+    '''
+    values of a country's cells from (lat, lon) arrays on the global grid
+    (or a part of it)
+
+    @returns values: lat, lon and each variable as flat arrays, None if
+             the arrays do not cover the country
+    '''
+    lat_index, lon_index = mask.country_cells(country_name)
+    grid_lat, grid_lon = grid_index(lat, lon)
+    # position of the country's cells in the arrays
+    lat_position = np.searchsorted(grid_lat, lat_index)
+    lon_position = np.searchsorted(grid_lon, lon_index)
+    if np.any(lat_position >= len(grid_lat)) or np.any(lon_position >= len(grid_lon)) \
+            or np.any(grid_lat[np.minimum(lat_position, len(grid_lat) - 1)] != lat_index) \
+            or np.any(grid_lon[np.minimum(lon_position, len(grid_lon) - 1)] != lon_index):
+        return None
+
+    values = {'lat': lat[lat_position], 'lon': lon[lon_position]}
+    valid = mask.valid[country_name]
+    for name, array in sums.items():
+        values[name] = np.where(valid, array[lat_position, lon_position], 0)
+    return values
+
+
+if __name__ == '__main__':
+    import sys
+    from dotenv import load_dotenv
+
+    # common/ is two folders up
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+    from common.storage import get_storage
+
+    load_dotenv()
+
+    start_time = time()
+    mask = build_mask()
+    file_path = os.path.join(local_data_folder, mask_file_name)
+    mask.save(file_path)
+    num_cells = sum(len(cells) for cells in mask.cells.values())
+    print(f'saved mask of {len(mask.countries)} countries, {num_cells} cells '
+          f'to {file_path}, time {time() - start_time:.1f}s')
+
+    # in place with STORAGE=local
+    get_storage().upload(file_path, mask_file_name)
+    print('uploaded', mask_file_name)
@@ -1,104 +1,511 @@
 #!/usr/bin/env python3
-from functools import reduce
 import json
 import os
-from time import time
-from typing import List
+import sys
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep, time
+from typing import Dict, List, Optional, Tuple
 
 import pandas as pd
 import xarray as xr
-import boto3
+from botocore.exceptions import ClientError, BotoCoreError
 
 from dotenv import load_dotenv
 
-load_dotenv()
-
-s3 = boto3.client('s3')
+# common/ is next to main.py in the image, two folders up locally
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from common import store  # noqa: E402
+from common.cache import ObjectCache, process_folder  # noqa: E402
+from common.storage import get_storage, ObjectNotFound  # noqa: E402
+from common.catalog import event_key  # noqa: E402
+from common import metrics  # noqa: E402
+from config import download_workers, download_attempts, incremental, \
+    input_format, output_formats, accumulate_dtype, cache_max_bytes  # noqa: E402
+from accumulator import GridAccumulator  # noqa: E402
+from country_mask import CountryMask, mask_file_name, scatter  # noqa: E402
 
-s3_bucket = 'tori-calculate-wind-power'
+load_dotenv()
 
-local = False
+# the bucket, or data/ with STORAGE=local (common/storage.py). one client
+# shared by all download threads, with a connection per thread
+storage = get_storage(max_pool_connections=download_workers, max_attempts=download_attempts)
 
 tmp_folder = '/tmp'
 
 input_main = 'output'
 input_compressed = 'output_compressed'
 output_folder = 'output_aggregated'
+checkpoint_folder = 'output_checkpoint'
+# daily outputs of the global grid mode, one file per day
+input_global = 'output_global'
+# daily outputs of the turbine / hub height sweep, with a config dim
+input_sweep = 'output_sweep'
+output_sweep_folder = 'output_aggregated_sweep'
+checkpoint_sweep_folder = 'output_checkpoint_sweep'
+
+# extensions of the daily outputs, netcdf and the parquet store
+daily_extensions = ('.nc4', store.file_extension)
+# hours summed in a daily output, for the cell x hour count of the spans
+hours_per_day = 24
+
+# objects downloaded by earlier invocations of this container
+cache = ObjectCache(process_folder(os.path.join(tmp_folder, 'cache')), cache_max_bytes)
+
+
+def get_input_folder(compressed: bool = True, file_format: str = input_format) -> str:
+    if file_format == 'parquet':
+        if not compressed:
+            raise ValueError('the parquet store only has the compressed outputs')
+        return store.daily_folder
+    if file_format != 'netcdf':
+        raise ValueError(f'invalid input format {file_format}')
+    return input_compressed if compressed else input_main
+
+
+def is_transient_error(error: Exception) -> bool:
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code', '')
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return status >= 500 or code in ('Throttling', 'SlowDown', 'RequestTimeout')
+    # connection resets, timeouts, incomplete reads
+    return isinstance(error, (BotoCoreError, ConnectionError, TimeoutError))
+
+
+def download_object(key: str, file_path: str, version_id: Optional[str] = None,
+                    attempts: int = download_attempts) -> dict:
+    '''
+    downloads one object (or one version of it), retrying transient
+    errors with exponential backoff
+
+    @returns info: dict with etag, version_id and size of what was downloaded
+    '''
+    with metrics.span('download', file=key) as record:
+        for attempt in range(attempts):
+            try:
+                info = storage.download(key, file_path, version_id)
+                record.update(bytes=info['size'], attempts=attempt + 1)
+                return info
+            except Exception as error:
+                if attempt == attempts - 1 or not is_transient_error(error):
+                    raise
+                print(f'retry download {key}, attempt {attempt + 1}: {error}')
+                sleep(min(2 ** attempt * 0.1, 5))
+
+
+def fetch_objects(objects: List[Tuple[str, Optional[str], Optional[str]]],
+                  num_workers: int = download_workers) -> List[dict]:
+    '''
+    cached files of (key, etag, version id) tuples, downloading the ones
+    that are not cached with that etag over a thread pool. the entries
+    are pinned, release them once they are read
+
+    @returns entries: List[dict], see ObjectCache.get
+    '''
+    start_time = time()
+    hits = cache.hits
+
+    # the download spans of the threads have the country of this one
+    @metrics.bind
+    def fetch(key: str, etag: Optional[str], version_id: Optional[str]) -> dict:
+        return cache.fetch(key, etag, lambda file_path: download_object(
+            key, file_path, version_id), pin=True)
+
+    with ThreadPoolExecutor(max_workers=num_workers) as pool, \
+            metrics.span('download_wait', files=len(objects)):
+        entries = list(pool.map(lambda args: fetch(*args), objects))
+
+    duration = time() - start_time
+    num_bytes = sum(entry['size'] for entry in entries)
+    print(f'fetched {len(entries)} files, {cache.hits - hits} from the cache, '
+          f'{num_bytes / 1024 ** 2:.1f} MB, {len(entries) / max(duration, 1e-9):.1f} files/s')
+
+    return entries
+
+
+def list_files(remote_folder: str) -> Dict[str, str]:
+    '''
+    @returns etags: Dict[str, str], etag of every daily output in the folder
+    '''
+    # Niger is a prefix of Nigeria
+    prefix = remote_folder.rstrip('/') + '/'
+    with metrics.span('list', folder=remote_folder) as record:
+        etags = {content['key']: content['etag'] for content in storage.list(prefix)
+                 if os.path.splitext(content['key'])[1] in daily_extensions}
+        record['objects'] = len(etags)
+    return etags
+
+
+def download_files(country_name: str, compressed: bool = True,
+                   num_workers: int = download_workers, input_folder: Optional[str] = None) -> str:
+    if input_folder is None:
+        input_folder = get_input_folder(compressed)
+    remote_folder = os.path.join(input_folder, country_name)
+
+    local_folder = storage.local_path(remote_folder)
+    if local_folder is not None:
+        # the daily outputs are read in place
+        return local_folder
+
+    data_folder = os.path.join(tmp_folder, input_folder, country_name)
+    # a warm container has the folder of an earlier invocation, the files
+    # are linked from the cache again if they did not change
+    shutil.rmtree(data_folder, ignore_errors=True)
 
-local_data_folder = os.path.abspath(
-    os.path.join(os.path.dirname(__file__), '../../data'))
+    print('start download files')
 
+    os.makedirs(data_folder)
+    etags = list_files(remote_folder)
+
+    try:
+        entries = fetch_objects([(key, etag, None) for key, etag in etags.items()],
+                                num_workers)
+        for key, entry in zip(etags, entries):
+            cache.link(entry, os.path.join(data_folder, os.path.basename(key)))
+            cache.release(entry['path'])
+    except Exception:
+        # do not leave a partial folder behind, it would be reused
+        shutil.rmtree(data_folder, ignore_errors=True)
+        raise
 
-def get_s3_keys(prefix='') -> List[str]:
-    paginator = s3.get_paginator('list_objects_v2')
-    for page in paginator.paginate(Bucket=s3_bucket, Prefix=prefix):
-        for content in page.get('Contents', ()):
-            yield content['Key']
+    return data_folder
 
 
-def download_files(country_name: str, local: bool = False, compressed: bool = True) -> None:
-    data_folder = local_data_folder if local else tmp_folder
-    input_folder = input_compressed if compressed else input_main
+def open_daily(file_path: str) -> xr.Dataset:
+    '''
+    opens a daily output, netcdf or parquet
+    '''
+    if os.path.splitext(file_path)[1] == store.file_extension:
+        return store.table_to_dataset(store.read_table(file_path))
+    return xr.open_dataset(file_path)
+
+
+def add_file(accumulator: GridAccumulator, file_path: str, sign: float = 1,
+             key: Optional[str] = None) -> None:
+    '''
+    adds (sign 1) or subtracts (sign -1) one daily output, with an open
+    and a sum span
+    '''
+    with metrics.context(file=key or os.path.basename(file_path)):
+        with metrics.span('open') as record:
+            ds_wind = open_daily(file_path)
+            record['cells_hours'] = metrics.cells_hours(ds_wind.sizes) * hours_per_day
+        metrics.update(cells_hours=record['cells_hours'])
+        with ds_wind, metrics.span('sum', sign=sign):
+            accumulator.add(ds_wind, sign)
+
+
+def sum_files(folder_path: str) -> GridAccumulator:
+    '''
+    sums the daily outputs in the folder, one file at a time into a
+    single accumulator on the (lat, lon) grid
+    '''
+    print('read data')
 
-    data_folder = os.path.join(
-        data_folder, input_folder, country_name)
-    if os.path.isdir(data_folder):
-        return data_folder
+    accumulator = GridAccumulator(accumulate_dtype)
+    for file_name in sorted(os.listdir(folder_path)):
+        # a folder read in place can have files of other writers
+        if os.path.splitext(file_name)[1] not in daily_extensions:
+            continue
+        add_file(accumulator, os.path.join(folder_path, file_name))
 
-    print('start download files')
+    return accumulator
 
-    os.makedirs(data_folder)
-    remote_folder = os.path.join(input_folder, country_name)
-    keys = get_s3_keys(remote_folder)
 
+def read_data(folder_path: str) -> pd.DataFrame:
+    return sum_files(folder_path).to_dataframe()
+
+
+def sweep_dataframe(accumulator: GridAccumulator) -> pd.DataFrame:
+    '''
+    sums of the sweep indexed by (turbine_type, hub_height, lat, lon)
+    '''
+    df = accumulator.to_dataframe().reset_index()
+    return df.drop(columns='config') \
+        .set_index(['turbine_type', 'hub_height', 'lat', 'lon']).sort_index()
+
+
+def save_s3(df: pd.DataFrame, country_name: str,
+            file_formats: List[str] = output_formats,
+            csv_folder: str = output_folder) -> List[dict]:
+    '''
+    saves the sums of the country in every format of file_formats
+
+    @returns records: List[dict], key, size and etag of the outputs
+    '''
+    records = []
+    for file_format in file_formats:
+        with metrics.span('write', format=file_format, cells=len(df)):
+            if file_format == 'csv':
+                output_file_path = os.path.join(tmp_folder, f'{country_name}.csv')
+                df.to_csv(output_file_path)
+                remote_output_file_path = os.path.join(
+                    csv_folder, os.path.basename(output_file_path))
+            elif file_format == 'parquet':
+                output_file_path = os.path.join(tmp_folder,
+                                                f'{country_name}{store.file_extension}')
+                store.write_table(store.dataframe_to_table(df), output_file_path)
+                remote_output_file_path = store.aggregated_key(country_name)
+            else:
+                raise ValueError(f'invalid output format {file_format}')
+
+        with metrics.span('upload', file=remote_output_file_path) as record:
+            info = storage.upload(output_file_path, remote_output_file_path)
+            record['bytes'] = info['size']
+        os.remove(output_file_path)
+
+        records.append({
+            'key': remote_output_file_path,
+            'size': info['size'],
+            'etag': info['etag']
+        })
+
+    return records
+
+
+def write_catalog_event(records: List[dict]) -> None:
+    '''
+    saves the records of the uploaded outputs as one event object, the key
+    starts with the utc time so the catalog can list only new events
+    '''
+    if len(records) == 0:
+        return
+    storage.put(event_key(), json.dumps({'records': records}).encode())
+
+
+def checkpoint_path(country_name: str, input_folder: str,
+                    folder: str = checkpoint_folder) -> str:
+    '''
+    folder of the checkpoint of a country, by input folder, so the sums of
+    the main, compressed and parquet store outputs are kept apart
+    '''
+    return os.path.join(folder, input_folder, country_name)
+
+
+def load_checkpoint(country_name: str, input_folder: str,
+                    folder: str = checkpoint_folder) -> Tuple[Optional[GridAccumulator],
+                                                              Dict[str, dict]]:
+    '''
+    loads the partial sums of a country and the manifest of the daily
+    files (etag and version id) they contain. the manifest records the
+    etag of the sums object, so a sums / manifest pair that was not
+    written together is not used
+    '''
+    remote_folder = checkpoint_path(country_name, input_folder, folder)
+    sums_key = os.path.join(remote_folder, 'sums.nc')
+    try:
+        manifest = json.loads(storage.read(os.path.join(remote_folder, 'manifest.json')))
+
+        # the sums saved by this container are still cached
+        entry = cache.fetch(sums_key, manifest['sums_etag'], lambda file_path: download_object(
+            sums_key, file_path), pin=True)
+    except ObjectNotFound:
+        return None, {}
+
+    try:
+        if entry['etag'] != manifest['sums_etag']:
+            print('checkpoint sums do not match the manifest')
+            return None, {}
+        with xr.open_dataset(entry['path']) as ds:
+            accumulator = GridAccumulator.from_dataset(ds.load(), accumulate_dtype)
+    finally:
+        cache.release(entry['path'])
+
+    return accumulator, manifest['files']
+
+
+def save_checkpoint(country_name: str, input_folder: str, accumulator: GridAccumulator,
+                    files: Dict[str, dict], folder: str = checkpoint_folder) -> None:
+    remote_folder = checkpoint_path(country_name, input_folder, folder)
+
+    sums_key = os.path.join(remote_folder, 'sums.nc')
+    sums_file_path = cache.part_path()
+    with metrics.span('write', file=sums_key):
+        accumulator.to_dataset().to_netcdf(sums_file_path)
+    # one put, so the etag is the one of these sums
+    with open(sums_file_path, 'rb') as f, metrics.span('upload', file=sums_key) as record:
+        info = storage.put(sums_key, f.read())
+        record['bytes'] = info['size']
+    # the next invocation on this container does not download it
+    cache.put(sums_key, sums_file_path, info['etag'], info['version_id'])
+
+    manifest = {'sums_etag': info['etag'], 'files': files}
+    storage.put(os.path.join(remote_folder, 'manifest.json'), json.dumps(manifest).encode())
+
+
+def fold_files(accumulator: GridAccumulator, objects: List[Tuple[str, str, Optional[str]]],
+               sign: float, num_workers: int = download_workers) -> List[dict]:
+    '''
+    fetches the (key, etag, version id) files and adds (sign 1) or
+    subtracts (sign -1) them, one at a time. they are fetched num_workers
+    at a time and released once added, so /tmp holds at most that many
+    besides the cache budget
+
+    @returns entries: List[dict], etag and version id of the files
+    '''
+    all_entries = []
+    for start in range(0, len(objects), num_workers):
+        chunk = objects[start:start + num_workers]
+        entries = fetch_objects(chunk, num_workers)
+        for i, ((key, _etag, _version_id), entry) in enumerate(zip(chunk, entries)):
+            try:
+                add_file(accumulator, entry['path'], sign, key)
+            except Exception:
+                for other_entry in entries[i + 1:]:
+                    cache.release(other_entry['path'])
+                raise
+            finally:
+                cache.release(entry['path'])
+        all_entries += entries
+    return all_entries
+
+
+def read_data_incremental(country_name: str, compressed: bool = True,
+                          sweep: bool = False) -> pd.DataFrame:
+    '''
+    updates the checkpoint of the country with the daily files that are
+    new or changed since it was written, and backs out the versions they
+    superseded. falls back to summing all files if there is no checkpoint,
+    or if an old version can not be fetched (bucket without versioning).
+    the sweep outputs have their own checkpoints
+    '''
     start_time = time()
-    for key in keys:
-        if os.path.splitext(key)[1] == '.nc4':
-            file_path = os.path.join(data_folder, os.path.basename(key))
-            s3.download_file(s3_bucket, key, file_path)
+    input_folder = input_sweep if sweep else get_input_folder(compressed)
+    folder = checkpoint_sweep_folder if sweep else checkpoint_folder
+    remote_folder = os.path.join(input_folder, country_name)
 
-    print('file download time:', time() - start_time)
+    current = list_files(remote_folder)
+    accumulator, files = load_checkpoint(country_name, input_folder, folder)
 
-    return data_folder
+    superseded = [key for key, info in files.items()
+                  if current.get(key) != info['etag']]
+    if accumulator is None or any(files[key].get('version_id') in (None, 'null')
+                                  for key in superseded):
+        print('no usable checkpoint, sum all files')
+        accumulator, files, superseded = GridAccumulator(accumulate_dtype), {}, []
 
+    changed = [key for key, etag in current.items()
+               if key not in files or files[key]['etag'] != etag]
+    print(f'checkpoint has {len(files)} files, {len(changed)} new or changed, '
+          f'{len(superseded)} superseded')
 
-def read_data(folder_path: str) -> pd.DataFrame:
-    start_time = time()
-    print('read data')
+    # back out the old versions, then add the new ones. the old versions
+    # are still cached if this container folded them in
+    fold_files(accumulator, [(key, files[key]['etag'], files[key]['version_id'])
+                             for key in superseded], -1)
+    for key in superseded:
+        del files[key]
 
-    data: List[pd.DataFrame] = []
-    for file_name in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, file_name)
-        with xr.open_mfdataset(file_path) as ds_wind:
-            df = ds_wind.to_dataframe()
-            data.append(df)
+    infos = fold_files(accumulator, [(key, current[key], None) for key in changed], 1)
+    for key, info in zip(changed, infos):
+        files[key] = {'etag': info['etag'], 'version_id': info['version_id']}
 
-    df = reduce(lambda a, b: a.add(b, fill_value=0), data)
+    if len(changed) > 0 or len(superseded) > 0:
+        save_checkpoint(country_name, input_folder, accumulator, files, folder)
 
     print('time read data', time() - start_time)
 
-    return df
+    return sweep_dataframe(accumulator) if sweep else accumulator.to_dataframe()
+
+
+def get_mask() -> CountryMask:
+    '''
+    the country mask, parsed once per container as long as its etag does
+    not change
+    '''
+    local_path = storage.local_path(mask_file_name)
+    if local_path is not None:
+        return CountryMask.load(local_path)
 
+    etag = storage.head(mask_file_name)['etag']
+    return cache.parse(mask_file_name, etag, CountryMask.load,
+                       lambda file_path: download_object(mask_file_name, file_path))
 
-def save_s3(df: pd.DataFrame, country_name: str) -> None:
-    output_file_path = os.path.join(tmp_folder, f'{country_name}.csv')
-    df.to_csv(output_file_path)
 
-    remote_output_file_path = os.path.join(
-        output_folder, os.path.basename(output_file_path))
+def save_countries(accumulator: GridAccumulator, mask: CountryMask,
+                   num_workers: int = download_workers) -> List[dict]:
+    '''
+    splits the sums on the global grid into the countries of the mask and
+    saves one output per country, same format as save_s3 of a country
 
-    s3.upload_file(output_file_path, s3_bucket, remote_output_file_path)
+    @returns records: List[dict], see save_s3
+    '''
+    totals = accumulator.totals()
 
+    def save_country(country_name: str) -> List[dict]:
+        values = scatter(totals, accumulator.lat, accumulator.lon,
+                         mask, country_name)
+        if values is None:
+            print(f'the daily outputs do not cover {country_name}')
+            return []
+        df = pd.DataFrame(values).set_index(['lat', 'lon']).sort_index()
+        with metrics.context(country=country_name):
+            return save_s3(df, country_name)
+
+    start_time = time()
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        records = [record for country_records in pool.map(save_country, mask.countries)
+                   for record in country_records]
+    print(f'saved {len(records)} outputs, time {time() - start_time:.1f}s')
+
+    return records
+
+
+def reduce_global() -> None:
+    '''
+    sums the daily outputs of the global grid mode once, then saves the
+    sums of every country with the country mask
+    '''
+    local_folder = storage.local_path(input_global)
+    if local_folder is not None:
+        # the daily outputs are read in place
+        accumulator = sum_files(local_folder)
+    else:
+        # a year of the globe does not fit in /tmp, the files are streamed
+        # through the cache into the sums
+        accumulator = GridAccumulator(accumulate_dtype)
+        etags = list_files(input_global)
+        fold_files(accumulator, [(key, etag, None) for key, etag in sorted(etags.items())], 1)
+    records = save_countries(accumulator, get_mask())
+    write_catalog_event(records)
+
+
+def lambda_handler(event, _context=None):
+    metrics.start_run(getattr(_context, 'aws_request_id', None))
+    if event.get('global', False):
+        reduce_global()
+        metrics.end_run(function='reduce', country=None)
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'message': 'done processing for the global grid'
+            })
+        }
 
-def lambda_handler(event, _context=None, local=False):
     country_name = event['country']
     compressed = 'compressed' in event and event['compressed']
-
-    folder_path = download_files(country_name, local, compressed=compressed)
-    df = read_data(folder_path)
-    print(df.head(5))
-    print(df.shape)
-    save_s3(df, country_name)
+    # sums of the turbine / hub height sweep, csv only
+    sweep = event.get('sweep', False)
+
+    with metrics.context(country=country_name):
+        # the checkpoints need the older versions of s3
+        if event.get('incremental', incremental) and not storage.local:
+            df = read_data_incremental(country_name, compressed=compressed, sweep=sweep)
+        elif sweep:
+            folder_path = download_files(country_name, input_folder=input_sweep)
+            df = sweep_dataframe(sum_files(folder_path))
+        else:
+            folder_path = download_files(country_name, compressed=compressed)
+            df = read_data(folder_path)
+        print(df.head(5))
+        print(df.shape)
+        if sweep:
+            records = save_s3(df, country_name, ['csv'], output_sweep_folder)
+        else:
+            records = save_s3(df, country_name)
+    write_catalog_event(records)
+    print(cache.stats())
+    metrics.end_run(function='reduce', country=country_name)
 
     return {
         'statusCode': 200,
@@ -111,4 +518,4 @@ def lambda_handler(event, _context=None, local=False):
 if __name__ == '__main__':
     lambda_handler({
         'country': 'Germany'
-    }, local=True)
+    })
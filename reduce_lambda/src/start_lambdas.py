@@ -1,38 +1,126 @@
 #!/usr/bin/env python3
 import os
-from typing import List
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import time
+from typing import Dict, List
 
 import boto3
 import json
 import yaml
 
 from dotenv import load_dotenv
-from click import confirm
+from click import confirm, prompt
 from tqdm import tqdm
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from common.catalog import Catalog  # noqa: E402
+from common.store import aggregated_folder  # noqa: E402
+from common.storage import get_storage  # noqa: E402
+from config import output_formats  # noqa: E402
+
 load_dotenv()
 
-s3 = boto3.client('s3')
+# the bucket, or data/ with STORAGE=local, which only local runs can read
+storage = get_storage()
 lmda = boto3.client('lambda')
 
 lambda_function = 'tori-reduce-wind-power'
-s3_bucket = 'tori-calculate-wind-power'
 output_folder = 'output_aggregated'
+# sums of the turbine / hub height sweep, see main.sweep_dataframe
+output_sweep_folder = 'output_aggregated_sweep'
 
 data_folder = os.path.abspath(os.path.join(
     os.path.dirname(__file__), '../../data', 'World_2019', '11111'))
 
 
-def get_s3_keys(prefix='') -> List[str]:
-    paginator = s3.get_paginator('list_objects_v2')
-    for page in tqdm(paginator.paginate(Bucket=s3_bucket, Prefix=prefix)):
-        for content in page.get('Contents', ()):
-            yield content['Key']
+def run_local_country(country_name: str, compressed: bool, sweep: bool = False) -> None:
+    '''
+    reduces one country through lambda_handler in a worker process, with
+    the storage of STORAGE
+    '''
+    from main import lambda_handler
+    lambda_handler({
+        'country': country_name,
+        'compressed': compressed,
+        'sweep': sweep
+    })
+
+
+def run_local_countries(country_names: List[str], compressed: bool, num_workers: int,
+                        sweep: bool = False) -> List[Dict[str, str]]:
+    '''
+    reduces the countries on a local process pool, showing progress and
+    throughput, and prints a summary of the countries that failed
+
+    @returns failed: List[Dict[str, str]], the countries that failed with the error
+    '''
+    failed: List[Dict[str, str]] = []
+    start_time = time()
+
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        futures = {pool.submit(run_local_country, country_name, compressed,
+                               sweep): country_name
+                   for country_name in country_names}
+        with tqdm(total=len(country_names), unit='country') as progress:
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as error:
+                    failed.append({'country': futures[future], 'error': repr(error)})
+                progress.update()
+                progress.set_postfix(
+                    countries_per_s=f'{progress.n / (time() - start_time):.2f}',
+                    failed=len(failed))
+
+    duration = time() - start_time
+    print(f'reduced {len(country_names)} countries with {num_workers} workers, '
+          f'{duration:.1f}s, {len(country_names) / duration:.2f} countries/s')
+
+    if len(failed) > 0:
+        print(f'{len(failed)} of {len(country_names)} countries failed:')
+        for failure in sorted(failed, key=lambda failure: failure['country']):
+            print(f"  {failure['country']}: {failure['error']}")
+    return failed
+
+
+def run_global(run_local=False) -> None:
+    '''
+    reduces the outputs of the global grid mode, one lambda sums all days
+    and saves every country of the country mask (country_mask.py)
+    '''
+    run_local = confirm('Run locally?', default=run_local or storage.local)
+    if not run_local and storage.local:
+        raise ValueError('the lambdas can not read the local storage, run locally')
+    if not confirm('Do you want to continue?', default=True):
+        exit()
+
+    payload = json.dumps({'global': True})
+    if run_local:
+        from main import lambda_handler
+        response = lambda_handler(json.loads(payload))
+    else:
+        response = lmda.invoke(
+            FunctionName=lambda_function,
+            InvocationType='Event',
+            Payload=payload
+        )
+    print(response)
 
 
 def main(use_filesystem=True, country_names=[], exclude_country_names=[],
          check_country_complete=False, max_lambdas=-1, run_local=False,
-         compressed=False):
+         compressed=False, num_workers=os.cpu_count(), use_catalog=True, refresh_catalog=False,
+         global_grid=False, sweep=False):
+    '''
+    sweep reduces the outputs of the turbine / hub height sweep of the
+    calculate lambda to output_aggregated_sweep. a local run returns the
+    countries that failed, see run_local_countries
+    '''
+    if global_grid:
+        run_global(run_local)
+        return
+
     country_names = set(country_names)
     exclude_country_names = set(exclude_country_names)
 
@@ -60,17 +148,31 @@ def main(use_filesystem=True, country_names=[], exclude_country_names=[],
 
     if check_country_complete:
         print('check completed countries...')
-        new_all_countries = []
-        output_keys = list(get_s3_keys(output_folder))
-        all_output_countries = {os.path.splitext(os.path.basename(key))[
-            0] for key in output_keys}
+        # save_s3 writes the formats in order, the last one marks a complete country
+        completed_folder = output_folder if output_formats[-1] == 'csv' else aggregated_folder
+        if sweep:
+            completed_folder = output_sweep_folder
+        if use_catalog:
+            catalog = Catalog()
+            catalog.update(storage, [completed_folder], refresh=refresh_catalog)
+        else:
+            # list the bucket every time, into a catalog that is not saved
+            catalog = Catalog(':memory:')
+            catalog.refresh(storage, completed_folder)
+        all_output_countries = set(catalog.countries(completed_folder))
+        catalog.close()
 
         all_countries = [country_name for country_name in all_countries
                          if country_name not in all_output_countries]
 
     all_countries.sort()
 
-    run_local = confirm('Run locally?', default=run_local)
+    run_local = confirm('Run locally?', default=run_local or storage.local)
+    if not run_local and storage.local:
+        raise ValueError('the lambdas can not read the local storage, run locally')
+    if run_local:
+        num_workers = prompt('Number of local workers',
+                             type=int, default=num_workers)
 
     print('num countries / lambdas:', len(all_countries))
 
@@ -84,22 +186,23 @@ def main(use_filesystem=True, country_names=[], exclude_country_names=[],
     if not confirm('Do you want to continue?', default=True):
         exit()
 
+    if max_lambdas != -1:
+        all_countries = all_countries[:max_lambdas]
+
     if run_local:
-        from main import lambda_handler
+        return run_local_countries(all_countries, compressed, num_workers, sweep)
 
     for i, country_name in enumerate(all_countries):
         payload = json.dumps({
             'country': country_name,
-            'compressed': compressed
+            'compressed': compressed,
+            'sweep': sweep
         })
-        if run_local:
-            response = lambda_handler(json.loads(payload), local=run_local)
-        else:
-            response = lmda.invoke(
-                FunctionName=lambda_function,
-                InvocationType='Event',
-                Payload=payload
-            )
+        response = lmda.invoke(
+            FunctionName=lambda_function,
+            InvocationType='Event',
+            Payload=payload
+        )
         print(response)
 
         if i == max_lambdas - 1:
@@ -107,6 +210,10 @@ def main(use_filesystem=True, country_names=[], exclude_country_names=[],
 
 
 if __name__ == '__main__':
-    main(check_country_complete=True, compressed=True,
-         use_filesystem=False,
-         run_local=False)
+    failed = main(check_country_complete=True, compressed=True,
+                  use_filesystem=False,
+                  run_local=False) or []
+
+    # a local run with failed countries exits with an error, for cron and ci
+    if len(failed) > 0:
+        sys.exit(f'{len(failed)} countries failed')